@@ -15,7 +15,7 @@ def fix_doctor_records():
         from bson import ObjectId
         
         # 获取所有医生记录
-        doctors = list(mongo_dao._MongoDao__db["doctors"].find({}))
+        doctors = mongo_dao.find("doctors", {})
         print(f"找到 {len(doctors)} 个医生记录")
         
         updated_count = 0
@@ -29,7 +29,7 @@ def fix_doctor_records():
             # 添加current_consultation_count字段
             if "current_consultation_count" not in doctor:
                 # 计算当前咨询数量
-                current_count = mongo_dao._MongoDao__db["consultations"].count_documents({
+                current_count = mongo_dao.count("consultations", {
                     "assigned_doctor_id": doctor_id,
                     "status": {"$in": ["in_progress", "paid"]}
                 })
@@ -59,7 +59,8 @@ def fix_doctor_records():
             
             # 执行更新
             if updates:
-                mongo_dao._MongoDao__db["doctors"].update_one(
+                mongo_dao.update_one(
+                    "doctors",
                     {"_id": ObjectId(doctor_id)},
                     {"$set": updates}
                 )
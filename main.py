@@ -5,29 +5,54 @@
 @Date: 2025/10/13
 """
 
-from fastapi import FastAPI, Request, HTTPException, Depends, status, Response, UploadFile, File, Form
+from fastapi import FastAPI, Request, HTTPException, Depends, status, Response, UploadFile, File, Form, WebSocket, WebSocketDisconnect, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
-from google.oauth2 import id_token
-from google.auth.transport import requests
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from bson import ObjectId
 from pydantic import BaseModel
 from dotenv import load_dotenv
 from typing import Optional, Dict, Any, List
 import os
+import json
+import asyncio
+import hashlib
+from datetime import datetime
 from functools import wraps
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.interval import IntervalTrigger
-from services.user_service import user_service
-from services.consultation_service import consultation_service
-from services.payment_service import payment_service
-from services.doctor_service import doctor_service
+from services.user_service import async_user_service
+from services.consultation_service import consultation_service, async_consultation_service
+from services.payment_service import async_payment_service, QR_CONTENT_TYPES
+from services.doctor_service import async_doctor_service
+from services.assignment_engine import assignment_engine
+from services.doctor_load_index import doctor_load_index
+from services.chat_hub import chat_hub
+from services.attachment_service import attachment_service
+from services.preview_worker import preview_worker
+from services.payment_watcher import payment_watcher
+from services.earnings_service import async_earnings_service, parse_range, MAX_SERIES_DAYS, EXPORT_COLUMNS
+from services.index_service import ensure_all_indexes, collscan_report
+from utils.mongo_dao import query_stats
+from utils.session_store import session_store, SESSION_TTL_SECONDS
+from utils.pagination import InvalidCursor, NEXT_CURSOR_HEADER, PREV_CURSOR_HEADER
+from utils.etag import ETagSigner
+from utils.blob_store import is_blob_id, content_disposition
+from utils.file_response import RangeFileResponse
+from utils.previews import PREVIEW_SUFFIX, PREVIEW_CONTENT_TYPE
+from utils.uploads import UploadTooLarge, RequestSizeLimitMiddleware, UPLOAD_MAX_REQUEST_BYTES
+from utils.session_token import sign_session_token, verify_session_token
+from utils.google_auth import verify_google_id_token, google_cert_cache
+from utils.tabular_export import export_stream, export_formats, EXPORT_CONTENT_TYPES
+from utils.leader_lease import background_lease
 from models.user import UserInDB, UserCreate, UserResponse
 from models.doctor import DoctorInDB, DoctorCreate, DoctorResponse, DoctorEarnings, DoctorStatus
 from models.consultation import (
     ConsultationCreate, ConsultationResponse, PaymentOrderResponse,
-    ChatMessageResponse, ConsultationMode, DoctorLevel
+    ChatMessageResponse, ConsultationMode, DoctorLevel, ConsultationStatus
 )
 
 load_dotenv(".env")
@@ -46,42 +71,70 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, PREV_CURSOR_HEADER],
 )
+# 请求体在接收过程中限制大小（附件总大小之外留出表单字段的余量）
+app.add_middleware(RequestSizeLimitMiddleware, max_bytes=UPLOAD_MAX_REQUEST_BYTES + 1024 * 1024)
 
 # 配置
 SECRET_KEY = os.getenv('SECRET_KEY')
 GOOGLE_CLIENT_ID = os.getenv('GOOGLE_CLIENT_ID')
+# 设为0可关闭启动时的索引检查（改用 python -m services.index_service 单独执行）
+ENSURE_INDEXES_ON_STARTUP = os.getenv('ENSURE_INDEXES_ON_STARTUP', '1') == '1'
+# 医生负载索引与数据库对齐的间隔（分钟）
+DOCTOR_LOAD_RECONCILE_MINUTES = int(os.getenv('DOCTOR_LOAD_RECONCILE_MINUTES', 5))
+# 到期的待支付订单每隔多少秒批量标记为过期
+PAYMENT_EXPIRY_SECONDS = int(os.getenv('PAYMENT_EXPIRY_SECONDS', 60))
+# 管理员邮箱（逗号分隔），可访问 /api/admin 下的诊断和导出接口；为空时没有管理员
+ADMIN_EMAILS = {email.strip().lower() for email in os.getenv('ADMIN_EMAILS', '').split(',') if email.strip()}
+# SSE连接的心跳间隔（秒），防止代理断开空闲连接
+SSE_HEARTBEAT_SECONDS = int(os.getenv('SSE_HEARTBEAT_SECONDS', 15))
+# 内容永不变化的资源（以内容哈希为ID的附件、订单的支付二维码），浏览器可长期缓存（private：仅限登录者本人的浏览器）
+IMMUTABLE_CACHE_CONTROL = "private, max-age=31536000, immutable"
+# 可在浏览器中直接打开的附件类型，其他类型（html、svg等）一律作为下载，避免在本站域名下执行
+ATTACHMENT_INLINE_TYPES = ("image/png", "image/jpeg", "image/gif", "image/webp", "application/pdf", "text/plain")
 
-# 简单的内存会话存储（生产环境建议使用Redis或数据库）
-sessions: Dict[str, Dict[str, Any]] = {}
+# 会话模式：store - Cookie中是会话ID，数据在会话存储中（后端由 SESSION_BACKEND 选择：memory/mongo/redis）
+#          token - Cookie中是用SECRET_KEY签名的会话令牌，验证时不访问任何共享状态；
+#                  令牌在过期前一直有效，退出登录只清除浏览器Cookie
+SESSION_MODE = os.getenv('SESSION_MODE', 'store')
+
+# 轮询接口的ETag签名（未配置SECRET_KEY时每个进程随机生成，ETag只在本进程内有效）
+etag_signer = ETagSigner(SECRET_KEY or os.urandom(16).hex())
 
 # 创建调度器
 scheduler = AsyncIOScheduler()
 
 async def check_unassigned_consultations():
-    """检查未分配的咨询并尝试分配"""
+    """兜底扫描：把支付成功但未分配的咨询放入分配队列（正常情况下支付成功时已立即分配）"""
     try:
-        print("开始检查未分配的咨询...")
-        # 获取支付成功但未分配的咨询
-        unassigned_consultations = consultation_service.get_unassigned_consultations(limit=20)
-        
-        if not unassigned_consultations:
-            print("没有未分配的咨询")
-            return
-        
-        print(f"发现 {len(unassigned_consultations)} 个未分配的咨询")
-        
-        for consultation in unassigned_consultations:
-            print(f"尝试分配咨询: {consultation['id']}")
-            success = consultation_service.auto_assign_doctor(consultation['id'])
-            if success:
-                print(f"✅ 成功分配咨询: {consultation['id']}")
-            else:
-                print(f"❌ 分配失败，咨询: {consultation['id']}")
-                
+        queued = await assignment_engine.sweep()
+        if queued:
+            print(f"扫描发现 {queued} 个未分配的咨询，已加入分配队列")
     except Exception as e:
         print(f"检查未分配咨询时出错: {e}")
 
+async def run_on_leader(job):
+    """多个worker中只需一个执行的定时任务：只在持有后台任务租约的进程中运行（见 utils.leader_lease）"""
+    if await background_lease.held():
+        await job()
+
+async def reconcile_doctor_load_index():
+    """用一次聚合查询把医生负载索引与数据库对齐"""
+    try:
+        await async_doctor_service.reconcile_load_index()
+    except Exception as e:
+        print(f"医生负载索引对齐失败: {e}")
+
+async def expire_payment_orders():
+    """把到期的待支付订单批量标记为过期（状态接口不再在读取时修改订单）"""
+    try:
+        expired = await async_consultation_service.expire_payment_orders()
+        if expired:
+            print(f"已过期 {expired} 个待支付订单")
+    except Exception as e:
+        print(f"处理过期订单时出错: {e}")
+
 # Pydantic模型
 class GoogleAuthRequest(BaseModel):
     token: str
@@ -122,25 +175,67 @@ def get_session_id(request: Request) -> str:
         session_id = str(uuid.uuid4())
     return session_id
 
-def get_current_user(request: Request) -> Optional[UserInfo]:
+async def get_session_data(request: Request) -> Optional[Dict[str, Any]]:
+    """读取当前请求的会话数据，同一请求内只解析一次"""
+    if hasattr(request.state, "session_data"):
+        return request.state.session_data
+    cookie = request.cookies.get("session_id")
+    session_data = None
+    if cookie:
+        if SESSION_MODE == 'token':
+            session_data = verify_session_token(cookie, SECRET_KEY)
+        else:
+            session_data = await session_store.get(cookie)
+    request.state.session_data = session_data
+    return session_data
+
+async def save_session(request: Request, response: Response, session_data: Dict[str, Any]):
+    """保存会话数据并设置Cookie"""
+    if SESSION_MODE == 'token':
+        cookie = sign_session_token(session_data, SECRET_KEY, SESSION_TTL_SECONDS)
+    else:
+        cookie = get_session_id(request)
+        await session_store.set(cookie, session_data)
+
+    response.set_cookie(
+        key="session_id",
+        value=cookie,
+        max_age=SESSION_TTL_SECONDS,  # 与服务端会话过期时间一致
+        httponly=True,
+        secure=False  # 在HTTPS环境中应设置为True
+    )
+
+async def get_current_user(request: Request) -> Optional[UserInfo]:
     """获取当前登录用户"""
-    session_id = get_session_id(request)
-    session_data = sessions.get(session_id)
+    session_data = await get_session_data(request)
     if session_data and 'user' in session_data:
-        return UserInfo(**session_data['user'])
+        # 会话数据由服务端写入（或已验证签名），无需重新校验
+        return UserInfo.model_construct(**session_data['user'])
     return None
 
-def get_current_doctor(request: Request) -> Optional[DoctorInfo]:
+async def get_current_doctor(request: Request) -> Optional[DoctorInfo]:
     """获取当前登录医生"""
-    session_id = get_session_id(request)
-    session_data = sessions.get(session_id)
+    session_data = await get_session_data(request)
     if session_data and 'doctor' in session_data:
-        return DoctorInfo(**session_data['doctor'])
+        return DoctorInfo.model_construct(**session_data['doctor'])
     return None
 
-def login_required(request: Request):
+def is_admin(user: Optional[UserInfo]) -> bool:
+    """登录用户的邮箱是否在 ADMIN_EMAILS 中"""
+    return bool(user and user.email and user.email.lower() in ADMIN_EMAILS)
+
+async def admin_required(request: Request) -> UserInfo:
+    """管理员接口的权限检查：未登录返回401，非管理员返回403"""
+    user = await get_current_user(request)
+    if not user:
+        raise HTTPException(status_code=401, detail="需要登录")
+    if not is_admin(user):
+        raise HTTPException(status_code=403, detail="需要管理员权限")
+    return user
+
+async def login_required(request: Request):
     """登录验证装饰器"""
-    user = get_current_user(request)
+    user = await get_current_user(request)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -148,9 +243,9 @@ def login_required(request: Request):
         )
     return user
 
-def doctor_login_required(request: Request):
+async def doctor_login_required(request: Request):
     """医生登录验证装饰器"""
-    doctor = get_current_doctor(request)
+    doctor = await get_current_doctor(request)
     if not doctor:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -158,6 +253,54 @@ def doctor_login_required(request: Request):
         )
     return doctor
 
+async def get_chat_participant(connection: Request, consultation_id: str):
+    """
+    咨询的聊天参与者：咨询所属用户或已分配的医生
+    :return: (consultation, sender_type, sender_id)，无权限时返回None
+    """
+    consultation = await async_consultation_service.get_consultation_by_id(consultation_id)
+    if not consultation:
+        return None
+    user = await get_current_user(connection)
+    if user and consultation.user_id == user.id:
+        return consultation, "user", user.id
+    doctor = await get_current_doctor(connection)
+    if doctor and consultation.assigned_doctor_id == doctor.id:
+        return consultation, "doctor", doctor.id
+    return None
+
+async def paginate(response: Response, keyset, fetch, skip: int, limit: int,
+                   after: Optional[str], before: Optional[str]):
+    """
+    执行一次分页查询并在响应头中返回相邻页的游标（X-Next-Cursor / X-Prev-Cursor）
+    :param fetch: async callable(skip, limit, after, before) -> list
+    """
+    try:
+        items = await fetch(skip, limit, after, before)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    response.headers.update(keyset.headers(items, limit, after, before, skip))
+    return items
+
+async def conditional_get(request: Request, consultation_id: str, scope: str):
+    """
+    轮询接口的条件请求：版本号由数据库中的数据派生（各worker一致），未变化时直接返回304，
+    不加载消息/订单，也不再校验权限（ETag的签名绑定了登录身份）
+    :param scope: "messages|..." 或 "payment|..."，第一段决定版本号包含哪些数据
+    :return: (version, scope, 304响应或None)
+    """
+    version = await async_consultation_service.get_poll_version(consultation_id, scope.split("|", 1)[0])
+    scope = f"{scope}|{consultation_id}|{request.url.query}"
+    etag = etag_signer.matches(request.headers.get("if-none-match"), version, scope)
+    if etag:
+        return version, scope, Response(status_code=304, headers={"ETag": etag, "Cache-Control": "private, no-cache"})
+    return version, scope, None
+
+def set_etag(response: Response, version: str, scope: str, valid_until=None):
+    response.headers["ETag"] = etag_signer.make(version, scope, valid_until)
+    # 浏览器每次都带If-None-Match重新验证
+    response.headers["Cache-Control"] = "private, no-cache"
+
 # 路由实现
 @app.get("/", response_class=HTMLResponse)
 async def index(request: Request):
@@ -176,12 +319,8 @@ async def login(request: Request):
 async def auth_google(request: Request, response: Response, auth_data: GoogleAuthRequest):
     """Google OAuth2认证"""
     try:
-        # 验证Google ID token
-        idinfo = id_token.verify_oauth2_token(
-            auth_data.token, 
-            requests.Request(), 
-            GOOGLE_CLIENT_ID
-        )
+        # 验证Google ID token（证书有缓存，验证在线程池中执行）
+        idinfo = await verify_google_id_token(auth_data.token, GOOGLE_CLIENT_ID)
         
         # 创建用户数据
         user_create = UserCreate(
@@ -193,7 +332,7 @@ async def auth_google(request: Request, response: Response, auth_data: GoogleAut
         
         # 保存或更新用户到数据库
         print(f"开始创建/更新用户: {user_create.email}")
-        db_user = user_service.create_user(user_create)
+        db_user = await async_user_service.create_user(user_create)
         
         if not db_user:
             print(f"用户创建失败: {user_create.email}")
@@ -209,21 +348,11 @@ async def auth_google(request: Request, response: Response, auth_data: GoogleAut
             picture=db_user.picture or ""
         )
         
-        # 保存用户信息到会话
-        session_id = get_session_id(request)
-        sessions[session_id] = {
+        # 保存用户信息到会话并设置Cookie
+        await save_session(request, response, {
             'user': user_info.dict(),
             'db_user_id': str(db_user.id)
-        }
-        
-        # 设置Cookie
-        response.set_cookie(
-            key="session_id",
-            value=session_id,
-            max_age=3600 * 24,  # 24小时
-            httponly=True,
-            secure=False  # 在HTTPS环境中应设置为True
-        )
+        })
         
         return AuthResponse(success=True, user=user_info)
         
@@ -242,16 +371,14 @@ async def auth_doctor_google(request: Request, response: Response, auth_data: Go
         else:
             # 否则尝试验证token
             try:
-                idinfo = id_token.verify_oauth2_token(
-                    auth_data.token, 
-                    requests.Request(), 
-                    GOOGLE_CLIENT_ID
-                )
+                idinfo = await verify_google_id_token(auth_data.token, GOOGLE_CLIENT_ID)
             except:
                 # 如果token验证失败，尝试作为访问令牌使用
                 import requests as http_requests
-                user_info_response = http_requests.get(
-                    f'https://www.googleapis.com/oauth2/v2/userinfo?access_token={auth_data.token}'
+                user_info_response = await run_in_threadpool(
+                    http_requests.get,
+                    f'https://www.googleapis.com/oauth2/v2/userinfo?access_token={auth_data.token}',
+                    timeout=10
                 )
                 if user_info_response.status_code == 200:
                     idinfo = user_info_response.json()
@@ -259,12 +386,12 @@ async def auth_doctor_google(request: Request, response: Response, auth_data: Go
                     return AuthResponse(success=False, error="无效的访问令牌")
         
         # 检查是否已存在医生记录
-        existing_doctor = doctor_service.get_doctor_by_google_id(idinfo['sub'])
+        existing_doctor = await async_doctor_service.get_doctor_by_google_id(idinfo['sub'])
         if not existing_doctor:
             return AuthResponse(success=False, error="医生账户不存在，请联系管理员注册")
         
         # 更新医生登录信息
-        updated_doctor = doctor_service.update_doctor_login(str(existing_doctor.id))
+        updated_doctor = await async_doctor_service.update_doctor_login(str(existing_doctor.id))
         if not updated_doctor:
             return AuthResponse(success=False, error="医生登录失败")
         
@@ -281,21 +408,11 @@ async def auth_doctor_google(request: Request, response: Response, auth_data: Go
             status=updated_doctor.status.value
         )
         
-        # 保存医生信息到会话
-        session_id = get_session_id(request)
-        sessions[session_id] = {
+        # 保存医生信息到会话并设置Cookie
+        await save_session(request, response, {
             'doctor': doctor_info.dict(),
             'db_doctor_id': str(updated_doctor.id)
-        }
-        
-        # 设置Cookie
-        response.set_cookie(
-            key="session_id",
-            value=session_id,
-            max_age=3600 * 24,  # 24小时
-            httponly=True,
-            secure=False  # 在HTTPS环境中应设置为True
-        )
+        })
         
         return AuthResponse(success=True, doctor=doctor_info)
         
@@ -315,14 +432,13 @@ async def profile(request: Request, user: UserInfo = Depends(login_required)):
 @app.get("/logout")
 async def logout(request: Request, response: Response):
     """退出登录"""
-    session_id = get_session_id(request)
-    if session_id in sessions:
-        del sessions[session_id]
-    
-    # 清除Cookie
-    response.delete_cookie(key="session_id")
+    if SESSION_MODE != 'token':
+        await session_store.delete(get_session_id(request))
     
-    return RedirectResponse(url="/", status_code=status.HTTP_302_FOUND)
+    # 清除Cookie（需要设置在实际返回的重定向响应上）
+    redirect = RedirectResponse(url="/", status_code=status.HTTP_302_FOUND)
+    redirect.delete_cookie(key="session_id")
+    return redirect
 
 # 医生端路由
 @app.get("/doctor/login", response_class=HTMLResponse)
@@ -370,14 +486,13 @@ async def doctor_earnings(request: Request, doctor: DoctorInfo = Depends(doctor_
 @app.get("/api/user/profile", response_model=UserResponse)
 async def get_user_profile(request: Request, user: UserInfo = Depends(login_required)):
     """获取当前用户详细信息"""
-    session_id = get_session_id(request)
-    session_data = sessions.get(session_id, {})
+    session_data = await get_session_data(request) or {}
     db_user_id = session_data.get('db_user_id')
     
     if not db_user_id:
         raise HTTPException(status_code=404, detail="用户信息未找到")
     
-    db_user = user_service.get_user_by_id(db_user_id)
+    db_user = await async_user_service.get_user_by_id(db_user_id)
     if not db_user:
         raise HTTPException(status_code=404, detail="用户不存在")
     
@@ -397,13 +512,15 @@ async def get_user_profile(request: Request, user: UserInfo = Depends(login_requ
 @app.get("/api/user/stats")
 async def get_user_stats():
     """获取用户统计信息（管理员功能）"""
-    stats = user_service.get_user_stats()
+    stats = await async_user_service.get_user_stats()
     return stats
 
 @app.get("/api/users")
-async def get_users(skip: int = 0, limit: int = 100):
-    """获取用户列表（管理员功能）"""
-    users = user_service.get_all_users(skip=skip, limit=limit)
+async def get_users(response: Response, skip: int = 0, limit: int = 100,
+                    after: Optional[str] = None, before: Optional[str] = None):
+    """获取用户列表（管理员功能），支持 after/before 游标分页"""
+    users = await paginate(response, async_user_service.LIST_KEYSET, async_user_service.get_all_users,
+                           skip, limit, after, before)
     return [UserResponse(
         id=str(user.id),
         google_id=user.google_id,
@@ -461,38 +578,15 @@ async def create_consultation(
     attachments: List[UploadFile] = File(default=[])
 ):
     """创建医疗咨询"""
-    user = get_current_user(request)
+    user = await get_current_user(request)
     if not user:
         raise HTTPException(status_code=401, detail="需要登录")
     
-    # 处理文件上传 - 支持多次上传，文件叠加而不是覆盖
-    attachment_paths = []
-    
-    # 确保uploads目录存在
-    import os
-    os.makedirs("uploads", exist_ok=True)
-    
-    for file in attachments:
-        if file.filename:
-            try:
-                # 生成唯一文件名，包含时间戳避免冲突
-                import uuid
-                from datetime import datetime
-                file_extension = file.filename.split('.')[-1] if '.' in file.filename else ''
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                unique_filename = f"{timestamp}_{uuid.uuid4().hex[:8]}.{file_extension}"
-                file_path = f"uploads/{unique_filename}"
-                
-                # 保存文件到服务器
-                with open(file_path, "wb") as buffer:
-                    content = await file.read()
-                    buffer.write(content)
-                
-                attachment_paths.append(file_path)
-                print(f"文件上传成功: {file.filename} -> {file_path}")
-            except Exception as e:
-                print(f"文件上传失败: {file.filename}, 错误: {e}")
-                # 即使文件上传失败，也继续处理其他文件
+    # 处理文件上传 - 分块写入暂存文件并计算SHA-256，多个文件并行；相同内容只存一份，咨询中保存附件ID
+    try:
+        attachment_ids = await attachment_service.save_attachments(attachments)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
     
     # 创建咨询数据
     consultation_data = ConsultationCreate(
@@ -500,7 +594,7 @@ async def create_consultation(
         disease_description=disease_description,
         symptoms=symptoms,
         medical_history=medical_history,
-        attachments=attachment_paths,
+        attachments=attachment_ids,
         doctor_level=DoctorLevel(doctor_level) if doctor_level else None
     ) 
     
@@ -513,7 +607,7 @@ async def create_consultation(
         print(f"转换后的用户ID: {user_id}")
         
         # 创建咨询记录
-        consultation = consultation_service.create_consultation(user_id, consultation_data)
+        consultation = await async_consultation_service.create_consultation(user_id, consultation_data)
         
         print(f"咨询服务返回结果: {consultation}")
         
@@ -525,7 +619,7 @@ async def create_consultation(
             }
         
         # 创建支付订单
-        payment_info = payment_service.create_payment_order(
+        payment_info = await async_payment_service.create_payment_order(
             consultation_id=str(consultation.id),
             user_id=user_id
         )
@@ -544,14 +638,16 @@ async def create_consultation(
 
 @app.get("/api/consultation/{consultation_id}")
 async def get_consultation(consultation_id: str, request: Request):
-    """获取咨询详情"""
-    user = get_current_user(request)
-    if not user:
+    """获取咨询详情（咨询所属用户或已分配的医生）"""
+    user = await get_current_user(request)
+    doctor = await get_current_doctor(request)
+    if not user and not doctor:
         raise HTTPException(status_code=401, detail="需要登录")
     
-    consultation = consultation_service.get_consultation_by_id(consultation_id)
-    if not consultation or consultation.user_id != user.id:
+    participant = await get_chat_participant(request, consultation_id)
+    if not participant:
         raise HTTPException(status_code=404, detail="咨询记录不存在")
+    consultation = participant[0]
     
     return ConsultationResponse(
         id=str(consultation.id),
@@ -561,6 +657,7 @@ async def get_consultation(consultation_id: str, request: Request):
         symptoms=consultation.symptoms,
         medical_history=consultation.medical_history,
         attachments=consultation.attachments,
+        attachment_details=await attachment_service.describe(consultation.attachments),
         package_id=consultation.package_id,
         doctor_level=consultation.doctor_level,
         status=consultation.status,
@@ -573,14 +670,94 @@ async def get_consultation(consultation_id: str, request: Request):
         completed_at=consultation.completed_at
     )
 
+async def authorize_attachment(request: Request, blob_id: str):
+    """引用该附件的咨询所属用户或已分配的医生才能访问，否则抛出401/404"""
+    user = await get_current_user(request)
+    doctor = await get_current_doctor(request)
+    if not user and not doctor:
+        raise HTTPException(status_code=401, detail="需要登录")
+    if not is_blob_id(blob_id) or not await async_consultation_service.can_access_attachment(
+            blob_id, user.id if user else None, doctor.id if doctor else None):
+        raise HTTPException(status_code=404, detail="附件不存在")
+
+def immutable_headers(request: Request, etag: str):
+    """
+    内容不变的资源：强ETag + 长期缓存
+    :return: (headers, 304 response|None)
+    """
+    headers = {"ETag": etag, "Cache-Control": IMMUTABLE_CACHE_CONTROL, "X-Content-Type-Options": "nosniff"}
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")] or if_none_match.strip() == "*":
+        return headers, Response(status_code=304, headers=headers)
+    return headers, None
+
+@app.api_route("/api/attachments/{blob_id}", methods=["GET", "HEAD"])
+async def download_attachment(blob_id: str, request: Request, download: bool = False):
+    """
+    下载附件（引用该附件的咨询所属用户或已分配的医生）
+    支持Range断点续传/分段读取；ETag即内容哈希，带 If-None-Match 时返回304
+    """
+    await authorize_attachment(request, blob_id)
+    etag = f'"{blob_id}"'
+    headers, not_modified = immutable_headers(request, etag)
+    if not_modified:
+        return not_modified
+    
+    blob = await attachment_service.get(blob_id) or {}
+    filename = blob.get("filename") or blob_id
+    content_type = blob.get("content_type") or "application/octet-stream"
+    inline = not download and content_type in ATTACHMENT_INLINE_TYPES
+    headers["Content-Disposition"] = content_disposition(filename, "inline" if inline else "attachment")
+    
+    # 对象存储：重定向到预签名URL，由存储服务直接传输
+    url = await attachment_service.store.download_url(blob_id, filename, content_type)
+    if url:
+        return RedirectResponse(url, status_code=307, headers={"Cache-Control": "private, no-store"})
+    
+    # If-Range 与当前内容不符时忽略Range，返回完整文件
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if if_range and if_range.strip() != etag:
+        range_header = None
+    try:
+        return RangeFileResponse(attachment_service.store.local_path(blob_id), content_type, range_header, headers,
+                                 send_body=request.method != "HEAD")
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="附件不存在")
+
+@app.api_route("/api/attachments/{blob_id}/preview", methods=["GET", "HEAD"])
+async def get_attachment_preview(blob_id: str, request: Request):
+    """附件预览图（压缩的缩略图/PDF首页），尚未生成或不支持预览时返回404"""
+    await authorize_attachment(request, blob_id)
+    headers, not_modified = immutable_headers(request, f'"{blob_id}{PREVIEW_SUFFIX}"')
+    if not_modified:
+        return not_modified
+    
+    blob = await attachment_service.get(blob_id) or {}
+    if blob.get("preview", {}).get("status") != attachment_service.PREVIEW_READY:
+        raise HTTPException(status_code=404, detail="预览图不存在")
+    url = await attachment_service.store.download_url(blob_id, content_type=PREVIEW_CONTENT_TYPE, suffix=PREVIEW_SUFFIX)
+    if url:
+        return RedirectResponse(url, status_code=307, headers={"Cache-Control": "private, no-store"})
+    try:
+        return RangeFileResponse(attachment_service.store.local_path(blob_id, PREVIEW_SUFFIX), PREVIEW_CONTENT_TYPE,
+                                 request.headers.get("range"), headers, send_body=request.method != "HEAD")
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="预览图不存在")
+
 @app.get("/api/consultation/user/list")
-async def get_user_consultations(request: Request, skip: int = 0, limit: int = 20):
-    """获取用户的咨询列表"""
-    user = get_current_user(request)
+async def get_user_consultations(request: Request, response: Response, skip: int = 0, limit: int = 20,
+                                 after: Optional[str] = None, before: Optional[str] = None):
+    """获取用户的咨询列表，支持 after/before 游标分页"""
+    user = await get_current_user(request)
     if not user:
         raise HTTPException(status_code=401, detail="需要登录")
     
-    consultations = consultation_service.get_user_consultations(user.id, skip, limit)
+    consultations = await paginate(
+        response, async_consultation_service.USER_CONSULTATION_KEYSET,
+        lambda *page: async_consultation_service.get_user_consultations(user.id, *page),
+        skip, limit, after, before
+    )
     return [ConsultationResponse(
         id=str(consultation.id),
         user_id=consultation.user_id,
@@ -601,45 +778,87 @@ async def get_user_consultations(request: Request, skip: int = 0, limit: int = 2
         completed_at=consultation.completed_at
     ) for consultation in consultations]
 
+@app.get("/api/payment/qr/{order_id}.{image_format}")
+async def get_payment_qr_code(order_id: str, image_format: str, request: Request):
+    """支付二维码图片（png/svg），订单的地址和金额不变，可长期缓存"""
+    user = await get_current_user(request)
+    if not user:
+        raise HTTPException(status_code=401, detail="需要登录")
+    if image_format not in QR_CONTENT_TYPES:
+        raise HTTPException(status_code=404, detail="不支持的二维码格式")
+    
+    payment_order = await async_consultation_service.get_payment_order_by_id(order_id)
+    if not payment_order or payment_order.user_id != user.id:
+        raise HTTPException(status_code=404, detail="支付订单不存在")
+    
+    payment_url = async_payment_service.payment_url(payment_order.usdt_address, payment_order.amount_usdt)
+    etag = '"' + hashlib.sha256(f"{payment_url}|{image_format}".encode("utf-8")).hexdigest()[:32] + '"'
+    headers, not_modified = immutable_headers(request, etag)
+    if not_modified:
+        return not_modified
+    
+    content = await async_payment_service.qr_code_image(payment_order.usdt_address, payment_order.amount_usdt,
+                                                        image_format)
+    return Response(content=content, media_type=QR_CONTENT_TYPES[image_format], headers=headers)
+
 @app.get("/api/payment/status/{consultation_id}")
-async def check_payment_status(consultation_id: str, request: Request):
-    """检查支付状态"""
-    user = get_current_user(request)
+async def check_payment_status(consultation_id: str, request: Request, response: Response):
+    """检查支付状态（只读订单状态，到账由支付监听确认），带 If-None-Match 且状态没有变化时返回304"""
+    user = await get_current_user(request)
     if not user:
         raise HTTPException(status_code=401, detail="需要登录")
     
+    version, scope, not_modified = await conditional_get(request, consultation_id, f"payment|{user.id}")
+    if not_modified:
+        return not_modified
+    
     try:
-        status_info = payment_service.check_payment_status(consultation_id)
-        
-        # 如果支付成功，触发自动分配医生
-        if status_info.get("status") == "paid":
-            print(f"支付成功，开始自动分配医生到咨询 {consultation_id}")
-            assignment_success = consultation_service.auto_assign_doctor(consultation_id)
-            if assignment_success:
-                status_info["assignment"] = "医生已自动分配"
-                print(f"咨询 {consultation_id} 医生分配成功")
-            else:
-                status_info["assignment"] = "暂无可用医生，系统将稍后自动分配"
-                print(f"咨询 {consultation_id} 医生分配失败，将稍后重试")
+        # 支付成功时咨询已由支付监听放入分配队列，轮询不再触发分配
+        status_info = await async_payment_service.check_payment_status(consultation_id)
         
+        # 待支付订单到期时状态会变化，ETag只在过期前有效
+        expires_at = status_info.get("expires_at")
+        set_etag(response, version, scope, datetime.fromisoformat(expires_at) if expires_at else None)
         return status_info
     except Exception as e:
         print(f"检查支付状态时出错: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/consultation/{consultation_id}/messages")
-async def get_chat_messages(consultation_id: str, request: Request, skip: int = 0, limit: int = 50):
-    """获取聊天消息"""
-    user = get_current_user(request)
-    if not user:
+async def get_chat_messages(consultation_id: str, request: Request, response: Response, skip: int = 0,
+                            limit: int = 50, after: Optional[str] = None, before: Optional[str] = None,
+                            since: Optional[str] = None):
+    """
+    获取聊天消息（咨询所属用户或已分配的医生）
+    支持 after/before 游标分页；since=<消息ID|ISO时间> 只返回其后的新消息；
+    带 If-None-Match 且没有新消息时返回304，只做几次索引查询，不加载消息
+    """
+    user = await get_current_user(request)
+    doctor = await get_current_doctor(request)
+    if not user and not doctor:
         raise HTTPException(status_code=401, detail="需要登录")
     
+    principal = f"{user.id if user else ''}|{doctor.id if doctor else ''}"
+    version, scope, not_modified = await conditional_get(request, consultation_id, f"messages|{principal}")
+    if not_modified:
+        return not_modified
+    
     # 验证用户权限
-    consultation = consultation_service.get_consultation_by_id(consultation_id)
-    if not consultation or consultation.user_id != user.id:
+    if not await get_chat_participant(request, consultation_id):
         raise HTTPException(status_code=404, detail="咨询记录不存在")
     
-    messages = consultation_service.get_chat_messages(consultation_id, skip, limit)
+    if since:
+        try:
+            messages = await async_consultation_service.get_chat_messages_since(consultation_id, since, limit)
+        except InvalidCursor as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    else:
+        messages = await paginate(
+            response, async_consultation_service.CHAT_MESSAGE_KEYSET,
+            lambda *page: async_consultation_service.get_chat_messages(consultation_id, *page),
+            skip, limit, after, before
+        )
+    set_etag(response, version, scope)
     return [ChatMessageResponse(
         id=str(message.id),
         consultation_id=message.consultation_id,
@@ -651,6 +870,65 @@ async def get_chat_messages(consultation_id: str, request: Request, skip: int =
         created_at=message.created_at
     ) for message in messages]
 
+@app.websocket("/ws/consultation/{consultation_id}")
+async def consultation_chat_socket(websocket: WebSocket, consultation_id: str):
+    """聊天WebSocket：推送该咨询的新消息，也可以直接发送 {"message": "..."}"""
+    participant = await get_chat_participant(websocket, consultation_id)
+    if not participant:
+        await websocket.close(code=4403)
+        return
+    _, sender_type, sender_id = participant
+    await websocket.accept()
+    
+    async with chat_hub.subscribe(consultation_id) as queue:
+        async def push():
+            while True:
+                await websocket.send_json(await queue.get())
+        
+        async def receive():
+            while True:
+                data = await websocket.receive_json()
+                if data.get("message"):
+                    await async_consultation_service.send_chat_message(
+                        consultation_id=consultation_id,
+                        sender_id=sender_id,
+                        sender_type=sender_type,
+                        message=data["message"],
+                        message_type=data.get("message_type", "text"),
+                        attachments=data.get("attachments", [])
+                    )
+        
+        tasks = [asyncio.create_task(push()), asyncio.create_task(receive())]
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        for task in done:
+            if not isinstance(task.exception(), (WebSocketDisconnect, type(None))):
+                print(f"聊天WebSocket异常: {task.exception()}")
+
+@app.get("/api/consultation/{consultation_id}/events")
+async def consultation_chat_events(consultation_id: str, request: Request):
+    """聊天SSE推送（不支持WebSocket时使用）"""
+    if not await get_chat_participant(request, consultation_id):
+        raise HTTPException(status_code=404, detail="咨询记录不存在")
+    
+    async def stream():
+        async with chat_hub.subscribe(consultation_id) as queue:
+            yield "retry: 3000\n\n"
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=SSE_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                yield f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+    
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
+
 @app.post("/api/consultation/{consultation_id}/send-message")
 async def send_chat_message(
     consultation_id: str,
@@ -658,17 +936,17 @@ async def send_chat_message(
     message_data: dict
 ):
     """发送聊天消息"""
-    user = get_current_user(request)
+    user = await get_current_user(request)
     if not user:
         raise HTTPException(status_code=401, detail="需要登录")
     
     # 验证用户权限
-    consultation = consultation_service.get_consultation_by_id(consultation_id)
+    consultation = await async_consultation_service.get_consultation_by_id(consultation_id)
     if not consultation or consultation.user_id != user.id:
         raise HTTPException(status_code=404, detail="咨询记录不存在")
     
     try:
-        message = consultation_service.send_chat_message(
+        message = await async_consultation_service.send_chat_message(
             consultation_id=consultation_id,
             sender_id=user.id,
             sender_type="user",
@@ -676,6 +954,8 @@ async def send_chat_message(
             message_type=message_data.get("message_type", "text"),
             attachments=message_data.get("attachments", [])
         )
+        if not message:
+            return {"success": False, "error": "发送消息失败"}
         
         return {
             "success": True,
@@ -699,18 +979,18 @@ async def send_chat_message(
 @app.post("/api/consultation/{consultation_id}/end")
 async def end_consultation(consultation_id: str, request: Request):
     """结束咨询"""
-    user = get_current_user(request)
+    user = await get_current_user(request)
     if not user:
         raise HTTPException(status_code=401, detail="需要登录")
     
     # 验证用户权限
-    consultation = consultation_service.get_consultation_by_id(consultation_id)
+    consultation = await async_consultation_service.get_consultation_by_id(consultation_id)
     if not consultation or consultation.user_id != user.id:
         raise HTTPException(status_code=404, detail="咨询记录不存在")
     
     try:
         from models.consultation import ConsultationStatus
-        consultation_service.update_consultation_status(
+        await async_consultation_service.update_consultation_status(
             consultation_id, 
             ConsultationStatus.COMPLETED
         )
@@ -721,12 +1001,12 @@ async def end_consultation(consultation_id: str, request: Request):
 @app.get("/api/consultation/{consultation_id}/feedback")
 async def get_doctor_feedback(consultation_id: str, request: Request):
     """获取医生反馈"""
-    user = get_current_user(request)
+    user = await get_current_user(request)
     if not user:
         raise HTTPException(status_code=401, detail="需要登录")
     
     # 验证用户权限
-    consultation = consultation_service.get_consultation_by_id(consultation_id)
+    consultation = await async_consultation_service.get_consultation_by_id(consultation_id)
     if not consultation or consultation.user_id != user.id:
         raise HTTPException(status_code=404, detail="咨询记录不存在")
     
@@ -756,12 +1036,12 @@ async def get_doctor_feedback(consultation_id: str, request: Request):
 @app.get("/api/consultation/{consultation_id}/report")
 async def download_consultation_report(consultation_id: str, request: Request):
     """下载咨询报告"""
-    user = get_current_user(request)
+    user = await get_current_user(request)
     if not user:
         raise HTTPException(status_code=401, detail="需要登录")
     
     # 验证用户权限
-    consultation = consultation_service.get_consultation_by_id(consultation_id)
+    consultation = await async_consultation_service.get_consultation_by_id(consultation_id)
     if not consultation or consultation.user_id != user.id:
         raise HTTPException(status_code=404, detail="咨询记录不存在")
     
@@ -796,22 +1076,19 @@ async def download_consultation_report(consultation_id: str, request: Request):
 @app.post("/api/payment/test/{consultation_id}")
 async def test_payment_success(consultation_id: str, request: Request):
     """测试支付成功（仅用于测试）"""
-    user = get_current_user(request)
+    user = await get_current_user(request)
     if not user:
         raise HTTPException(status_code=401, detail="需要登录")
     
     try:
         # 模拟支付成功
-        from models.consultation import PaymentStatus, ConsultationStatus
-        consultation_service.update_payment_status(
+        from models.consultation import PaymentStatus
+        # 支付成功会同时更新咨询状态并触发医生分配
+        await async_consultation_service.update_payment_status(
             consultation_id, 
             PaymentStatus.PAID, 
             "test_transaction_hash_12345"
         )
-        consultation_service.update_consultation_status(
-            consultation_id, 
-            ConsultationStatus.PAID
-        )
         return {"success": True, "message": "测试支付成功"}
     except Exception as e:
         return {"success": False, "error": str(e)}
@@ -821,14 +1098,13 @@ async def test_payment_success(consultation_id: str, request: Request):
 @app.get("/api/doctor/profile", response_model=DoctorResponse)
 async def get_doctor_profile(request: Request, doctor: DoctorInfo = Depends(doctor_login_required)):
     """获取当前医生详细信息"""
-    session_id = get_session_id(request)
-    session_data = sessions.get(session_id, {})
+    session_data = await get_session_data(request) or {}
     db_doctor_id = session_data.get('db_doctor_id')
     
     if not db_doctor_id:
         raise HTTPException(status_code=404, detail="医生信息未找到")
     
-    db_doctor = doctor_service.get_doctor_by_id(db_doctor_id)
+    db_doctor = await async_doctor_service.get_doctor_by_id(db_doctor_id)
     if not db_doctor:
         raise HTTPException(status_code=404, detail="医生不存在")
     
@@ -860,25 +1136,49 @@ async def get_doctor_profile(request: Request, doctor: DoctorInfo = Depends(doct
     )
 
 @app.get("/api/doctor/consultations")
-async def get_doctor_consultations(request: Request, doctor: DoctorInfo = Depends(doctor_login_required), skip: int = 0, limit: int = 20):
-    """获取医生的咨询列表"""
-    consultations = doctor_service.get_doctor_consultations(doctor.id, skip, limit)
+async def get_doctor_consultations(request: Request, response: Response, doctor: DoctorInfo = Depends(doctor_login_required),
+                                   skip: int = 0, limit: int = 20, after: Optional[str] = None, before: Optional[str] = None):
+    """获取医生的咨询列表，支持 after/before 游标分页；附件信息（含预览图地址）一次查询取回"""
+    consultations = await paginate(
+        response, async_doctor_service.CONSULTATION_KEYSET,
+        lambda *page: async_doctor_service.get_doctor_consultations(doctor.id, *page),
+        skip, limit, after, before
+    )
+    details = await attachment_service.describe(
+        [item for consultation in consultations for item in consultation.get("attachments") or []]
+    )
+    for consultation in consultations:
+        count = len(consultation.get("attachments") or [])
+        consultation["attachment_details"], details = details[:count], details[count:]
     return consultations
 
 @app.get("/api/doctor/earnings", response_model=DoctorEarnings)
 async def get_doctor_earnings(request: Request, doctor: DoctorInfo = Depends(doctor_login_required)):
     """获取医生收入统计"""
-    earnings = doctor_service.get_doctor_earnings(doctor.id)
+    earnings = await async_doctor_service.get_doctor_earnings(doctor.id)
     if not earnings:
         raise HTTPException(status_code=404, detail="收入信息未找到")
     return earnings
 
+@app.get("/api/doctor/earnings/series")
+async def get_doctor_earnings_series(request: Request, doctor: DoctorInfo = Depends(doctor_login_required),
+                                     start: Optional[str] = Query(None, alias="from"), end: Optional[str] = Query(None, alias="to"),
+                                     granularity: str = "day"):
+    """获取医生收入趋势：from/to 为 YYYY-MM-DD（含两端，默认最近30天），按日/周/月分桶，没有收入的时段为0"""
+    try:
+        start_day, end_day = parse_range(start, end, 30, MAX_SERIES_DAYS)
+        points = await async_earnings_service.get_series(doctor.id, start_day, end_day, granularity)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"from": start_day.date().isoformat(), "to": end_day.date().isoformat(),
+            "granularity": granularity, "points": points}
+
 @app.post("/api/doctor/status")
 async def update_doctor_status(request: Request, status_data: dict, doctor: DoctorInfo = Depends(doctor_login_required)):
     """更新医生状态"""
     try:
         new_status = DoctorStatus(status_data.get("status"))
-        success = doctor_service.set_doctor_status(doctor.id, new_status)
+        success = await async_doctor_service.set_doctor_status(doctor.id, new_status)
         if success:
             return {"success": True, "message": "状态更新成功"}
         else:
@@ -891,24 +1191,22 @@ async def assign_doctor_to_consultation(consultation_id: str, request: Request,
     """分配医生到咨询"""
     try:
         # 检查咨询是否存在且未分配
-        consultation = consultation_service.get_consultation_by_id(consultation_id)
+        consultation = await async_consultation_service.get_consultation_by_id(consultation_id)
         if not consultation:
             return {"success": False, "error": "咨询不存在"}
         
         if consultation.assigned_doctor_id:
             return {"success": False, "error": "咨询已分配给其他医生"}
         
-        # 分配医生
-        success = doctor_service.assign_doctor_to_consultation(doctor.id, consultation_id)
+        if consultation.status != ConsultationStatus.PAID:
+            return {"success": False, "error": "咨询尚未支付，不能认领"}
+        
+        # 分配医生（条件更新认领：只认领已支付且未分配的咨询，与自动分配并发时只有一方成功，同时把咨询状态更新为进行中）
+        success = await async_doctor_service.assign_doctor_to_consultation(doctor.id, consultation_id)
         if success:
-            # 更新咨询状态
-            consultation_service.update_consultation_status(
-                consultation_id, 
-                ConsultationStatus.IN_PROGRESS
-            )
             return {"success": True, "message": "分配成功"}
         else:
-            return {"success": False, "error": "分配失败"}
+            return {"success": False, "error": "咨询已分配给其他医生或状态已变化"}
     except Exception as e:
         return {"success": False, "error": str(e)}
 
@@ -922,12 +1220,12 @@ async def send_doctor_message(
     """医生发送聊天消息"""
     try:
         # 验证医生是否有权限访问此咨询
-        consultations = doctor_service.get_doctor_consultations(doctor.id)
+        consultations = await async_doctor_service.get_doctor_consultations(doctor.id)
         consultation_ids = [c["id"] for c in consultations]
         if consultation_id not in consultation_ids:
             return {"success": False, "error": "无权限访问此咨询"}
         
-        message = consultation_service.send_chat_message(
+        message = await async_consultation_service.send_chat_message(
             consultation_id=consultation_id,
             sender_id=doctor.id,
             sender_type="doctor",
@@ -935,6 +1233,8 @@ async def send_doctor_message(
             message_type=message_data.get("message_type", "text"),
             attachments=message_data.get("attachments", [])
         )
+        if not message:
+            return {"success": False, "error": "发送消息失败"}
         
         return {
             "success": True,
@@ -960,24 +1260,19 @@ async def complete_consultation(consultation_id: str, request: Request, doctor:
     """完成咨询"""
     try:
         # 验证医生是否有权限访问此咨询
-        consultations = doctor_service.get_doctor_consultations(doctor.id)
+        consultations = await async_doctor_service.get_doctor_consultations(doctor.id)
         consultation_ids = [c["id"] for c in consultations]
         if consultation_id not in consultation_ids:
             return {"success": False, "error": "无权限访问此咨询"}
         
-        # 更新咨询状态为已完成
-        consultation_service.update_consultation_status(
+        # 更新咨询状态为已完成，同时计入医生收入汇总（重复完成不会重复计入）
+        await async_consultation_service.update_consultation_status(
             consultation_id, 
             ConsultationStatus.COMPLETED
         )
         
         # 更新医生状态为活跃
-        doctor_service.set_doctor_status(doctor.id, DoctorStatus.ACTIVE)
-        
-        # 更新医生收入（这里需要根据实际业务逻辑计算）
-        consultation = consultation_service.get_consultation_by_id(consultation_id)
-        if consultation:
-            doctor_service.update_doctor_earnings(doctor.id, consultation.price_usdt)
+        await async_doctor_service.set_doctor_status(doctor.id, DoctorStatus.ACTIVE)
         
         return {"success": True, "message": "咨询已完成"}
     except Exception as e:
@@ -986,7 +1281,7 @@ async def complete_consultation(consultation_id: str, request: Request, doctor:
 @app.post("/api/admin/trigger-assignment")
 async def trigger_assignment_check(request: Request):
     """手动触发分配检查（管理员功能）"""
-    user = get_current_user(request)
+    user = await get_current_user(request)
     if not user:
         raise HTTPException(status_code=401, detail="需要登录")
     
@@ -997,19 +1292,120 @@ async def trigger_assignment_check(request: Request):
     except Exception as e:
         return {"success": False, "error": str(e)}
 
+@app.get("/api/admin/assignment/metrics")
+async def get_assignment_metrics(request: Request):
+    """查看分配引擎的队列深度与分配耗时（管理员功能）"""
+    await admin_required(request)
+    return dict(assignment_engine.metrics(), doctor_load=doctor_load_index.snapshot())
+
+@app.get("/api/admin/previews/metrics")
+async def get_preview_metrics(request: Request):
+    """查看附件预览生成的队列深度与结果统计（管理员功能）"""
+    await admin_required(request)
+    return preview_worker.metrics()
+
+@app.get("/api/admin/payments/watcher")
+async def get_payment_watcher_metrics(request: Request):
+    """查看支付监听的扫描次数、链上请求数和匹配结果（管理员功能）"""
+    await admin_required(request)
+    return payment_watcher.metrics()
+
+@app.get("/api/admin/earnings/export")
+async def export_earnings(request: Request, start: Optional[str] = Query(None, alias="from"),
+                          end: Optional[str] = Query(None, alias="to"), format: str = "csv",
+                          doctor_id: Optional[str] = None):
+    """
+    导出每日收入（按医生等级拆分），CSV或Parquet流式返回，默认最近一年。
+    管理员（ADMIN_EMAILS）导出所有医生或 doctor_id 指定的医生；医生只能导出自己的收入
+    """
+    user = await get_current_user(request)
+    if is_admin(user):
+        scope = doctor_id
+    else:
+        doctor = await get_current_doctor(request)
+        if doctor:
+            scope = doctor.id
+        elif user:
+            raise HTTPException(status_code=403, detail="需要管理员权限")
+        else:
+            raise HTTPException(status_code=401, detail="需要登录")
+    if format not in export_formats():
+        raise HTTPException(status_code=400, detail=f"不支持的导出格式: {format}，可用格式: {', '.join(export_formats())}")
+    try:
+        start_day, end_day = parse_range(start, end, 365)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    rows = async_earnings_service.iterate_rollup(start_day, end_day, scope)
+    prefix = f"earnings_{scope}" if scope else "earnings"
+    filename = f"{prefix}_{start_day.date().isoformat()}_{end_day.date().isoformat()}.{format}"
+    return StreamingResponse(export_stream(format, rows, EXPORT_COLUMNS), media_type=EXPORT_CONTENT_TYPES[format],
+                             headers={"Content-Disposition": content_disposition(filename, "attachment")})
+
+@app.get("/api/admin/db/query-stats")
+async def get_query_stats(request: Request):
+    """查看数据库查询统计（管理员功能）"""
+    await admin_required(request)
+    return query_stats.snapshot()
+
+@app.get("/api/admin/db/collscan-report")
+async def get_collscan_report(request: Request):
+    """列出本进程执行过的、走全表扫描的查询（管理员功能）"""
+    await admin_required(request)
+    report = await run_in_threadpool(collscan_report)
+    return jsonable_encoder(report, custom_encoder={ObjectId: str})
+
 # 应用启动事件
 @app.on_event("startup")
 async def startup_event():
     """应用启动时执行"""
+    # 每个worker进程在fork之后才会创建数据库连接；索引只在这里检查一次，不再在导入时执行
+    if ENSURE_INDEXES_ON_STARTUP:
+        await run_in_threadpool(ensure_all_indexes)
+    
+    # 预先获取Google证书，避免第一批登录请求等待下载
+    google_cert_cache.refresh_in_background()
+    
+    await reconcile_doctor_load_index()
+    await assignment_engine.start()
+    # 启动时先处理积压的未分配咨询
+    assignment_engine.trigger_sweep()
+    
+    await preview_worker.start()
+    try:
+        # 补做重启前未完成的附件预览
+        await preview_worker.sweep()
+    except Exception as e:
+        print(f"检查待生成预览时出错: {e}")
+    
+    await payment_watcher.start()
+    
     print("启动定时任务...")
-    # 添加定时任务（每5分钟检查一次未分配的咨询）
+    # 添加兜底定时任务（每5分钟检查一次未分配的咨询，只在持有租约的进程中执行）
     scheduler.add_job(
-        check_unassigned_consultations,
+        run_on_leader,
+        args=[check_unassigned_consultations],
         trigger=IntervalTrigger(minutes=5),
         id='check_unassigned_consultations',
         name='检查未分配咨询',
         replace_existing=True
     )
+    scheduler.add_job(
+        reconcile_doctor_load_index,
+        trigger=IntervalTrigger(minutes=DOCTOR_LOAD_RECONCILE_MINUTES),
+        id='reconcile_doctor_load_index',
+        name='医生负载索引对齐',
+        replace_existing=True
+    )
+    # 过期处理也只在持有租约的进程中执行，多个worker不会重复处理同一批订单
+    scheduler.add_job(
+        run_on_leader,
+        args=[expire_payment_orders],
+        trigger=IntervalTrigger(seconds=PAYMENT_EXPIRY_SECONDS),
+        id='expire_payment_orders',
+        name='过期待支付订单',
+        replace_existing=True
+    )
     scheduler.start()
     print("✅ 定时任务已启动")
 
@@ -1020,6 +1416,13 @@ async def shutdown_event():
     print("停止定时任务...")
     scheduler.shutdown()
     print("✅ 定时任务已停止")
+    await assignment_engine.stop()
+    await preview_worker.stop()
+    await payment_watcher.stop()
+    if background_lease.is_built():
+        await background_lease.release()
+    if chat_hub.is_built():
+        await chat_hub.stop()
 
 if __name__ == "__main__":
     import uvicorn
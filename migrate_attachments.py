@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+迁移旧版附件：把咨询/聊天消息中保存的本地路径（uploads/xxx.pdf）导入附件存储，替换为附件ID
+
+    python migrate_attachments.py            # 执行迁移
+    python migrate_attachments.py --dry-run  # 只统计，不做修改
+
+可重复执行：已是附件ID的条目跳过，相同文件只导入一次。找不到的文件保留原路径并列出。
+旧文件不会被删除，确认迁移结果后可手动清理 uploads/ 目录。
+"""
+
+import os
+import sys
+import asyncio
+import argparse
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from utils.blob_store import is_blob_id
+
+MIGRATED_COLLECTIONS = ("consultations", "chat_messages")
+
+
+async def migrate_attachments(service=None, dry_run=False, base_dir="."):
+    """
+    :param service: AttachmentService, defaults to the global attachment_service
+    :return: dict with counts of documents updated, files imported and missing paths
+    """
+    if service is None:
+        from services.attachment_service import attachment_service
+        service = attachment_service
+
+    imported = {}
+    stats = {"documents": 0, "files": 0, "missing": []}
+    for collection_name in MIGRATED_COLLECTIONS:
+        legacy = {"attachments": {"$elemMatch": {"$not": {"$regex": "^[0-9a-f]{64}$"}}}}
+        async for document in service.dao.iterate(collection_name, legacy, {"attachments": 1}):
+            attachments = []
+            for item in document["attachments"]:
+                if is_blob_id(item) or not isinstance(item, str):
+                    attachments.append(item)
+                    continue
+                path = item if os.path.isabs(item) else os.path.join(base_dir, item)
+                if item not in imported:
+                    if not os.path.isfile(path):
+                        print(f"⚠️ 找不到附件文件: {item}（{collection_name} {document['_id']}）")
+                        stats["missing"].append(item)
+                        imported[item] = item
+                    elif dry_run:
+                        imported[item] = item
+                        stats["files"] += 1
+                    else:
+                        imported[item] = await service.import_file(path)
+                        stats["files"] += 1
+                        print(f"✅ {item} -> {imported[item]}")
+                attachments.append(imported[item])
+
+            if attachments != document["attachments"]:
+                await service.dao.update_one(collection_name, {"_id": document["_id"]},
+                                             {"$set": {"attachments": attachments}})
+                stats["documents"] += 1
+            elif dry_run:
+                stats["documents"] += 1
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="迁移旧版附件到附件存储")
+    parser.add_argument("--dry-run", action="store_true", help="只统计，不做修改")
+    args = parser.parse_args()
+
+    result = asyncio.run(migrate_attachments(dry_run=args.dry_run))
+    action = "待迁移" if args.dry_run else "已迁移"
+    print(f"\n{action}: {result['documents']} 条记录，导入 {result['files']} 个文件，"
+          f"缺失 {len(result['missing'])} 个文件")
@@ -72,7 +72,7 @@ class ConsultationCreate(BaseModel):
     disease_description: str = Field(..., description="疾病描述")
     symptoms: Optional[str] = Field(None, description="症状描述")
     medical_history: Optional[str] = Field(None, description="病史")
-    attachments: List[str] = Field(default=[], description="附件文件路径列表")
+    attachments: List[str] = Field(default=[], description="附件ID列表")
     package_id: Optional[str] = Field(None, description="咨询套餐ID（一次性咨询必填）")
     doctor_level: Optional[DoctorLevel] = Field(None, description="医生等级（一次性咨询必填）")
 
@@ -84,7 +84,7 @@ class ConsultationInDB(BaseModel):
     disease_description: str = Field(..., description="疾病描述")
     symptoms: Optional[str] = Field(None, description="症状描述")
     medical_history: Optional[str] = Field(None, description="病史")
-    attachments: List[str] = Field(default=[], description="附件文件路径列表")
+    attachments: List[str] = Field(default=[], description="附件ID列表")
     package_id: Optional[str] = Field(None, description="咨询套餐ID")
     doctor_level: Optional[DoctorLevel] = Field(None, description="医生等级")
     status: ConsultationStatus = Field(default=ConsultationStatus.PENDING, description="咨询状态")
@@ -109,7 +109,8 @@ class ConsultationResponse(BaseModel):
     disease_description: str = Field(..., description="疾病描述")
     symptoms: Optional[str] = Field(None, description="症状描述")
     medical_history: Optional[str] = Field(None, description="病史")
-    attachments: List[str] = Field(default=[], description="附件文件路径列表")
+    attachments: List[str] = Field(default=[], description="附件ID列表")
+    attachment_details: List[Dict[str, Any]] = Field(default=[], description="附件信息（文件名、大小、下载地址）")
     package_id: Optional[str] = Field(None, description="咨询套餐ID")
     doctor_level: Optional[DoctorLevel] = Field(None, description="医生等级")
     status: ConsultationStatus = Field(..., description="咨询状态")
@@ -129,9 +130,10 @@ class PaymentOrder(BaseModel):
     id: PyObjectId = Field(default_factory=PyObjectId, alias="_id")
     consultation_id: str = Field(..., description="咨询ID")
     user_id: str = Field(..., description="用户ID")
-    amount_usdt: float = Field(..., description="支付金额(USDT)")
+    amount_usdt: float = Field(..., description="支付金额(USDT)，套餐价格加唯一的小数尾数")
     usdt_address: str = Field(..., description="收款USDT(TRC20)地址")
-    qr_code_url: str = Field(..., description="二维码URL")
+    deposit_key: Optional[str] = Field(None, description="收款键（收款地址:唯一金额），到账时据此找到订单")
+    qr_code_url: str = Field(..., description="二维码图片地址（/api/payment/qr/{order_id}.png）")
     status: PaymentStatus = Field(default=PaymentStatus.PENDING, description="支付状态")
     transaction_hash: Optional[str] = Field(None, description="交易哈希")
     created_at: datetime = Field(default_factory=datetime.utcnow, description="创建时间")
@@ -148,9 +150,9 @@ class PaymentOrderResponse(BaseModel):
     id: str = Field(..., description="订单ID")
     consultation_id: str = Field(..., description="咨询ID")
     user_id: str = Field(..., description="用户ID")
-    amount_usdt: float = Field(..., description="支付金额(USDT)")
+    amount_usdt: float = Field(..., description="支付金额(USDT)，套餐价格加唯一的小数尾数")
     usdt_address: str = Field(..., description="收款USDT(TRC20)地址")
-    qr_code_url: str = Field(..., description="二维码URL")
+    qr_code_url: str = Field(..., description="二维码图片地址（/api/payment/qr/{order_id}.png）")
     status: PaymentStatus = Field(..., description="支付状态")
     transaction_hash: Optional[str] = Field(None, description="交易哈希")
     created_at: datetime = Field(..., description="创建时间")
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+医生分配引擎
+
+支付成功或医生变为ACTIVE时立即触发分配，由固定数量的worker并发处理队列，
+同一个咨询在队列中只会出现一次。定时扫描只作为兜底（进程重启、队列满等情况）。
+"""
+
+import os
+import time
+import asyncio
+from collections import deque
+from utils.lazy_instance import LazyInstance
+
+ASSIGNMENT_WORKERS = int(os.getenv('ASSIGNMENT_WORKERS', 4))
+ASSIGNMENT_QUEUE_SIZE = int(os.getenv('ASSIGNMENT_QUEUE_SIZE', 1000))
+ASSIGNMENT_SWEEP_LIMIT = int(os.getenv('ASSIGNMENT_SWEEP_LIMIT', 200))
+
+
+def _percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class AssignmentEngine:
+    """
+    :param assign: async callable(consultation_id) -> bool, defaults to async_consultation_service.auto_assign_doctor
+    :param fetch_unassigned: async callable(limit) -> list of {"id": ...}, used by sweep()
+    :param workers: number of concurrent assignment workers
+    :param max_queue: queue bound; submissions beyond it are dropped and picked up by the next sweep
+    """
+    MAX_SAMPLES = 500
+
+    def __init__(self, assign=None, fetch_unassigned=None, workers=ASSIGNMENT_WORKERS,
+                 max_queue=ASSIGNMENT_QUEUE_SIZE, sweep_limit=ASSIGNMENT_SWEEP_LIMIT):
+        if assign is None or fetch_unassigned is None:
+            from services.consultation_service import async_consultation_service
+            assign = assign or async_consultation_service.auto_assign_doctor
+            fetch_unassigned = fetch_unassigned or async_consultation_service.get_unassigned_consultations
+        self.assign = assign
+        self.fetch_unassigned = fetch_unassigned
+        self.worker_count = workers
+        self.max_queue = max_queue
+        self.sweep_limit = sweep_limit
+        self._queue = None
+        self._workers = []
+        self._sweep_task = None
+        # consultation_id -> 首次提交时间，用于去重和统计分配耗时
+        self._pending = {}
+        self._in_flight = 0
+        self._samples = deque(maxlen=self.MAX_SAMPLES)
+        self._counters = {"submitted": 0, "assigned": 0, "failed": 0, "dropped": 0, "sweeps": 0}
+
+    @property
+    def running(self):
+        return bool(self._workers)
+
+    async def start(self):
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.worker_count)]
+        print(f"✅ 分配引擎已启动，worker数量: {self.worker_count}")
+
+    async def stop(self):
+        tasks = self._workers + ([self._sweep_task] if self._sweep_task else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers = []
+        self._sweep_task = None
+        self._queue = None
+        self._pending.clear()
+
+    def submit(self, consultation_id):
+        """
+        queue a consultation for assignment
+        :return: True if queued, False if already pending, the engine is not running or the queue is full
+        """
+        if not self.running or consultation_id in self._pending:
+            return False
+        try:
+            self._queue.put_nowait(consultation_id)
+        except asyncio.QueueFull:
+            self._counters["dropped"] += 1
+            return False
+        self._pending[consultation_id] = time.monotonic()
+        self._counters["submitted"] += 1
+        return True
+
+    async def sweep(self):
+        """
+        queue every paid but unassigned consultation
+        :return: number of newly queued consultations
+        """
+        self._counters["sweeps"] += 1
+        consultations = await self.fetch_unassigned(limit=self.sweep_limit)
+        return sum(1 for consultation in consultations if self.submit(consultation["id"]))
+
+    def trigger_sweep(self):
+        """
+        schedule a sweep, e.g. when a doctor becomes ACTIVE; bursts of triggers share one sweep
+        """
+        if not self.running or (self._sweep_task and not self._sweep_task.done()):
+            return
+        self._sweep_task = asyncio.create_task(self._run_sweep())
+
+    async def _run_sweep(self):
+        try:
+            await self.sweep()
+        except Exception as e:
+            print(f"分配扫描失败: {e}")
+
+    async def _worker(self):
+        while True:
+            consultation_id = await self._queue.get()
+            self._in_flight += 1
+            try:
+                success = await self.assign(consultation_id)
+            except Exception as e:
+                print(f"分配咨询 {consultation_id} 出错: {e}")
+                success = False
+            finally:
+                self._in_flight -= 1
+                submitted_at = self._pending.pop(consultation_id, None)
+                self._queue.task_done()
+
+            if success:
+                self._counters["assigned"] += 1
+                if submitted_at is not None:
+                    self._samples.append(time.monotonic() - submitted_at)
+            else:
+                # 没有可用医生时不重试，等医生变为ACTIVE或下一次扫描
+                self._counters["failed"] += 1
+
+    def metrics(self):
+        samples = sorted(self._samples)
+        time_to_assign = {"count": len(samples)}
+        if samples:
+            time_to_assign.update({
+                "avg_ms": round(sum(samples) / len(samples) * 1000, 2),
+                "p50_ms": round(_percentile(samples, 0.5) * 1000, 2),
+                "p95_ms": round(_percentile(samples, 0.95) * 1000, 2),
+                "max_ms": round(samples[-1] * 1000, 2),
+            })
+        return dict(
+            self._counters,
+            running=self.running,
+            workers=len(self._workers),
+            queue_depth=self._queue.qsize() if self._queue else 0,
+            in_flight=self._in_flight,
+            time_to_assign=time_to_assign,
+        )
+
+
+assignment_engine = LazyInstance(AssignmentEngine)
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+附件服务
+
+附件内容保存在 utils.blob_store（以SHA-256为ID，相同内容只存一份），
+这里在 blobs 集合中记录每个附件的大小、类型和首次上传时的文件名，以及预览图状态
+（pending/ready/unsupported/failed，由 services.preview_worker 在后台生成）。
+咨询的 attachments 字段保存附件ID列表。
+"""
+
+import os
+import mimetypes
+from datetime import datetime
+from fastapi.concurrency import run_in_threadpool
+from utils.async_mongo_dao import async_mongo_dao
+from utils.blob_store import blob_store, is_blob_id
+from utils.lazy_instance import LazyInstance
+from utils.mongo_indexes import IndexSpec
+from utils.previews import can_preview
+from utils.uploads import save_uploads, copy_to_file
+
+
+class AttachmentService:
+    """附件服务类（异步版本）"""
+
+    BLOB_COLLECTION = "blobs"
+    PREVIEW_PENDING = "pending"
+    PREVIEW_READY = "ready"
+
+    # 以附件ID为 _id；只有等待生成预览的附件进入部分索引，供启动时补做
+    INDEXES = {
+        BLOB_COLLECTION: [
+            IndexSpec([("preview.status", 1), ("created_at", 1)], name="preview_pending",
+                      partial_filter={"preview.status": PREVIEW_PENDING}),
+        ]
+    }
+
+    def __init__(self, store=None):
+        self.dao = async_mongo_dao
+        self.store = store or blob_store
+
+    async def record(self, blobs):
+        """
+        record metadata of stored blobs, keeping the first filename seen for a content
+        :param blobs: dicts with "id", "size", "filename", "content_type"
+        """
+        now = datetime.utcnow()
+        for blob in blobs:
+            document = {
+                "size": blob["size"],
+                "filename": blob["filename"],
+                "content_type": blob["content_type"],
+                "created_at": now,
+            }
+            if can_preview(blob["content_type"]):
+                document["preview"] = {"status": self.PREVIEW_PENDING}
+            await self.dao.update_one(self.BLOB_COLLECTION, {"_id": blob["id"]}, {"$setOnInsert": document},
+                                      upsert=True)
+
+    async def save_attachments(self, files, **limits):
+        """
+        store uploaded files and their metadata
+        :param limits: max_file_bytes / max_request_bytes / max_files, see utils.uploads.save_uploads
+        :return: list of attachment IDs in upload order
+        :raise UploadTooLarge: a limit was exceeded; nothing is stored
+        """
+        blobs = await save_uploads(files, self.store, **limits)
+        await self.record(blobs)
+        # 上传请求不等待预览生成
+        from services.preview_worker import preview_worker
+        for blob in blobs:
+            if blob["created"] and can_preview(blob["content_type"]):
+                preview_worker.submit(blob["id"], blob["content_type"])
+        return [blob["id"] for blob in blobs]
+
+    async def import_file(self, path, filename=None):
+        """
+        store a file already on local disk (e.g. a legacy uploads/ path), leaving the original in place
+        :return: attachment ID
+        """
+        staging_path = self.store.staging_path()
+        try:
+            with open(path, "rb") as source:
+                size, blob_id = await run_in_threadpool(copy_to_file, source, staging_path, float("inf"))
+        except BaseException:
+            if os.path.exists(staging_path):
+                os.remove(staging_path)
+            raise
+        await self.store.put(staging_path, blob_id)
+        filename = filename or os.path.basename(path)
+        await self.record([{
+            "id": blob_id,
+            "size": size,
+            "filename": filename,
+            "content_type": mimetypes.guess_type(filename)[0] or "application/octet-stream",
+        }])
+        return blob_id
+
+    async def describe(self, attachments):
+        """
+        display information of a consultation's attachments, one query for all of them
+        :param attachments: attachment IDs (legacy entries may still be uploads/ paths)
+        :return: list of dicts with "id", "filename", "size", "content_type", "url" (None for legacy paths)
+        """
+        blob_ids = [item for item in attachments if is_blob_id(item)]
+        found = {}
+        if blob_ids:
+            for blob in await self.dao.find(self.BLOB_COLLECTION, {"_id": {"$in": blob_ids}}):
+                found[blob["_id"]] = blob
+        details = []
+        for item in attachments:
+            blob = found.get(item, {})
+            details.append({
+                "id": item,
+                "filename": blob.get("filename") or os.path.basename(item),
+                "size": blob.get("size"),
+                "content_type": blob.get("content_type"),
+                "url": f"/api/attachments/{item}" if is_blob_id(item) else None,
+                "preview_url": f"/api/attachments/{item}/preview"
+                if blob.get("preview", {}).get("status") == self.PREVIEW_READY else None,
+            })
+        return details
+
+    async def set_preview(self, blob_id, status, **info):
+        """
+        :param status: ready / unsupported / failed
+        :param info: width, height, size of a ready preview, or error
+        """
+        await self.dao.update_one(self.BLOB_COLLECTION, {"_id": blob_id},
+                                  {"$set": {"preview": dict(info, status=status)}})
+
+    async def pending_previews(self, limit=100):
+        """
+        :return: blobs still waiting for a preview, oldest first
+        """
+        return await self.dao.find(self.BLOB_COLLECTION, {"preview.status": self.PREVIEW_PENDING},
+                                   {"content_type": 1}, sort=[("created_at", 1)], limit=limit)
+
+    async def get(self, blob_id):
+        """
+        :return: metadata document or None
+        """
+        if not is_blob_id(blob_id):
+            return None
+        return await self.dao.find_one(self.BLOB_COLLECTION, {"_id": blob_id})
+
+
+attachment_service = LazyInstance(AttachmentService)
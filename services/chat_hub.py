@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+聊天消息实时推送
+
+每个咨询一个频道，WebSocket/SSE连接订阅所在咨询的频道。消息发布到broker，
+broker再交给每个进程的ChatHub分发给本进程内的订阅者：
+
+    CHAT_BROKER=memory   # 默认，只在本进程内分发，适合单worker
+    CHAT_BROKER=redis    # Redis发布/订阅，多个worker/多台机器之间分发，地址见 REDIS_URL
+"""
+
+import os
+import json
+import asyncio
+from contextlib import asynccontextmanager
+from utils.lazy_instance import LazyInstance
+from utils.session_store import REDIS_URL
+
+CHAT_BROKER = os.getenv('CHAT_BROKER', 'memory')
+# 单个连接积压的消息上限，客户端太慢时丢弃最早的消息
+CHAT_SUBSCRIBER_QUEUE_SIZE = int(os.getenv('CHAT_SUBSCRIBER_QUEUE_SIZE', 100))
+
+
+class InProcessBroker:
+    """
+    deliver straight to the local hub
+    """
+    def __init__(self):
+        self.deliver = None
+
+    async def start(self, deliver):
+        self.deliver = deliver
+
+    async def stop(self):
+        self.deliver = None
+
+    async def publish(self, channel, event):
+        if self.deliver:
+            self.deliver(channel, event)
+
+
+class RedisBroker:
+    """
+    Redis pub/sub across workers; every process (including the publisher) receives
+    events through its own pattern subscription.
+    :param client: a redis.asyncio compatible client; built from REDIS_URL when omitted
+    """
+    PREFIX = "chat:"
+
+    def __init__(self, client=None, url=REDIS_URL):
+        if client is None:
+            import redis.asyncio as redis
+            client = redis.from_url(url)
+        self.client = client
+        self._task = None
+
+    async def start(self, deliver):
+        pubsub = self.client.pubsub()
+        await pubsub.psubscribe(self.PREFIX + "*")
+        self._task = asyncio.create_task(self._listen(pubsub, deliver))
+
+    async def _listen(self, pubsub, deliver):
+        try:
+            async for item in pubsub.listen():
+                if item.get("type") != "pmessage":
+                    continue
+                channel = item["channel"]
+                if isinstance(channel, bytes):
+                    channel = channel.decode("utf-8")
+                try:
+                    deliver(channel[len(self.PREFIX):], json.loads(item["data"]))
+                except Exception as e:
+                    print(f"处理聊天推送失败: {e}")
+        finally:
+            await pubsub.aclose()
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def publish(self, channel, event):
+        await self.client.publish(self.PREFIX + channel, json.dumps(event))
+
+
+class ChatHub:
+    """
+    consultation_id -> set of subscriber queues in this process
+    """
+    def __init__(self, broker=None, queue_size=CHAT_SUBSCRIBER_QUEUE_SIZE):
+        self.broker = broker or create_broker()
+        self.queue_size = queue_size
+        self._subscribers = {}
+        self._started = False
+        self._start_lock = asyncio.Lock()
+
+    async def start(self):
+        async with self._start_lock:
+            if not self._started:
+                await self.broker.start(self.deliver)
+                self._started = True
+
+    async def stop(self):
+        if self._started:
+            await self.broker.stop()
+            self._started = False
+
+    async def publish(self, consultation_id, event):
+        """
+        publish an event ({"type": "message", "message": {...}}) to every subscriber of the consultation
+        """
+        await self.start()
+        await self.broker.publish(consultation_id, event)
+
+    async def notify(self, consultation_id, event):
+        """
+        publish, logging instead of raising: a failed push must not fail the write that caused it
+        """
+        try:
+            await self.publish(consultation_id, event)
+        except Exception as e:
+            print(f"推送咨询 {consultation_id} 事件失败: {e}")
+
+    def deliver(self, consultation_id, event):
+        """
+        fan an event out to the local subscribers, called by the broker
+        """
+        for queue in list(self._subscribers.get(consultation_id, ())):
+            if queue.full():
+                # 慢客户端：丢弃最早的消息，不阻塞其他订阅者
+                queue.get_nowait()
+            queue.put_nowait(event)
+
+    @asynccontextmanager
+    async def subscribe(self, consultation_id):
+        """
+        async with chat_hub.subscribe(consultation_id) as queue:
+            event = await queue.get()
+        """
+        await self.start()
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.setdefault(consultation_id, set()).add(queue)
+        try:
+            yield queue
+        finally:
+            subscribers = self._subscribers.get(consultation_id)
+            if subscribers is not None:
+                subscribers.discard(queue)
+                if not subscribers:
+                    del self._subscribers[consultation_id]
+
+    def subscriber_count(self, consultation_id=None):
+        if consultation_id is not None:
+            return len(self._subscribers.get(consultation_id, ()))
+        return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+
+def create_broker(backend=None):
+    backend = (backend or CHAT_BROKER).lower()
+    if backend == "memory":
+        return InProcessBroker()
+    if backend == "redis":
+        return RedisBroker()
+    raise ValueError(f"未知的聊天推送后端: {backend}")
+
+
+chat_hub = LazyInstance(ChatHub)
@@ -4,10 +4,16 @@
 医疗咨询服务类
 """
 
+import os
+import random
 from typing import Optional, List, Dict, Any
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
 from utils.mongo_dao import mongo_dao
+from utils.async_mongo_dao import async_mongo_dao
+from utils.lazy_instance import LazyInstance
+from utils.mongo_indexes import IndexSpec
 from models.consultation import (
     ConsultationInDB, ConsultationCreate, ConsultationResponse,
     PaymentOrder, PaymentOrderResponse, ChatMessage, ChatMessageResponse,
@@ -15,6 +21,23 @@ from models.consultation import (
     ConsultationPackage
 )
 from models.doctor import DoctorStatus
+from services.doctor_load_index import doctor_load_index, load_pipeline, LOAD_STATUSES
+from utils.pagination import Keyset, InvalidCursor, encode_cursor
+from utils.tron_client import usdt_to_sun, USDT_DECIMALS
+from services.earnings_service import earnings_service, async_earnings_service
+
+# 每个订单的金额在套餐价格上加 1~PAYMENT_AMOUNT_TAGS 个最小单位（默认最多多付0.009999 USDT），
+# 同一收款地址同一时间内每个金额只属于一个待支付订单，到账后按金额直接找到订单
+PAYMENT_AMOUNT_TAGS = int(os.getenv('PAYMENT_AMOUNT_TAGS', 9999))
+PAYMENT_ORDER_HOURS = 24
+# 过期任务每批处理的订单数
+PAYMENT_EXPIRY_BATCH = int(os.getenv('PAYMENT_EXPIRY_BATCH', 500))
+
+
+def _version_part(value: Optional[datetime]) -> str:
+    """时间戳（毫秒）作为版本号的一段"""
+    return str(int(value.replace(tzinfo=timezone.utc).timestamp() * 1000)) if value else "-"
+
 
 class ConsultationService:
     """医疗咨询服务类"""
@@ -22,6 +45,56 @@ class ConsultationService:
     CONSULTATION_COLLECTION = "consultations"
     PAYMENT_ORDER_COLLECTION = "payment_orders"
     CHAT_MESSAGE_COLLECTION = "chat_messages"
+    # 支付二维码由本站按订单渲染
+    PAYMENT_QR_PATH = "/api/payment/qr/{order_id}.{image_format}"
+    # 支付监听的扫描进度（每个收款地址一条）
+    PAYMENT_WATCH_COLLECTION = "payment_watch_state"
+    # 收款键 "<收款地址>:<金额(最小单位)>" -> 订单，_id 唯一保证同一金额不会同时分给两个订单
+    DEPOSIT_KEY_COLLECTION = "payment_deposit_keys"
+    DEPOSIT_KEY_ATTEMPTS = 20
+    
+    # 声明式索引，由 services.index_service 统一应用
+    INDEXES = {
+        CONSULTATION_COLLECTION: [
+            # 用户咨询列表，按创建时间倒序（_id 作为游标分页的次序键）
+            IndexSpec([("user_id", 1), ("created_at", -1), ("_id", -1)]),
+            # 未分配咨询扫描：status=paid, assigned_doctor_id=null, 按创建时间排序
+            IndexSpec([("status", 1), ("assigned_doctor_id", 1), ("created_at", 1)]),
+            # 医生当前咨询数量、收入统计
+            IndexSpec([("assigned_doctor_id", 1), ("status", 1)]),
+            # 附件下载鉴权：按附件ID找到引用它的咨询（多键索引）
+            IndexSpec("attachments"),
+        ],
+        PAYMENT_ORDER_COLLECTION: [
+            IndexSpec("consultation_id"),
+            IndexSpec("user_id"),
+            # 支付监听：某个收款地址下的待支付订单；只索引待支付订单，已支付/过期订单不占索引
+            IndexSpec([("usdt_address", 1), ("status", 1), ("created_at", 1)],
+                      partial_filter={"status": PaymentStatus.PENDING.value}),
+            # 过期任务：按过期时间取出到期的待支付订单
+            IndexSpec("expires_at", name="pending_expires_at", partial_filter={"status": PaymentStatus.PENDING.value}),
+            # 同一笔链上交易只能确认一个订单
+            IndexSpec("transaction_hash", unique=True, partial_filter={"transaction_hash": {"$type": "string"}}),
+        ],
+        # 收款键在订单过期后由TTL删除，金额可以被新订单使用
+        DEPOSIT_KEY_COLLECTION: [
+            IndexSpec("expires_at", expire_after_seconds=0),
+        ],
+        CHAT_MESSAGE_COLLECTION: [
+            # 聊天记录按时间顺序分页
+            IndexSpec([("consultation_id", 1), ("created_at", 1), ("_id", 1)]),
+        ]
+    }
+    
+    # 热点查询只取需要的字段
+    AVAILABLE_DOCTOR_PROJECTION = {"name": 1, "email": 1, "level": 1, "status": 1, "specialties": 1}
+    # 状态变化时需要旧状态、医生（释放负载）和金额、等级（收入汇总）
+    STATUS_CHANGE_PROJECTION = {"status": 1, "assigned_doctor_id": 1, "price_usdt": 1, "doctor_level": 1}
+    UNASSIGNED_PROJECTION = {"user_id": 1, "doctor_level": 1, "mode": 1, "status": 1, "created_at": 1}
+    
+    # 游标分页顺序：咨询列表最新在前，聊天记录按时间顺序
+    USER_CONSULTATION_KEYSET = Keyset("created_at", "_id", descending=True)
+    CHAT_MESSAGE_KEYSET = Keyset("created_at", "_id")
     
     # 咨询套餐配置
     CONSULTATION_PACKAGES = {
@@ -56,19 +129,6 @@ class ConsultationService:
     
     def __init__(self):
         self.dao = mongo_dao
-        self._ensure_indexes()
-    
-    def _ensure_indexes(self):
-        """确保数据库索引存在"""
-        try:
-            # 为consultation_id创建索引
-            self.dao.create_index(self.CONSULTATION_COLLECTION, "user_id")
-            self.dao.create_index(self.CONSULTATION_COLLECTION, "status")
-            self.dao.create_index(self.PAYMENT_ORDER_COLLECTION, "consultation_id")
-            self.dao.create_index(self.PAYMENT_ORDER_COLLECTION, "user_id")
-            self.dao.create_index(self.CHAT_MESSAGE_COLLECTION, "consultation_id")
-        except Exception as e:
-            print(f"创建索引时出错: {e}")
     
     def get_consultation_packages(self) -> List[ConsultationPackage]:
         """获取所有咨询套餐"""
@@ -229,9 +289,8 @@ class ConsultationService:
     def get_consultation_by_id(self, consultation_id: str) -> Optional[ConsultationInDB]:
         """根据ID获取咨询记录"""
         try:
-            consultations = self.dao.search(self.CONSULTATION_COLLECTION, "_id", ObjectId(consultation_id))
-            if consultations:
-                consultation_data = consultations[0]
+            consultation_data = self.dao.find_one(self.CONSULTATION_COLLECTION, {"_id": ObjectId(consultation_id)})
+            if consultation_data:
                 consultation_data["id"] = consultation_data.pop("_id")
                 
                 # 使用标准化方法处理数据
@@ -243,12 +302,29 @@ class ConsultationService:
             traceback.print_exc()
         return None
     
+    def _attachment_access_query(self, blob_id: str, user_id: Optional[str], doctor_id: Optional[str]) -> Optional[dict]:
+        """引用该附件、且属于该用户或分配给该医生的咨询"""
+        owners = []
+        if user_id:
+            owners.append({"user_id": str(user_id)})
+        if doctor_id:
+            owners.append({"assigned_doctor_id": str(doctor_id)})
+        if not owners:
+            return None
+        return {"attachments": blob_id, "$or": owners}
+    
+    def can_access_attachment(self, blob_id: str, user_id: Optional[str] = None, doctor_id: Optional[str] = None) -> bool:
+        """用户或医生是否可以下载附件"""
+        query = self._attachment_access_query(blob_id, user_id, doctor_id)
+        return bool(query) and self.dao.find_one(self.CONSULTATION_COLLECTION, query, {"_id": 1}) is not None
+    
     def get_consultation_by_user_and_latest(self, user_id: str) -> Optional[ConsultationInDB]:
         """获取用户最新的咨询记录"""
         try:
-            consultations = self.dao._MongoDao__db[self.CONSULTATION_COLLECTION].find(
-                {"user_id": user_id}
-            ).sort("created_at", -1).limit(1)
+            consultations = self.dao.find(
+                self.CONSULTATION_COLLECTION, {"user_id": user_id},
+                sort=[("created_at", -1)], limit=1
+            )
             
             for consultation in consultations:
                 consultation["id"] = consultation.pop("_id")
@@ -260,12 +336,14 @@ class ConsultationService:
             print(f"获取用户咨询记录时出错: {e}")
         return None
     
-    def get_user_consultations(self, user_id: str, skip: int = 0, limit: int = 20) -> List[ConsultationInDB]:
-        """获取用户的咨询记录列表"""
+    def get_user_consultations(self, user_id: str, skip: int = 0, limit: int = 20,
+                               after: Optional[str] = None, before: Optional[str] = None) -> List[ConsultationInDB]:
+        """获取用户的咨询记录列表，after/before 为游标分页参数"""
+        query, sort, reverse = self.USER_CONSULTATION_KEYSET.page({"user_id": user_id}, after, before)
         try:
-            consultations = self.dao._MongoDao__db[self.CONSULTATION_COLLECTION].find(
-                {"user_id": user_id}
-            ).sort("created_at", -1).skip(skip).limit(limit)
+            consultations = self.dao.find(self.CONSULTATION_COLLECTION, query, sort=sort, skip=skip, limit=limit)
+            if reverse:
+                consultations = consultations[::-1]
             
             result = []
             for consultation in consultations:
@@ -302,21 +380,26 @@ class ConsultationService:
         if consultation.user_id != user_id:
             raise ValueError("无权限访问此咨询记录")
         
-        # 生成二维码URL（这里使用在线二维码生成服务）
-        qr_code_url = f"https://api.qrserver.com/v1/create-qr-code/?size=200x200&data={usdt_address}"
+        # 预先分配订单ID，二维码地址指向本站的二维码接口
+        order_id = ObjectId()
+        now = datetime.utcnow()
+        expires_at = now + timedelta(hours=PAYMENT_ORDER_HOURS)
+        
+        # 为订单占用一个唯一的支付金额
+        for amount_sun in self._candidate_amounts(consultation.price_usdt):
+            key = self._deposit_key(usdt_address, amount_sun)
+            try:
+                self.dao.find_one_and_update(self.DEPOSIT_KEY_COLLECTION, *self._claim_deposit_key(
+                    key, order_id, consultation_id, now, expires_at), upsert=True)
+                break
+            except DuplicateKeyError:
+                continue
+        else:
+            raise ValueError("当前待支付订单过多，请稍后重试")
         
         # 创建支付订单
-        payment_order_dict = {
-            "consultation_id": consultation_id,
-            "user_id": user_id,
-            "amount_usdt": consultation.price_usdt,
-            "usdt_address": usdt_address,
-            "qr_code_url": qr_code_url,
-            "status": PaymentStatus.PENDING,
-            "created_at": datetime.utcnow(),
-            "updated_at": datetime.utcnow(),
-            "expires_at": datetime.utcnow() + timedelta(hours=24)  # 24小时过期
-        }
+        payment_order_dict = self._payment_order_document(order_id, consultation_id, user_id, usdt_address,
+                                                          amount_sun, key, now, expires_at)
         
         # 插入数据库
         self.dao.insert(self.PAYMENT_ORDER_COLLECTION, payment_order_dict)
@@ -324,12 +407,61 @@ class ConsultationService:
         # 返回创建的支付订单
         return self.get_payment_order_by_consultation(consultation_id)
     
+    @staticmethod
+    def _deposit_key(usdt_address: str, amount_sun: int) -> str:
+        return f"{usdt_address}:{amount_sun}"
+    
+    def _candidate_amounts(self, price_usdt: float):
+        """
+        random tagged amounts (smallest unit) to try for a new order
+        """
+        base = usdt_to_sun(price_usdt)
+        tags = random.sample(range(1, PAYMENT_AMOUNT_TAGS + 1), min(self.DEPOSIT_KEY_ATTEMPTS, PAYMENT_AMOUNT_TAGS))
+        return [base + tag for tag in tags]
+    
+    @staticmethod
+    def _claim_deposit_key(key: str, order_id, consultation_id: str, now: datetime, expires_at: datetime):
+        """
+        (query, update) taking a deposit key that is free or whose order has expired; with upsert=True
+        a key still held by a pending order raises DuplicateKeyError
+        """
+        query = {"_id": key, "expires_at": {"$lte": now}}
+        update = {"$set": {"order_id": order_id, "consultation_id": consultation_id,
+                           "created_at": now, "expires_at": expires_at}}
+        return query, update
+    
+    def _payment_order_document(self, order_id, consultation_id: str, user_id: str, usdt_address: str,
+                                amount_sun: int, deposit_key: str, now: datetime, expires_at: datetime) -> dict:
+        return {
+            "_id": order_id,
+            "consultation_id": consultation_id,
+            "user_id": user_id,
+            "amount_usdt": amount_sun / 10 ** USDT_DECIMALS,
+            "usdt_address": usdt_address,
+            "deposit_key": deposit_key,
+            "qr_code_url": self.PAYMENT_QR_PATH.format(order_id=order_id, image_format="png"),
+            "status": PaymentStatus.PENDING,
+            "created_at": now,
+            "updated_at": now,
+            "expires_at": expires_at
+        }
+    
     def get_payment_order_by_consultation(self, consultation_id: str) -> Optional[PaymentOrder]:
         """根据咨询ID获取支付订单"""
         try:
-            orders = self.dao.search(self.PAYMENT_ORDER_COLLECTION, "consultation_id", consultation_id)
-            if orders:
-                order_data = orders[0]
+            order_data = self.dao.find_one(self.PAYMENT_ORDER_COLLECTION, {"consultation_id": consultation_id})
+            if order_data:
+                order_data["id"] = order_data.pop("_id")
+                return PaymentOrder(**order_data)
+        except Exception as e:
+            print(f"获取支付订单时出错: {e}")
+        return None
+    
+    def get_payment_order_by_id(self, order_id: str) -> Optional[PaymentOrder]:
+        """根据订单ID获取支付订单"""
+        try:
+            order_data = self.dao.find_one(self.PAYMENT_ORDER_COLLECTION, {"_id": ObjectId(order_id)})
+            if order_data:
                 order_data["id"] = order_data.pop("_id")
                 return PaymentOrder(**order_data)
         except Exception as e:
@@ -337,22 +469,19 @@ class ConsultationService:
         return None
     
     def check_payment_status(self, consultation_id: str) -> PaymentStatus:
-        """检查支付状态（模拟实现，实际需要连接以太坊网络）"""
-        # 这里应该连接以太坊网络检查交易状态
-        # 为了演示，我们模拟一个简单的检查逻辑
+        """检查支付状态（到账由支付监听确认，过期由定时任务批量处理，这里只读订单）"""
         payment_order = self.get_payment_order_by_consultation(consultation_id)
         if not payment_order:
             return PaymentStatus.FAILED
         
-        # 检查是否过期
-        if datetime.utcnow() > payment_order.expires_at:
-            self.update_payment_status(consultation_id, PaymentStatus.EXPIRED)
-            return PaymentStatus.EXPIRED
-        
         # 如果已经有支付状态，直接返回
         if payment_order.status != PaymentStatus.PENDING:
             return payment_order.status
         
+        # 已过期但定时任务还没处理到
+        if datetime.utcnow() > payment_order.expires_at:
+            return PaymentStatus.EXPIRED
+        
         # 模拟支付检查（实际应该查询以太坊网络）
         # 为了演示，我们使用一个更保守的检查逻辑
         # 只有在特定条件下才认为支付成功（比如有交易哈希）
@@ -397,43 +526,99 @@ class ConsultationService:
             elif status == ConsultationStatus.COMPLETED:
                 update_data["completed_at"] = datetime.utcnow()
             
-            self.dao.update(
-                self.CONSULTATION_COLLECTION,
-                "_id",
-                ObjectId(consultation_id),
-                update_data
+            previous = self.dao.find_one_and_update(
+                self.CONSULTATION_COLLECTION, {"_id": ObjectId(consultation_id)}, {"$set": update_data},
+                projection=self.STATUS_CHANGE_PROJECTION, return_document="before"
             )
+            # 咨询结束时医生当前咨询数量减一
+            if self._releases_doctor(previous, status):
+                self.dao.update_one("doctors", {"_id": ObjectId(previous["assigned_doctor_id"])},
+                                    {"$inc": {"current_consultation_count": -1}})
+            # 完成的咨询计入医生收入日汇总（每个咨询只计入一次）
+            if self._earns(previous, status):
+                earnings_service.record_completion(consultation_id, previous["assigned_doctor_id"],
+                                                   previous.get("price_usdt", 0.0), previous.get("doctor_level"),
+                                                   update_data["completed_at"])
         except Exception as e:
             print(f"更新咨询状态时出错: {e}")
     
-    def send_chat_message(self, consultation_id: str, sender_id: str, sender_type: str, 
-                         message: str, message_type: str = "text", attachments: List[str] = None) -> ChatMessage:
-        """发送聊天消息"""
-        if attachments is None:
-            attachments = []
-        
-        message_dict = {
+    @staticmethod
+    def _earns(previous: Optional[dict], status: ConsultationStatus) -> bool:
+        """已分配医生的咨询变为已完成"""
+        return bool(previous and previous.get("assigned_doctor_id")
+                    and ConsultationStatus(status) == ConsultationStatus.COMPLETED)
+    
+    @staticmethod
+    def _releases_doctor(previous: Optional[dict], status: ConsultationStatus) -> bool:
+        """咨询从已支付/进行中变为其他状态时，释放已分配医生的负载"""
+        return bool(previous and previous.get("assigned_doctor_id")
+                    and previous.get("status") in LOAD_STATUSES
+                    and ConsultationStatus(status).value not in LOAD_STATUSES)
+    
+    @staticmethod
+    def _chat_message_document(consultation_id: str, sender_id: str, sender_type: str, message: str,
+                               message_type: str = "text", attachments: List[str] = None) -> dict:
+        """待插入的聊天消息文档"""
+        now = datetime.utcnow()
+        return {
             "consultation_id": consultation_id,
             "sender_id": sender_id,
             "sender_type": sender_type,
             "message": message,
             "message_type": message_type,
-            "attachments": attachments,
-            "created_at": datetime.utcnow()
+            "attachments": attachments or [],
+            # MongoDB只保存到毫秒，截断后返回值与库中一致（游标分页依赖精确的created_at）
+            "created_at": now.replace(microsecond=now.microsecond // 1000 * 1000)
         }
-        
-        # 插入数据库
-        self.dao.insert(self.CHAT_MESSAGE_COLLECTION, message_dict)
-        
-        # 返回创建的消息
-        return self.get_latest_message_by_consultation(consultation_id)
     
-    def get_chat_messages(self, consultation_id: str, skip: int = 0, limit: int = 50) -> List[ChatMessage]:
-        """获取聊天消息列表"""
+    @staticmethod
+    def _inserted_message(message_dict: dict) -> ChatMessage:
+        """由已插入的文档（insert后带有_id）构造消息，无需再查询"""
+        message_dict["id"] = message_dict.pop("_id")
+        return ChatMessage(**message_dict)
+    
+    def send_chat_message(self, consultation_id: str, sender_id: str, sender_type: str, 
+                         message: str, message_type: str = "text", attachments: List[str] = None) -> Optional[ChatMessage]:
+        """发送聊天消息，插入失败时返回None"""
+        message_dict = self._chat_message_document(consultation_id, sender_id, sender_type, message,
+                                                   message_type, attachments)
+        if not self.dao.insert(self.CHAT_MESSAGE_COLLECTION, message_dict):
+            return None
+        return self._inserted_message(message_dict)
+    
+    def send_chat_messages(self, messages: List[dict]) -> List[ChatMessage]:
+        """
+        批量发送消息（系统消息、机器人消息等），一次insert_many
+        :param messages: 每项包含 consultation_id, sender_id, sender_type, message，可选 message_type, attachments
+        """
+        documents = [self._chat_message_document(**message) for message in messages]
+        if not documents:
+            return []
+        self.dao.insert_many(self.CHAT_MESSAGE_COLLECTION, documents)
+        return [self._inserted_message(document) for document in documents]
+    
+    @staticmethod
+    def message_payload(message: ChatMessage) -> dict:
+        """聊天消息的JSON表示（与消息接口的返回格式相同）"""
+        return ChatMessageResponse(
+            id=str(message.id),
+            consultation_id=message.consultation_id,
+            sender_id=message.sender_id,
+            sender_type=message.sender_type,
+            message=message.message,
+            message_type=message.message_type,
+            attachments=message.attachments,
+            created_at=message.created_at
+        ).model_dump(mode="json")
+    
+    def get_chat_messages(self, consultation_id: str, skip: int = 0, limit: int = 50,
+                          after: Optional[str] = None, before: Optional[str] = None) -> List[ChatMessage]:
+        """获取聊天消息列表，after/before 为游标分页参数"""
+        query, sort, reverse = self.CHAT_MESSAGE_KEYSET.page({"consultation_id": consultation_id}, after, before)
         try:
-            messages = self.dao._MongoDao__db[self.CHAT_MESSAGE_COLLECTION].find(
-                {"consultation_id": consultation_id}
-            ).sort("created_at", 1).skip(skip).limit(limit)
+            messages = self.dao.find(self.CHAT_MESSAGE_COLLECTION, query, sort=sort, skip=skip, limit=limit)
+            if reverse:
+                messages = messages[::-1]
             
             result = []
             for message in messages:
@@ -447,9 +632,10 @@ class ConsultationService:
     def get_latest_message_by_consultation(self, consultation_id: str) -> Optional[ChatMessage]:
         """获取咨询的最新消息"""
         try:
-            messages = self.dao._MongoDao__db[self.CHAT_MESSAGE_COLLECTION].find(
-                {"consultation_id": consultation_id}
-            ).sort("created_at", -1).limit(1)
+            messages = self.dao.find(
+                self.CHAT_MESSAGE_COLLECTION, {"consultation_id": consultation_id},
+                sort=[("created_at", -1)], limit=1
+            )
             
             for message in messages:
                 message["id"] = message.pop("_id")
@@ -495,15 +681,12 @@ class ConsultationService:
             from bson import ObjectId
             success = doctor_service.assign_doctor_to_consultation(
                 selected_doctor["id"], 
-                consultation_id
+                consultation_id,
+                available_only=True
             )
             
             if success:
-                # 更新咨询状态
-                self.update_consultation_status(
-                    consultation_id, 
-                    ConsultationStatus.IN_PROGRESS
-                )
+                # 认领时已把咨询状态更新为进行中
                 print(f"成功分配医生 {selected_doctor['name']} 到咨询 {consultation_id}")
                 return True
             
@@ -523,19 +706,17 @@ class ConsultationService:
                 "is_active": True
             }
             
-            doctors = self.dao._MongoDao__db["doctors"].find(query)
-            result = []
+            doctors = self.dao.find("doctors", query, projection=self.AVAILABLE_DOCTOR_PROJECTION)
             for doctor in doctors:
                 doctor["id"] = str(doctor.pop("_id"))
-                # 计算当前咨询数量
-                current_count = self.dao._MongoDao__db["consultations"].count_documents({
-                    "assigned_doctor_id": doctor["id"],
-                    "status": {"$in": [ConsultationStatus.IN_PROGRESS.value, ConsultationStatus.PAID.value]}
-                })
-                doctor["current_consultation_count"] = current_count
-                result.append(doctor)
             
-            return result
+            # 一次聚合计算所有候选医生的当前咨询数量
+            rows = self.dao.aggregate(self.CONSULTATION_COLLECTION, load_pipeline([doctor["id"] for doctor in doctors]))
+            loads = {row["_id"]: row["count"] for row in rows}
+            for doctor in doctors:
+                doctor["current_consultation_count"] = loads.get(doctor["id"], 0)
+            
+            return doctors
         except Exception as e:
             print(f"获取可用医生失败: {e}")
             return []
@@ -543,10 +724,12 @@ class ConsultationService:
     def get_unassigned_consultations(self, limit: int = 50):
         """获取未分配的咨询列表"""
         try:
-            consultations = self.dao._MongoDao__db[self.CONSULTATION_COLLECTION].find({
-                "status": ConsultationStatus.PAID.value,
-                "assigned_doctor_id": None
-            }).sort("created_at", 1).limit(limit)
+            consultations = self.dao.find(
+                self.CONSULTATION_COLLECTION,
+                {"status": ConsultationStatus.PAID.value, "assigned_doctor_id": None},
+                projection=self.UNASSIGNED_PROJECTION,
+                sort=[("created_at", 1)], limit=limit
+            )
             
             result = []
             for consultation in consultations:
@@ -558,5 +741,552 @@ class ConsultationService:
             print(f"获取未分配咨询失败: {e}")
             return []
 
+
+class AsyncConsultationService(ConsultationService):
+    """医疗咨询服务类（异步版本，基于Motor，供async路由使用）"""
+    
+    def __init__(self):
+        self.dao = async_mongo_dao
+    
+    async def create_consultation(self, user_id: str, consultation_data: ConsultationCreate) -> Optional[ConsultationInDB]:
+        """创建医疗咨询"""
+        try:
+            # 计算价格
+            if consultation_data.mode == ConsultationMode.REALTIME:
+                # 实时聊天模式：按分钟计费，先收取基础费用
+                price_usdt = 20.0  # 基础费用
+            else:
+                # 一次性咨询模式：根据医生等级定价
+                if not consultation_data.doctor_level:
+                    raise ValueError("一次性咨询必须选择医生等级")
+                package = self.get_package_by_level(consultation_data.doctor_level)
+                if not package:
+                    raise ValueError("无效的医生等级")
+                price_usdt = package.price_usdt
+            
+            now = datetime.utcnow()
+            consultation_dict = {
+                "user_id": str(user_id),
+                "mode": consultation_data.mode.value,
+                "disease_description": consultation_data.disease_description,
+                "symptoms": consultation_data.symptoms or "",
+                "medical_history": consultation_data.medical_history or "",
+                "attachments": consultation_data.attachments or [],
+                "package_id": consultation_data.package_id,
+                "doctor_level": consultation_data.doctor_level.value if consultation_data.doctor_level else None,
+                "status": ConsultationStatus.PENDING.value,
+                "assigned_doctor_id": None,
+                "price_usdt": float(price_usdt),
+                "payment_order_id": None,
+                "created_at": now,
+                "updated_at": now,
+                "started_at": None,
+                "completed_at": None
+            }
+            
+            result = await self.dao.insert(self.CONSULTATION_COLLECTION, consultation_dict)
+            if not result or not result.inserted_id:
+                print("❌ 插入操作失败")
+                return None
+            
+            consultation_dict["id"] = consultation_dict.pop("_id", result.inserted_id)
+            return ConsultationInDB(**consultation_dict)
+        except Exception as e:
+            print(f"创建咨询时出错: {e}")
+            import traceback
+            traceback.print_exc()
+            return None
+    
+    async def get_consultation_by_id(self, consultation_id: str) -> Optional[ConsultationInDB]:
+        """根据ID获取咨询记录"""
+        try:
+            consultation_data = await self.dao.find_one(self.CONSULTATION_COLLECTION, {"_id": ObjectId(consultation_id)})
+            if consultation_data:
+                consultation_data["id"] = consultation_data.pop("_id")
+                normalized_data = self._normalize_consultation_data(consultation_data)
+                return ConsultationInDB(**normalized_data)
+        except Exception as e:
+            print(f"获取咨询记录时出错: {e}")
+        return None
+    
+    async def can_access_attachment(self, blob_id: str, user_id: Optional[str] = None, doctor_id: Optional[str] = None) -> bool:
+        """用户或医生是否可以下载附件"""
+        query = self._attachment_access_query(blob_id, user_id, doctor_id)
+        return bool(query) and await self.dao.find_one(self.CONSULTATION_COLLECTION, query, {"_id": 1}) is not None
+    
+    async def get_consultation_by_user_and_latest(self, user_id: str) -> Optional[ConsultationInDB]:
+        """获取用户最新的咨询记录"""
+        try:
+            consultations = await self.dao.find(
+                self.CONSULTATION_COLLECTION, {"user_id": user_id},
+                sort=[("created_at", -1)], limit=1
+            )
+            for consultation in consultations:
+                consultation["id"] = consultation.pop("_id")
+                return ConsultationInDB(**self._normalize_consultation_data(consultation))
+        except Exception as e:
+            print(f"获取用户咨询记录时出错: {e}")
+        return None
+    
+    async def get_user_consultations(self, user_id: str, skip: int = 0, limit: int = 20,
+                                     after: Optional[str] = None, before: Optional[str] = None) -> List[ConsultationInDB]:
+        """获取用户的咨询记录列表，after/before 为游标分页参数"""
+        query, sort, reverse = self.USER_CONSULTATION_KEYSET.page({"user_id": user_id}, after, before)
+        result = []
+        try:
+            async for consultation in self.dao.iterate(
+                self.CONSULTATION_COLLECTION, query, sort=sort, skip=skip, limit=limit
+            ):
+                consultation["id"] = consultation.pop("_id")
+                consultation_data = self._normalize_consultation_data(consultation)
+                try:
+                    result.append(ConsultationInDB(**consultation_data))
+                except Exception as e:
+                    print(f"转换咨询记录失败: {e}")
+                    continue
+        except Exception as e:
+            print(f"获取用户咨询列表时出错: {e}")
+        return result[::-1] if reverse else result
+    
+    async def create_payment_order(self, consultation_id: str, user_id: str, usdt_address: str) -> PaymentOrder:
+        """创建支付订单"""
+        consultation = await self.get_consultation_by_id(consultation_id)
+        if not consultation:
+            raise ValueError("咨询记录不存在")
+        
+        if consultation.user_id != user_id:
+            raise ValueError("无权限访问此咨询记录")
+        
+        order_id = ObjectId()
+        now = datetime.utcnow()
+        expires_at = now + timedelta(hours=PAYMENT_ORDER_HOURS)
+        
+        for amount_sun in self._candidate_amounts(consultation.price_usdt):
+            key = self._deposit_key(usdt_address, amount_sun)
+            try:
+                await self.dao.find_one_and_update(self.DEPOSIT_KEY_COLLECTION, *self._claim_deposit_key(
+                    key, order_id, consultation_id, now, expires_at), upsert=True)
+                break
+            except DuplicateKeyError:
+                continue
+        else:
+            raise ValueError("当前待支付订单过多，请稍后重试")
+        
+        payment_order_dict = self._payment_order_document(order_id, consultation_id, user_id, usdt_address,
+                                                          amount_sun, key, now, expires_at)
+        
+        await self.dao.insert(self.PAYMENT_ORDER_COLLECTION, payment_order_dict)
+        await self._publish_status(consultation_id, payment_status=PaymentStatus.PENDING.value)
+        return await self.get_payment_order_by_consultation(consultation_id)
+    
+    async def get_payment_order_by_consultation(self, consultation_id: str) -> Optional[PaymentOrder]:
+        """根据咨询ID获取支付订单"""
+        try:
+            order_data = await self.dao.find_one(self.PAYMENT_ORDER_COLLECTION, {"consultation_id": consultation_id})
+            if order_data:
+                order_data["id"] = order_data.pop("_id")
+                return PaymentOrder(**order_data)
+        except Exception as e:
+            print(f"获取支付订单时出错: {e}")
+        return None
+    
+    async def get_payment_order_by_id(self, order_id: str) -> Optional[PaymentOrder]:
+        """根据订单ID获取支付订单"""
+        try:
+            order_data = await self.dao.find_one(self.PAYMENT_ORDER_COLLECTION, {"_id": ObjectId(order_id)})
+            if order_data:
+                order_data["id"] = order_data.pop("_id")
+                return PaymentOrder(**order_data)
+        except Exception as e:
+            print(f"获取支付订单时出错: {e}")
+        return None
+    
+    async def check_payment_status(self, consultation_id: str) -> PaymentStatus:
+        """检查支付状态"""
+        status, _ = await self.check_payment_order(consultation_id)
+        return status
+    
+    async def check_payment_order(self, consultation_id: str):
+        """
+        检查支付状态，只读订单：过期由 expire_payment_orders 定时批量处理
+        :return: (PaymentStatus, PaymentOrder或None)
+        """
+        payment_order = await self.get_payment_order_by_consultation(consultation_id)
+        if not payment_order:
+            return PaymentStatus.FAILED, None
+        
+        if payment_order.status != PaymentStatus.PENDING:
+            return payment_order.status, payment_order
+        
+        # 已过期但定时任务还没处理到
+        if datetime.utcnow() > payment_order.expires_at:
+            return PaymentStatus.EXPIRED, payment_order
+        
+        if payment_order.transaction_hash:
+            await self.update_payment_status(consultation_id, PaymentStatus.PAID)
+            return PaymentStatus.PAID, payment_order
+        
+        return PaymentStatus.PENDING, payment_order
+    
+    async def update_payment_status(self, consultation_id: str, status: PaymentStatus, transaction_hash: str = None):
+        """更新支付状态"""
+        try:
+            update_data = {
+                "status": status,
+                "updated_at": datetime.utcnow()
+            }
+            if transaction_hash:
+                update_data["transaction_hash"] = transaction_hash
+            
+            await self.dao.update(self.PAYMENT_ORDER_COLLECTION, "consultation_id", consultation_id, update_data)
+            
+            if status == PaymentStatus.PAID:
+                # 支付成功后咨询变为已支付，并立即进入分配队列
+                await self.update_consultation_status(consultation_id, ConsultationStatus.PAID)
+                from services.assignment_engine import assignment_engine
+                assignment_engine.submit(consultation_id)
+            else:
+                await self._publish_status(consultation_id, payment_status=getattr(status, "value", status))
+        except Exception as e:
+            print(f"更新支付状态时出错: {e}")
+    
+    async def get_oldest_pending_payment(self, usdt_address: str, now: Optional[datetime] = None) -> Optional[dict]:
+        """某个收款地址下最早创建的未过期待支付订单，没有时返回None（支付监听据此决定是否查询链上）"""
+        return await self.dao.find_one(
+            self.PAYMENT_ORDER_COLLECTION,
+            {"usdt_address": usdt_address, "status": PaymentStatus.PENDING,
+             "expires_at": {"$gt": now or datetime.utcnow()}},
+            projection={"created_at": 1}, sort=[("created_at", 1)]
+        )
+    
+    async def get_deposit_keys(self, usdt_address: str, amounts_sun: List[int]) -> Dict[int, dict]:
+        """
+        一次查询取出一批到账金额对应的收款键
+        :return: {金额(最小单位): {"order_id", "created_at", "expires_at", ...}}
+        """
+        keys = {self._deposit_key(usdt_address, amount): amount for amount in amounts_sun}
+        if not keys:
+            return {}
+        documents = await self.dao.find(self.DEPOSIT_KEY_COLLECTION, {"_id": {"$in": list(keys)}})
+        return {keys[document["_id"]]: document for document in documents}
+    
+    async def get_untagged_pending_orders(self, usdt_address: str, now: Optional[datetime] = None) -> List[dict]:
+        """没有收款键的待支付订单（收款键上线之前创建的），只能按金额匹配"""
+        return await self.dao.find(
+            self.PAYMENT_ORDER_COLLECTION,
+            {"usdt_address": usdt_address, "status": PaymentStatus.PENDING,
+             "expires_at": {"$gt": now or datetime.utcnow()}, "deposit_key": {"$exists": False}},
+            projection={"consultation_id": 1, "amount_usdt": 1, "created_at": 1},
+            sort=[("created_at", 1)]
+        )
+    
+    async def get_used_transaction_hashes(self, transaction_hashes: List[str]) -> set:
+        """已经确认过订单的交易哈希"""
+        if not transaction_hashes:
+            return set()
+        orders = await self.dao.find(self.PAYMENT_ORDER_COLLECTION,
+                                     {"transaction_hash": {"$in": list(transaction_hashes)}},
+                                     projection={"transaction_hash": 1})
+        return {order["transaction_hash"] for order in orders}
+    
+    async def confirm_payment(self, order_id, transaction_hash: str, paid_at: Optional[datetime] = None) -> Optional[dict]:
+        """
+        链上到账后确认订单：只有仍在待支付的订单会变为已支付，随后咨询进入分配队列
+        :return: 被确认的订单，订单已不是待支付状态或交易已被使用时返回None
+        """
+        now = datetime.utcnow()
+        try:
+            order = await self.dao.find_one_and_update(
+                self.PAYMENT_ORDER_COLLECTION, {"_id": ObjectId(order_id), "status": PaymentStatus.PENDING},
+                {"$set": {"status": PaymentStatus.PAID, "transaction_hash": transaction_hash,
+                          "paid_at": paid_at or now, "updated_at": now}},
+                projection={"consultation_id": 1}
+            )
+        except DuplicateKeyError:
+            return None
+        if not order:
+            return None
+        await self.update_consultation_status(order["consultation_id"], ConsultationStatus.PAID)
+        from services.assignment_engine import assignment_engine
+        assignment_engine.submit(order["consultation_id"])
+        return order
+    
+    async def get_payment_watch_cursor(self, usdt_address: str) -> Optional[int]:
+        """支付监听上次扫描到的区块时间（毫秒）"""
+        state = await self.dao.find_one(self.PAYMENT_WATCH_COLLECTION, {"_id": usdt_address})
+        return state["cursor"] if state else None
+    
+    async def save_payment_watch_cursor(self, usdt_address: str, cursor: int):
+        await self.dao.update_one(self.PAYMENT_WATCH_COLLECTION, {"_id": usdt_address},
+                                  {"$set": {"cursor": cursor, "updated_at": datetime.utcnow()}}, upsert=True)
+    
+    async def expire_payment_orders(self, batch_size: int = PAYMENT_EXPIRY_BATCH, now: Optional[datetime] = None) -> int:
+        """
+        把到期的待支付订单分批标记为过期，对应的待支付咨询改为已取消，并释放收款键
+        :return: 过期的订单数量
+        """
+        now = now or datetime.utcnow()
+        expired = 0
+        while True:
+            orders = await self.dao.find(
+                self.PAYMENT_ORDER_COLLECTION,
+                {"status": PaymentStatus.PENDING, "expires_at": {"$lte": now}},
+                projection={"consultation_id": 1}, limit=batch_size
+            )
+            if not orders:
+                return expired
+            
+            # 条件中带上status，与支付监听并发确认的订单不会被改为过期
+            order_ids = [order["_id"] for order in orders]
+            result = await self.dao.update_many(
+                self.PAYMENT_ORDER_COLLECTION,
+                {"_id": {"$in": order_ids}, "status": PaymentStatus.PENDING},
+                {"$set": {"status": PaymentStatus.EXPIRED, "updated_at": now}}
+            )
+            expired += result.modified_count
+            
+            # 后续处理只针对本次真正改为过期的订单：查询与更新之间被确认支付的订单不能取消咨询或通知过期
+            if result.modified_count < len(orders):
+                orders = await self.dao.find(
+                    self.PAYMENT_ORDER_COLLECTION,
+                    {"_id": {"$in": order_ids}, "status": PaymentStatus.EXPIRED, "updated_at": now},
+                    projection={"consultation_id": 1}
+                )
+            consultation_ids = [order["consultation_id"] for order in orders]
+            await self.dao.update_many(
+                self.CONSULTATION_COLLECTION,
+                {"_id": {"$in": [ObjectId(consultation_id) for consultation_id in consultation_ids]},
+                 "status": ConsultationStatus.PENDING},
+                {"$set": {"status": ConsultationStatus.CANCELLED, "updated_at": now}}
+            )
+            # 收款键可能已被新订单重新占用，只删除仍属于这些订单的
+            await self.dao.delete(self.DEPOSIT_KEY_COLLECTION, "order_id",
+                                  {"$in": [order["_id"] for order in orders]})
+            for consultation_id in consultation_ids:
+                await self._publish_status(consultation_id, payment_status=PaymentStatus.EXPIRED.value)
+            
+            if len(order_ids) < batch_size:
+                return expired
+    
+    async def update_consultation_status(self, consultation_id: str, status: ConsultationStatus):
+        """更新咨询状态"""
+        try:
+            update_data = {
+                "status": status,
+                "updated_at": datetime.utcnow()
+            }
+            
+            if status == ConsultationStatus.IN_PROGRESS:
+                update_data["started_at"] = datetime.utcnow()
+            elif status == ConsultationStatus.COMPLETED:
+                update_data["completed_at"] = datetime.utcnow()
+            
+            previous = await self.dao.find_one_and_update(
+                self.CONSULTATION_COLLECTION, {"_id": ObjectId(consultation_id)}, {"$set": update_data},
+                projection=self.STATUS_CHANGE_PROJECTION, return_document="before"
+            )
+            # 咨询结束时释放医生负载（只在从已支付/进行中离开时释放一次）
+            if self._releases_doctor(previous, status):
+                await self.dao.update_one("doctors", {"_id": ObjectId(previous["assigned_doctor_id"])},
+                                          {"$inc": {"current_consultation_count": -1}})
+                doctor_load_index.adjust_load(previous["assigned_doctor_id"], -1)
+            if self._earns(previous, status):
+                await async_earnings_service.record_completion(
+                    consultation_id, previous["assigned_doctor_id"], previous.get("price_usdt", 0.0),
+                    previous.get("doctor_level"), update_data["completed_at"]
+                )
+            if previous:
+                await self._publish_status(consultation_id, status=getattr(status, "value", status))
+        except Exception as e:
+            print(f"更新咨询状态时出错: {e}")
+    
+    async def send_chat_message(self, consultation_id: str, sender_id: str, sender_type: str, 
+                                message: str, message_type: str = "text", attachments: List[str] = None) -> Optional[ChatMessage]:
+        """发送聊天消息，插入失败时返回None"""
+        message_dict = self._chat_message_document(consultation_id, sender_id, sender_type, message,
+                                                   message_type, attachments)
+        if not await self.dao.insert(self.CHAT_MESSAGE_COLLECTION, message_dict):
+            return None
+        message = self._inserted_message(message_dict)
+        await self._publish_messages([message])
+        return message
+    
+    async def send_chat_messages(self, messages: List[dict]) -> List[ChatMessage]:
+        """
+        批量发送消息（系统消息、机器人消息等），一次insert_many
+        :param messages: 每项包含 consultation_id, sender_id, sender_type, message，可选 message_type, attachments
+        """
+        documents = [self._chat_message_document(**message) for message in messages]
+        if not documents:
+            return []
+        await self.dao.insert_many(self.CHAT_MESSAGE_COLLECTION, documents)
+        result = [self._inserted_message(document) for document in documents]
+        await self._publish_messages(result)
+        return result
+    
+    async def _publish_messages(self, messages: List[ChatMessage]):
+        """推送给正在查看该咨询的WebSocket/SSE连接"""
+        from services.chat_hub import chat_hub
+        for message in messages:
+            await chat_hub.notify(message.consultation_id, {"type": "message", "message": self.message_payload(message)})
+    
+    async def _publish_status(self, consultation_id: str, **fields):
+        """推送状态变化给正在查看该咨询的WebSocket/SSE连接"""
+        from services.chat_hub import chat_hub
+        await chat_hub.notify(consultation_id, dict(fields, type="status"))
+    
+    async def get_poll_version(self, consultation_id: str, scope: str) -> str:
+        """
+        轮询接口ETag的版本号，由数据库中的数据派生，所有worker、所有写入路径（包括同步服务）看到的都一样：
+        咨询的 updated_at（状态、医生分配），加上 scope="messages" 时的消息数量和最新消息ID，
+        或 scope="payment" 时支付订单的状态和 updated_at。每个查询只走索引、只取一两个字段
+        """
+        if not ObjectId.is_valid(consultation_id):
+            return "0"
+        consultation = await self.dao.find_one(self.CONSULTATION_COLLECTION, {"_id": ObjectId(consultation_id)},
+                                               projection={"updated_at": 1})
+        parts = [_version_part(consultation.get("updated_at") if consultation else None)]
+        if scope == "messages":
+            query = {"consultation_id": consultation_id}
+            # 数量能发现时钟稍慢的worker写入的、不是最新的消息
+            count = await self.dao.count(self.CHAT_MESSAGE_COLLECTION, query)
+            latest = await self.dao.find_one(self.CHAT_MESSAGE_COLLECTION, query, projection={"_id": 1},
+                                             sort=[("created_at", -1), ("_id", -1)])
+            parts += [str(count), str(latest["_id"]) if latest else "-"]
+        else:
+            order = await self.dao.find_one(self.PAYMENT_ORDER_COLLECTION, {"consultation_id": consultation_id},
+                                            projection={"status": 1, "updated_at": 1})
+            parts += [getattr(order["status"], "value", order["status"]) if order else "-",
+                      _version_part(order.get("updated_at") if order else None)]
+        return ".".join(parts)
+    
+    async def get_chat_messages(self, consultation_id: str, skip: int = 0, limit: int = 50,
+                                after: Optional[str] = None, before: Optional[str] = None) -> List[ChatMessage]:
+        """获取聊天消息列表，after/before 为游标分页参数"""
+        query, sort, reverse = self.CHAT_MESSAGE_KEYSET.page({"consultation_id": consultation_id}, after, before)
+        result = []
+        try:
+            async for message in self.dao.iterate(
+                self.CHAT_MESSAGE_COLLECTION, query, sort=sort, skip=skip, limit=limit
+            ):
+                message["id"] = message.pop("_id")
+                result.append(ChatMessage(**message))
+        except Exception as e:
+            print(f"获取聊天消息时出错: {e}")
+        return result[::-1] if reverse else result
+    
+    async def get_chat_messages_since(self, consultation_id: str, since: str, limit: int = 50) -> List[ChatMessage]:
+        """
+        增量获取聊天消息：since 为最后收到的消息ID或ISO时间，返回其后的消息
+        :raise InvalidCursor: since 无法解析
+        """
+        if ObjectId.is_valid(since):
+            last = await self.dao.find_one(self.CHAT_MESSAGE_COLLECTION,
+                                           {"_id": ObjectId(since), "consultation_id": consultation_id},
+                                           projection={"created_at": 1})
+            if not last:
+                raise InvalidCursor(f"消息不存在: {since}")
+            cursor = self.CHAT_MESSAGE_KEYSET.cursor(last)
+        else:
+            try:
+                timestamp = datetime.fromisoformat(since.replace("Z", "+00:00"))
+            except ValueError:
+                raise InvalidCursor(f"无效的since参数: {since}")
+            if timestamp.tzinfo:
+                timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+            # 时间点之后的消息：以该时间和最大的ObjectId为边界
+            cursor = encode_cursor(timestamp, ObjectId("f" * 24))
+        return await self.get_chat_messages(consultation_id, limit=limit, after=cursor)
+    
+    async def get_latest_message_by_consultation(self, consultation_id: str) -> Optional[ChatMessage]:
+        """获取咨询的最新消息"""
+        try:
+            messages = await self.dao.find(
+                self.CHAT_MESSAGE_COLLECTION, {"consultation_id": consultation_id},
+                sort=[("created_at", -1)], limit=1
+            )
+            for message in messages:
+                message["id"] = message.pop("_id")
+                return ChatMessage(**message)
+        except Exception as e:
+            print(f"获取最新消息时出错: {e}")
+        return None
+    
+    async def auto_assign_doctor(self, consultation_id: str) -> bool:
+        """自动分配医生到咨询"""
+        try:
+            consultation = await self.get_consultation_by_id(consultation_id)
+            if not consultation or consultation.assigned_doctor_id:
+                print(f"咨询 {consultation_id} 不存在或已分配医生")
+                return False
+            
+            doctor_level = DoctorLevel(consultation.doctor_level)
+            from services.doctor_service import async_doctor_service
+            if not doctor_load_index.loaded:
+                await async_doctor_service.reconcile_load_index()
+            
+            # 从负载索引中取当前咨询数量最少的在线医生并立即占用，并发分配不会选中同一个医生
+            selected_doctor = doctor_load_index.reserve(doctor_level)
+            if not selected_doctor:
+                print(f"没有可用的{doctor_level.value}级医生")
+                return False
+            
+            # 分配失败时由 assign_doctor_to_consultation 释放占用
+            success = await async_doctor_service.assign_doctor_to_consultation(
+                selected_doctor["id"], 
+                consultation_id,
+                reserved=True
+            )
+            
+            if success:
+                # 认领时已把咨询状态更新为进行中
+                print(f"成功分配医生 {selected_doctor['name']} 到咨询 {consultation_id}")
+                return True
+            
+            return False
+        except Exception as e:
+            print(f"自动分配医生失败: {e}")
+            return False
+    
+    async def get_available_doctors_by_level(self, doctor_level: DoctorLevel, 
+                                             status: DoctorStatus = DoctorStatus.ACTIVE):
+        """根据等级获取可用医生"""
+        result = []
+        try:
+            query = {
+                "level": doctor_level.value,
+                "status": status.value,
+                "is_active": True
+            }
+            
+            async for doctor in self.dao.iterate("doctors", query, projection=self.AVAILABLE_DOCTOR_PROJECTION):
+                doctor["id"] = str(doctor.pop("_id"))
+                result.append(doctor)
+            
+            rows = await self.dao.aggregate(self.CONSULTATION_COLLECTION, load_pipeline([doctor["id"] for doctor in result]))
+            loads = {row["_id"]: row["count"] for row in rows}
+            for doctor in result:
+                doctor["current_consultation_count"] = loads.get(doctor["id"], 0)
+        except Exception as e:
+            print(f"获取可用医生失败: {e}")
+        return result
+    
+    async def get_unassigned_consultations(self, limit: int = 50):
+        """获取未分配的咨询列表"""
+        result = []
+        try:
+            async for consultation in self.dao.iterate(
+                self.CONSULTATION_COLLECTION,
+                {"status": ConsultationStatus.PAID.value, "assigned_doctor_id": None},
+                projection=self.UNASSIGNED_PROJECTION,
+                sort=[("created_at", 1)], limit=limit
+            ):
+                consultation["id"] = str(consultation.pop("_id"))
+                result.append(consultation)
+        except Exception as e:
+            print(f"获取未分配咨询失败: {e}")
+        return result
+
 # 创建全局咨询服务实例
-consultation_service = ConsultationService()
+consultation_service = LazyInstance(ConsultationService)
+async_consultation_service = LazyInstance(AsyncConsultationService)
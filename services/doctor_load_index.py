@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+医生负载索引
+
+按医生等级维护一个以当前咨询数量为键的最小堆，分配时 O(log n) 取出负载最小的在线医生，
+不再对每个候选医生执行 count_documents。分配/完成/状态变化时增量更新，
+并定期用一次聚合查询与数据库对齐（其他进程的分配也会在对齐时反映进来）。
+
+自动分配用 reserve() 在锁内选出医生并立即占用（负载加一、标记忙碌），
+并发的分配不会选中同一个医生；分配失败时用 release() 归还。
+
+堆采用延迟删除：医生信息变化时压入新条目并增加版本号，旧条目在出堆时丢弃。
+"""
+
+import os
+import heapq
+import itertools
+import threading
+from utils.lazy_instance import LazyInstance
+
+ACTIVE = "active"
+BUSY = "busy"
+# 自动分配时医生同时进行中的咨询数量上限
+DOCTOR_MAX_CONSULTATIONS = int(os.getenv('DOCTOR_MAX_CONSULTATIONS', 5))
+# 计入医生当前负载的咨询状态
+LOAD_STATUSES = ["in_progress", "paid"]
+
+
+def load_pipeline(doctor_ids=None):
+    """
+    one aggregation over consultations: assigned_doctor_id -> number of PAID/IN_PROGRESS consultations
+    """
+    match = {"status": {"$in": LOAD_STATUSES}, "assigned_doctor_id": {"$ne": None}}
+    if doctor_ids is not None:
+        match["assigned_doctor_id"] = {"$in": list(doctor_ids)}
+    return [
+        {"$match": match},
+        {"$group": {"_id": "$assigned_doctor_id", "count": {"$sum": 1}}},
+    ]
+
+
+def _value(item):
+    return getattr(item, "value", item)
+
+
+class DoctorLoadIndex:
+    """
+    doctor_id -> {"level", "status", "load", "name"} plus one heap of (load, seq, doctor_id) per level.
+    Only ACTIVE doctors are pushed onto the heaps.
+    """
+    def __init__(self):
+        self._doctors = {}
+        self._heaps = {}
+        # 每次变更分配递增序号：同负载时最久未被分配的医生优先
+        self._seq = itertools.count()
+        self._lock = threading.RLock()
+        self.loaded = False
+
+    def _push(self, doctor_id):
+        doctor = self._doctors[doctor_id]
+        doctor["seq"] = next(self._seq)
+        if doctor["status"] != ACTIVE:
+            return
+        heap = self._heaps.setdefault(doctor["level"], [])
+        heapq.heappush(heap, (doctor["load"], doctor["seq"], doctor_id))
+        # 过期条目过多时重建，避免堆无限增长
+        if len(heap) > 2 * len(self._doctors) + 16:
+            self._rebuild(doctor["level"])
+
+    def _rebuild(self, level):
+        heap = [
+            (doctor["load"], doctor["seq"], doctor_id)
+            for doctor_id, doctor in self._doctors.items()
+            if doctor["level"] == level and doctor["status"] == ACTIVE
+        ]
+        heapq.heapify(heap)
+        self._heaps[level] = heap
+
+    def __contains__(self, doctor_id):
+        return doctor_id in self._doctors
+
+    def upsert(self, doctor_id, level, status, load=None, name=None):
+        with self._lock:
+            current = self._doctors.get(doctor_id, {"load": 0, "name": None})
+            self._doctors[doctor_id] = {
+                "level": _value(level),
+                "status": _value(status),
+                "load": current["load"] if load is None else load,
+                "name": name or current["name"],
+            }
+            self._push(doctor_id)
+
+    def remove(self, doctor_id):
+        with self._lock:
+            self._doctors.pop(doctor_id, None)
+
+    def set_status(self, doctor_id, status):
+        """
+        :return: False if the doctor is unknown (caller should upsert it)
+        """
+        with self._lock:
+            doctor = self._doctors.get(doctor_id)
+            if doctor is None:
+                return False
+            doctor["status"] = _value(status)
+            self._push(doctor_id)
+            return True
+
+    def adjust_load(self, doctor_id, delta):
+        with self._lock:
+            doctor = self._doctors.get(doctor_id)
+            if doctor is None:
+                return False
+            doctor["load"] = max(0, doctor["load"] + delta)
+            self._push(doctor_id)
+            return True
+
+    def least_loaded(self, level):
+        """
+        O(log n) amortised
+        :return: {"id", "name", "level", "load"} of the least loaded ACTIVE doctor of the level, or None
+        """
+        with self._lock:
+            heap = self._heaps.get(_value(level), [])
+            while heap:
+                load, seq, doctor_id = heap[0]
+                doctor = self._doctors.get(doctor_id)
+                if doctor and doctor["seq"] == seq and doctor["status"] == ACTIVE:
+                    return {"id": doctor_id, "name": doctor["name"], "level": doctor["level"], "load": load}
+                heapq.heappop(heap)
+            return None
+
+    def reserve(self, level, max_load=None):
+        """
+        pick the least loaded ACTIVE doctor of the level and take a slot on it in the same locked step
+        (load + 1, status BUSY), so concurrent assignments never pick the same doctor
+        :param max_load: doctors already at this load are not picked, defaults to DOCTOR_MAX_CONSULTATIONS
+        :return: like least_loaded(), or None; undo with release() if the assignment fails
+        """
+        max_load = DOCTOR_MAX_CONSULTATIONS if max_load is None else max_load
+        with self._lock:
+            doctor = self.least_loaded(level)
+            if doctor is None or doctor["load"] >= max_load:
+                return None
+            current = self._doctors[doctor["id"]]
+            current["load"] += 1
+            current["status"] = BUSY
+            self._push(doctor["id"])
+            return doctor
+
+    def release(self, doctor_id, status=ACTIVE):
+        """
+        undo reserve(): load - 1 and set the doctor's status (ACTIVE unless the database says otherwise)
+        """
+        with self._lock:
+            doctor = self._doctors.get(doctor_id)
+            if doctor is None:
+                return False
+            doctor["load"] = max(0, doctor["load"] - 1)
+            doctor["status"] = _value(status)
+            self._push(doctor_id)
+            return True
+
+    def reconcile(self, doctors, loads):
+        """
+        replace the whole index with the database state
+        :param doctors: iterable of doctor dicts with "id", "level", "status" and optionally "name"
+        :param loads: dict doctor_id -> number of PAID/IN_PROGRESS consultations
+        """
+        with self._lock:
+            self._doctors = {}
+            self._heaps = {}
+            for doctor in doctors:
+                doctor_id = str(doctor["id"])
+                self._doctors[doctor_id] = {
+                    "level": _value(doctor["level"]),
+                    "status": _value(doctor["status"]),
+                    "load": loads.get(doctor_id, 0),
+                    "name": doctor.get("name"),
+                    "seq": next(self._seq),
+                }
+            for level in {doctor["level"] for doctor in self._doctors.values()}:
+                self._rebuild(level)
+            self.loaded = True
+
+    def snapshot(self):
+        with self._lock:
+            levels = {}
+            for doctor in self._doctors.values():
+                stats = levels.setdefault(doctor["level"], {"doctors": 0, "active": 0, "load": 0})
+                stats["doctors"] += 1
+                stats["active"] += doctor["status"] == ACTIVE
+                stats["load"] += doctor["load"]
+            return {"loaded": self.loaded, "levels": levels}
+
+
+doctor_load_index = LazyInstance(DoctorLoadIndex)
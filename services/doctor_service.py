@@ -5,14 +5,20 @@
 """
 
 from typing import Optional, List, Dict, Any
-from datetime import datetime, timedelta
+from datetime import datetime
 from bson import ObjectId
 from utils.mongo_dao import mongo_dao
+from utils.async_mongo_dao import async_mongo_dao
+from utils.lazy_instance import LazyInstance
+from utils.mongo_indexes import IndexSpec
 from models.doctor import (
     DoctorInDB, DoctorCreate, DoctorUpdate, DoctorResponse, 
     DoctorEarnings, DoctorAssignment, DoctorLevel, DoctorStatus, DoctorSpecialty
 )
 from models.consultation import ConsultationStatus
+from services.doctor_load_index import doctor_load_index, load_pipeline, DOCTOR_MAX_CONSULTATIONS
+from services.earnings_service import earnings_service, async_earnings_service
+from utils.pagination import Keyset
 
 class DoctorService:
     """医生服务类"""
@@ -20,27 +26,35 @@ class DoctorService:
     COLLECTION_NAME = "doctors"
     ASSIGNMENT_COLLECTION = "doctor_assignments"
     
+    # 声明式索引，由 services.index_service 统一应用
+    INDEXES = {
+        COLLECTION_NAME: [
+            IndexSpec("google_id", unique=True),
+            IndexSpec("email"),
+            IndexSpec("license_number", unique=True),
+            IndexSpec("status"),
+            IndexSpec("specialties"),
+            # 按等级筛选可用医生
+            IndexSpec([("level", 1), ("status", 1), ("is_active", 1)]),
+            # 医生列表游标分页
+            IndexSpec([("created_at", 1), ("_id", 1)]),
+        ],
+        ASSIGNMENT_COLLECTION: [
+            # 医生的咨询列表，按分配时间倒序（consultation_id 唯一，作为游标分页的次序键）
+            IndexSpec([("doctor_id", 1), ("assigned_at", -1), ("consultation_id", -1)]),
+            IndexSpec("consultation_id"),
+        ]
+    }
+    
+    # 负载索引只需要等级和状态
+    LOAD_INDEX_PROJECTION = {"name": 1, "level": 1, "status": 1}
+    
+    # 游标分页顺序：咨询列表按分配时间倒序，医生列表按注册时间
+    CONSULTATION_KEYSET = Keyset("assigned_at", "consultation_id", descending=True)
+    LIST_KEYSET = Keyset("created_at", "_id")
+    
     def __init__(self):
         self.dao = mongo_dao
-        self._ensure_indexes()
-    
-    def _ensure_indexes(self):
-        """确保数据库索引存在"""
-        try:
-            # 为google_id创建唯一索引
-            self.dao.create_index(self.COLLECTION_NAME, "google_id")
-            # 为email创建索引
-            self.dao.create_index(self.COLLECTION_NAME, "email")
-            # 为license_number创建唯一索引
-            self.dao.create_index(self.COLLECTION_NAME, "license_number")
-            # 为status创建索引
-            self.dao.create_index(self.COLLECTION_NAME, "status")
-            # 为specialties创建索引
-            self.dao.create_index(self.COLLECTION_NAME, "specialties")
-            # 为level创建索引
-            self.dao.create_index(self.COLLECTION_NAME, "level")
-        except Exception as e:
-            print(f"创建医生索引时出错: {e}")
     
     def create_doctor(self, doctor_data: DoctorCreate) -> DoctorInDB:
         """创建新医生"""
@@ -90,9 +104,8 @@ class DoctorService:
     
     def get_doctor_by_google_id(self, google_id: str) -> Optional[DoctorInDB]:
         """根据Google ID获取医生"""
-        doctors = self.dao.search(self.COLLECTION_NAME, "google_id", google_id)
-        if doctors:
-            doctor_data = doctors[0]
+        doctor_data = self.dao.find_one(self.COLLECTION_NAME, {"google_id": google_id})
+        if doctor_data:
             doctor_data["id"] = doctor_data.pop("_id")
             
             # 确保包含current_consultation_count字段
@@ -109,9 +122,8 @@ class DoctorService:
             if isinstance(doctor_id, str):
                 doctor_id = ObjectId(doctor_id)
             
-            doctors = self.dao.search(self.COLLECTION_NAME, "_id", doctor_id)
-            if doctors:
-                doctor_data = doctors[0]
+            doctor_data = self.dao.find_one(self.COLLECTION_NAME, {"_id": doctor_id})
+            if doctor_data:
                 doctor_data["id"] = doctor_data.pop("_id")
                 
                 # 确保包含current_consultation_count字段
@@ -125,9 +137,8 @@ class DoctorService:
     
     def get_doctor_by_email(self, email: str) -> Optional[DoctorInDB]:
         """根据邮箱获取医生"""
-        doctors = self.dao.search(self.COLLECTION_NAME, "email", email)
-        if doctors:
-            doctor_data = doctors[0]
+        doctor_data = self.dao.find_one(self.COLLECTION_NAME, {"email": email})
+        if doctor_data:
             doctor_data["id"] = doctor_data.pop("_id")
             
             # 确保包含current_consultation_count字段
@@ -141,7 +152,8 @@ class DoctorService:
         """更新医生登录信息"""
         try:
             # 使用MongoDB的$inc操作符增加登录次数
-            result = self.dao._MongoDao__db[self.COLLECTION_NAME].update_one(
+            result = self.dao.update_one(
+                self.COLLECTION_NAME,
                 {"_id": ObjectId(doctor_id)}, 
                 {
                     "$set": {
@@ -195,183 +207,175 @@ class DoctorService:
             if level:
                 query["level"] = level.value
             
-            doctors = self.dao._MongoDao__db[self.COLLECTION_NAME].find(query)
-            result = []
+            doctors = self.dao.find(self.COLLECTION_NAME, query)
             for doctor in doctors:
                 doctor["id"] = str(doctor.pop("_id"))
-                # 计算当前咨询数量
-                current_count = self.dao._MongoDao__db["consultations"].count_documents({
-                    "assigned_doctor_id": doctor["id"],
-                    "status": {"$in": [ConsultationStatus.IN_PROGRESS.value, ConsultationStatus.PAID.value]}
-                })
-                doctor["current_consultation_count"] = current_count
-                result.append(doctor)  # 返回字典而不是DoctorInDB对象
-            return result
+            # 一次聚合计算所有医生的当前咨询数量
+            loads = self.get_doctor_loads([doctor["id"] for doctor in doctors])
+            for doctor in doctors:
+                doctor["current_consultation_count"] = loads.get(doctor["id"], 0)
+            return doctors  # 返回字典而不是DoctorInDB对象
         except Exception as e:
             print(f"获取可用医生时出错: {e}")
             return []
     
-    def assign_doctor_to_consultation(self, doctor_id: str, consultation_id: str) -> bool:
-        """分配医生到咨询"""
-        try:
-            # 创建分配记录
-            assignment_dict = {
+    @staticmethod
+    def _claim(doctor_id: str, consultation_id: str, now: datetime):
+        """认领咨询的条件更新：只有已支付且 assigned_doctor_id 仍为空时才会匹配"""
+        query = {"_id": ObjectId(consultation_id), "status": ConsultationStatus.PAID.value, "assigned_doctor_id": None}
+        update = {"$set": {
+            "assigned_doctor_id": doctor_id,
+            "status": ConsultationStatus.IN_PROGRESS.value,
+            "started_at": now,
+            "updated_at": now
+        }}
+        return query, update
+    
+    @staticmethod
+    def _unclaim(doctor_id: str, consultation_id: str, now: datetime):
+        """撤销 _claim：医生不能接诊时把咨询退回已支付、未分配"""
+        query = {"_id": ObjectId(consultation_id), "assigned_doctor_id": doctor_id,
+                 "status": ConsultationStatus.IN_PROGRESS.value}
+        update = {"$set": {"assigned_doctor_id": None, "status": ConsultationStatus.PAID.value, "updated_at": now},
+                  "$unset": {"started_at": ""}}
+        return query, update
+    
+    def _assignment_record(self, doctor_id: str, consultation_id: str, now: datetime):
+        """分配记录按consultation_id幂等写入（upsert）"""
+        return (
+            self.ASSIGNMENT_COLLECTION,
+            {"consultation_id": consultation_id},
+            {"$setOnInsert": {
                 "doctor_id": doctor_id,
                 "consultation_id": consultation_id,
-                "assigned_at": datetime.utcnow(),
+                "assigned_at": now,
                 "status": "assigned",
-                "created_at": datetime.utcnow()
-            }
-            
-            self.dao.insert(self.ASSIGNMENT_COLLECTION, assignment_dict)
-            
-            # 更新咨询记录的分配医生ID
-            from services.consultation_service import consultation_service
-            consultation_service.dao.update(
-                "consultations",
-                "_id",
-                ObjectId(consultation_id),
-                {
-                    "assigned_doctor_id": doctor_id,
-                    "updated_at": datetime.utcnow()
-                }
-            )
-            
-            # 更新医生状态为忙碌
-            self.dao.update(
-                self.COLLECTION_NAME,
-                "_id",
-                ObjectId(doctor_id),
-                {
-                    "status": DoctorStatus.BUSY,
-                    "updated_at": datetime.utcnow()
-                }
-            )
-            
-            # 更新医生当前咨询数量
-            self.update_doctor_consultation_count(doctor_id)
-            
+                "created_at": now
+            }},
+            True
+        )
+    
+    def _doctor_busy(self, doctor_id: str, now: datetime, available_only: bool = False):
+        """
+        医生变为忙碌，当前咨询数量加一（不再重新count）。
+        available_only 时只在医生仍在线且未达到 DOCTOR_MAX_CONSULTATIONS 时匹配，以数据库为准
+        """
+        query = {"_id": ObjectId(doctor_id)}
+        if available_only:
+            query["status"] = DoctorStatus.ACTIVE.value
+            # 没有该字段的旧文档视为0
+            query["current_consultation_count"] = {"$not": {"$gte": DOCTOR_MAX_CONSULTATIONS}}
+        return (
+            self.COLLECTION_NAME,
+            query,
+            {"$set": {"status": DoctorStatus.BUSY.value, "updated_at": now},
+             "$inc": {"current_consultation_count": 1}},
+            False
+        )
+    
+    def assign_doctor_to_consultation(self, doctor_id: str, consultation_id: str, available_only: bool = False) -> bool:
+        """
+        分配医生到咨询：用一次条件更新认领咨询，并发认领同一咨询时只有一个成功，
+        认领成功后再更新医生状态和写分配记录（配置了副本集时在同一个事务中完成）。
+        available_only（自动分配）时医生必须仍在线且未满，否则撤销认领，同一医生不会被并发分配超过上限
+        """
+        try:
+            now = datetime.utcnow()
+            with self.dao.transaction() as session:
+                query, update = self._claim(doctor_id, consultation_id, now)
+                if not self.dao.find_one_and_update("consultations", query, update,
+                                                    projection={"_id": 1}, session=session):
+                    print(f"咨询 {consultation_id} 不存在、未支付或已分配医生")
+                    return False
+                
+                collection_name, doctor_query, doctor_update, _ = self._doctor_busy(doctor_id, now, available_only)
+                if not self.dao.update_one(collection_name, doctor_query, doctor_update, session=session).matched_count:
+                    print(f"医生 {doctor_id} 不在线或已达到接诊上限，撤销认领咨询 {consultation_id}")
+                    self.dao.update_one("consultations", *self._unclaim(doctor_id, consultation_id, now), session=session)
+                    return False
+                
+                collection_name, record_query, record_update, upsert = self._assignment_record(doctor_id, consultation_id, now)
+                self.dao.update_one(collection_name, record_query, record_update, upsert=upsert, session=session)
             return True
         except Exception as e:
             print(f"分配医生时出错: {e}")
             return False
     
-    def get_doctor_consultations(self, doctor_id: str, skip: int = 0, limit: int = 20) -> List[Dict[str, Any]]:
-        """获取医生的咨询列表"""
+    def get_doctor_consultations(self, doctor_id: str, skip: int = 0, limit: int = 20,
+                                 after: Optional[str] = None, before: Optional[str] = None) -> List[Dict[str, Any]]:
+        """获取医生的咨询列表（按分配时间倒序），after/before 为游标分页参数"""
+        query, sort, reverse = self.CONSULTATION_KEYSET.page({"doctor_id": doctor_id}, after, before)
         try:
             # 获取分配给该医生的咨询
-            assignments = self.dao._MongoDao__db[self.ASSIGNMENT_COLLECTION].find(
-                {"doctor_id": doctor_id}
-            ).sort("assigned_at", -1).skip(skip).limit(limit)
-            
-            consultation_ids = [assignment["consultation_id"] for assignment in assignments]
-            
-            if not consultation_ids:
+            assignments = self.dao.find(
+                self.ASSIGNMENT_COLLECTION, query,
+                projection={"consultation_id": 1, "assigned_at": 1, "_id": 0},
+                sort=sort, skip=skip, limit=limit
+            )
+            if not assignments:
                 return []
             
             # 获取咨询详情
-            consultations = self.dao._MongoDao__db["consultations"].find(
-                {"_id": {"$in": [ObjectId(cid) for cid in consultation_ids]}}
+            consultations = self.dao.find(
+                "consultations",
+                {"_id": {"$in": [ObjectId(assignment["consultation_id"]) for assignment in assignments]}}
             )
-            
-            result = []
-            for consultation in consultations:
-                consultation["id"] = str(consultation.pop("_id"))
-                result.append(consultation)
-            
-            return result
+            return self._ordered_consultations(assignments[::-1] if reverse else assignments, consultations)
         except Exception as e:
             print(f"获取医生咨询列表时出错: {e}")
             return []
     
+    @staticmethod
+    def _ordered_consultations(assignments, consultations):
+        """按分配记录的顺序返回咨询详情，并带上分配时间（游标分页使用）"""
+        by_id = {}
+        for consultation in consultations:
+            consultation["id"] = str(consultation.pop("_id"))
+            by_id[consultation["id"]] = consultation
+        result = []
+        for assignment in assignments:
+            consultation = by_id.get(assignment["consultation_id"])
+            if consultation:
+                consultation["consultation_id"] = assignment["consultation_id"]
+                consultation["assigned_at"] = assignment["assigned_at"]
+                result.append(consultation)
+        return result
+    
     def get_doctor_earnings(self, doctor_id: str) -> DoctorEarnings:
-        """获取医生收入统计"""
+        """获取医生收入统计（一次 $facet 聚合）"""
         try:
             # 获取医生基本信息
             doctor = self.get_doctor_by_id(doctor_id)
             if not doctor:
                 return None
             
-            # 计算时间范围
             now = datetime.utcnow()
-            today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
-            week_start = today_start - timedelta(days=today_start.weekday())
-            month_start = today_start.replace(day=1)
-            
-            # 获取该医生的所有已完成咨询
-            completed_consultations = self.dao._MongoDao__db["consultations"].find({
-                "assigned_doctor_id": doctor_id,
-                "status": ConsultationStatus.COMPLETED.value
-            })
-            
-            total_earnings = 0.0
-            monthly_earnings = 0.0
-            weekly_earnings = 0.0
-            daily_earnings = 0.0
-            completed_count = 0
-            
-            for consultation in completed_consultations:
-                earnings = consultation.get("price_usdt", 0.0)
-                total_earnings += earnings
-                completed_count += 1
-                
-                created_at = consultation.get("created_at")
-                if created_at:
-                    if created_at >= month_start:
-                        monthly_earnings += earnings
-                    if created_at >= week_start:
-                        weekly_earnings += earnings
-                    if created_at >= today_start:
-                        daily_earnings += earnings
-            
-            # 获取待处理咨询数量
-            pending_count = self.dao._MongoDao__db["consultations"].count_documents({
-                "assigned_doctor_id": doctor_id,
-                "status": {"$in": [ConsultationStatus.PAID.value, ConsultationStatus.IN_PROGRESS.value]}
-            })
+            summary = earnings_service.compute_doctor_earnings(doctor_id, now)
             
             return DoctorEarnings(
                 doctor_id=doctor_id,
-                total_earnings=total_earnings,
-                monthly_earnings=monthly_earnings,
-                weekly_earnings=weekly_earnings,
-                daily_earnings=daily_earnings,
                 total_consultations=doctor.total_consultations,
-                completed_consultations=completed_count,
-                pending_consultations=pending_count,
-                last_updated=now
+                # 待处理咨询数量即医生当前负载，分配和结束咨询时已经维护
+                pending_consultations=doctor.current_consultation_count,
+                last_updated=now,
+                **summary
             )
         except Exception as e:
             print(f"获取医生收入统计时出错: {e}")
             return None
     
-    def update_doctor_earnings(self, doctor_id: str, earnings: float):
-        """更新医生收入"""
-        try:
-            self.dao._MongoDao__db[self.COLLECTION_NAME].update_one(
-                {"_id": ObjectId(doctor_id)},
-                {
-                    "$inc": {
-                        "total_earnings": earnings,
-                        "total_consultations": 1
-                    },
-                    "$set": {"updated_at": datetime.utcnow()}
-                }
-            )
-        except Exception as e:
-            print(f"更新医生收入时出错: {e}")
-    
     def update_doctor_consultation_count(self, doctor_id: str):
         """更新医生当前咨询数量"""
         try:
             # 计算当前进行中的咨询数量
-            current_count = self.dao._MongoDao__db["consultations"].count_documents({
+            current_count = self.dao.count("consultations", {
                 "assigned_doctor_id": doctor_id,
                 "status": {"$in": [ConsultationStatus.IN_PROGRESS.value, ConsultationStatus.PAID.value]}
             })
             
             # 更新医生记录
-            self.dao._MongoDao__db[self.COLLECTION_NAME].update_one(
+            self.dao.update_one(
+                self.COLLECTION_NAME,
                 {"_id": ObjectId(doctor_id)},
                 {
                     "$set": {
@@ -385,6 +389,18 @@ class DoctorService:
         except Exception as e:
             print(f"更新医生咨询数量时出错: {e}")
     
+    def get_doctor_loads(self, doctor_ids: Optional[List[str]] = None) -> Dict[str, int]:
+        """医生ID -> 当前进行中（已支付/进行中）的咨询数量，一次聚合查询"""
+        rows = self.dao.aggregate("consultations", load_pipeline(doctor_ids))
+        return {row["_id"]: row["count"] for row in rows}
+    
+    def reconcile_load_index(self):
+        """用数据库状态重建医生负载索引"""
+        doctors = self.dao.find(self.COLLECTION_NAME, {"is_active": True}, projection=self.LOAD_INDEX_PROJECTION)
+        for doctor in doctors:
+            doctor["id"] = str(doctor.pop("_id"))
+        doctor_load_index.reconcile(doctors, self.get_doctor_loads())
+    
     def set_doctor_status(self, doctor_id: str, status: DoctorStatus):
         """设置医生状态"""
         try:
@@ -402,10 +418,14 @@ class DoctorService:
             print(f"设置医生状态时出错: {e}")
             return False
     
-    def get_all_doctors(self, skip: int = 0, limit: int = 100) -> List[DoctorInDB]:
-        """获取所有医生（分页）"""
+    def get_all_doctors(self, skip: int = 0, limit: int = 100,
+                        after: Optional[str] = None, before: Optional[str] = None) -> List[DoctorInDB]:
+        """获取所有医生（按注册时间分页），after/before 为游标分页参数"""
+        query, sort, reverse = self.LIST_KEYSET.page({}, after, before)
         try:
-            doctors = self.dao._MongoDao__db[self.COLLECTION_NAME].find({}).skip(skip).limit(limit)
+            doctors = self.dao.find(self.COLLECTION_NAME, query, sort=sort, skip=skip, limit=limit, secondary=True)
+            if reverse:
+                doctors = doctors[::-1]
             result = []
             for doctor in doctors:
                 doctor["id"] = doctor.pop("_id")
@@ -418,7 +438,7 @@ class DoctorService:
     def search_doctors(self, query: dict, skip: int = 0, limit: int = 100) -> List[DoctorInDB]:
         """搜索医生"""
         try:
-            doctors = self.dao._MongoDao__db[self.COLLECTION_NAME].find(query).skip(skip).limit(limit)
+            doctors = self.dao.find(self.COLLECTION_NAME, query, skip=skip, limit=limit, secondary=True)
             result = []
             for doctor in doctors:
                 doctor["id"] = doctor.pop("_id")
@@ -428,5 +448,302 @@ class DoctorService:
             print(f"搜索医生时出错: {e}")
             return []
 
+
+class AsyncDoctorService(DoctorService):
+    """医生服务类（异步版本，基于Motor，供async路由使用）"""
+    
+    def __init__(self):
+        self.dao = async_mongo_dao
+    
+    @staticmethod
+    def _to_doctor(doctor_data: dict) -> DoctorInDB:
+        doctor_data["id"] = doctor_data.pop("_id")
+        # 确保包含current_consultation_count字段
+        doctor_data.setdefault("current_consultation_count", 0)
+        return DoctorInDB(**doctor_data)
+    
+    async def create_doctor(self, doctor_data: DoctorCreate) -> Optional[DoctorInDB]:
+        """创建新医生"""
+        try:
+            existing_doctor = await self.get_doctor_by_google_id(doctor_data.google_id)
+            if existing_doctor:
+                updated_doctor = await self.update_doctor_login(str(existing_doctor.id))
+                return updated_doctor or existing_doctor
+            
+            now = datetime.utcnow()
+            doctor_dict = doctor_data.dict()
+            doctor_dict.update({
+                "status": DoctorStatus.OFFLINE,
+                "total_consultations": 0,
+                "total_earnings": 0.0,
+                "rating": 5.0,
+                "rating_count": 0,
+                "created_at": now,
+                "updated_at": now,
+                "last_login": now,
+                "login_count": 1,
+                "is_active": True
+            })
+            
+            await self.dao.insert(self.COLLECTION_NAME, doctor_dict)
+            print(f"新医生创建成功: {doctor_data.email}")
+            return await self.get_doctor_by_google_id(doctor_data.google_id)
+        except Exception as e:
+            print(f"创建医生时出错: {e}")
+            return None
+    
+    async def get_doctor_by_google_id(self, google_id: str) -> Optional[DoctorInDB]:
+        """根据Google ID获取医生"""
+        doctor_data = await self.dao.find_one(self.COLLECTION_NAME, {"google_id": google_id})
+        return self._to_doctor(doctor_data) if doctor_data else None
+    
+    async def get_doctor_by_id(self, doctor_id: str) -> Optional[DoctorInDB]:
+        """根据医生ID获取医生"""
+        try:
+            doctor_data = await self.dao.find_one(self.COLLECTION_NAME, {"_id": ObjectId(doctor_id)})
+            if doctor_data:
+                return self._to_doctor(doctor_data)
+        except Exception as e:
+            print(f"获取医生时出错: {e}, doctor_id: {doctor_id}")
+        return None
+    
+    async def get_doctor_by_email(self, email: str) -> Optional[DoctorInDB]:
+        """根据邮箱获取医生"""
+        doctor_data = await self.dao.find_one(self.COLLECTION_NAME, {"email": email})
+        return self._to_doctor(doctor_data) if doctor_data else None
+    
+    async def update_doctor_login(self, doctor_id: str) -> Optional[DoctorInDB]:
+        """更新医生登录信息"""
+        try:
+            result = await self.dao.update_one(
+                self.COLLECTION_NAME,
+                {"_id": ObjectId(doctor_id)}, 
+                {
+                    "$set": {
+                        "last_login": datetime.utcnow(), 
+                        "updated_at": datetime.utcnow(),
+                        "status": DoctorStatus.ACTIVE
+                    }, 
+                    "$inc": {"login_count": 1}
+                }
+            )
+            if result.modified_count > 0:
+                # 登录后医生在线，与 set_doctor_status 一样同步负载索引并检查等待分配的咨询
+                await self.track_doctor_status(doctor_id, DoctorStatus.ACTIVE)
+                from services.assignment_engine import assignment_engine
+                assignment_engine.trigger_sweep()
+                return await self.get_doctor_by_id(doctor_id)
+            print(f"更新医生登录信息失败，医生ID: {doctor_id}")
+        except Exception as e:
+            print(f"更新医生登录信息时出错: {e}")
+        return None
+    
+    async def update_doctor(self, doctor_id: str, doctor_data: DoctorUpdate) -> Optional[DoctorInDB]:
+        """更新医生信息"""
+        try:
+            update_dict = doctor_data.dict(exclude_unset=True)
+            update_dict["updated_at"] = datetime.utcnow()
+            if await self.dao.update(self.COLLECTION_NAME, "_id", ObjectId(doctor_id), update_dict):
+                return await self.get_doctor_by_id(doctor_id)
+        except Exception as e:
+            print(f"更新医生时出错: {e}")
+        return None
+    
+    async def get_available_doctors(self, specialty: Optional[DoctorSpecialty] = None, 
+                                    level: Optional[DoctorLevel] = None) -> List[Dict[str, Any]]:
+        """获取可用的医生列表"""
+        result = []
+        try:
+            query = {
+                "status": {"$in": [DoctorStatus.ACTIVE, DoctorStatus.BUSY]},
+                "is_active": True
+            }
+            if specialty:
+                query["specialties"] = specialty.value
+            if level:
+                query["level"] = level.value
+            
+            async for doctor in self.dao.iterate(self.COLLECTION_NAME, query):
+                doctor["id"] = str(doctor.pop("_id"))
+                result.append(doctor)
+            loads = await self.get_doctor_loads([doctor["id"] for doctor in result])
+            for doctor in result:
+                doctor["current_consultation_count"] = loads.get(doctor["id"], 0)
+        except Exception as e:
+            print(f"获取可用医生时出错: {e}")
+        return result
+    
+    async def assign_doctor_to_consultation(self, doctor_id: str, consultation_id: str, reserved: bool = False) -> bool:
+        """
+        分配医生到咨询，见 DoctorService.assign_doctor_to_consultation。
+        reserved 表示调用方已用 doctor_load_index.reserve 占用了该医生：成功时负载索引不再重复计数，失败时释放占用
+        """
+        assigned = False
+        release_status = DoctorStatus.ACTIVE
+        try:
+            now = datetime.utcnow()
+            async with self.dao.transaction() as session:
+                query, update = self._claim(doctor_id, consultation_id, now)
+                if not await self.dao.find_one_and_update("consultations", query, update,
+                                                          projection={"_id": 1}, session=session):
+                    print(f"咨询 {consultation_id} 不存在、未支付或已分配医生")
+                    return False
+                
+                # 自动分配时以数据库为准：医生可能已被其他进程分配满或已离线
+                collection_name, doctor_query, doctor_update, _ = self._doctor_busy(doctor_id, now, reserved)
+                result = await self.dao.update_one(collection_name, doctor_query, doctor_update, session=session)
+                if not result.matched_count:
+                    print(f"医生 {doctor_id} 不在线或已达到接诊上限，撤销认领咨询 {consultation_id}")
+                    await self.dao.update_one("consultations", *self._unclaim(doctor_id, consultation_id, now),
+                                              session=session)
+                    doctor = await self.dao.find_one(self.COLLECTION_NAME, {"_id": ObjectId(doctor_id)},
+                                                     projection={"status": 1})
+                    release_status = doctor["status"] if doctor else DoctorStatus.OFFLINE
+                    return False
+                
+                collection_name, record_query, record_update, upsert = self._assignment_record(doctor_id, consultation_id, now)
+                await self.dao.update_one(collection_name, record_query, record_update, upsert=upsert, session=session)
+            
+            assigned = True
+            if not reserved:
+                doctor_load_index.adjust_load(doctor_id, 1)
+                doctor_load_index.set_status(doctor_id, DoctorStatus.BUSY)
+            
+            from services.chat_hub import chat_hub
+            await chat_hub.notify(consultation_id, {"type": "status", "status": ConsultationStatus.IN_PROGRESS.value,
+                                                    "assigned_doctor_id": doctor_id})
+            return True
+        except Exception as e:
+            print(f"分配医生时出错: {e}")
+            return False
+        finally:
+            if reserved and not assigned:
+                doctor_load_index.release(doctor_id, release_status)
+    
+    async def get_doctor_consultations(self, doctor_id: str, skip: int = 0, limit: int = 20,
+                                       after: Optional[str] = None, before: Optional[str] = None) -> List[Dict[str, Any]]:
+        """获取医生的咨询列表（按分配时间倒序），after/before 为游标分页参数"""
+        query, sort, reverse = self.CONSULTATION_KEYSET.page({"doctor_id": doctor_id}, after, before)
+        try:
+            assignments = await self.dao.find(
+                self.ASSIGNMENT_COLLECTION, query,
+                projection={"consultation_id": 1, "assigned_at": 1, "_id": 0},
+                sort=sort, skip=skip, limit=limit
+            )
+            if not assignments:
+                return []
+            
+            consultations = await self.dao.find(
+                "consultations",
+                {"_id": {"$in": [ObjectId(assignment["consultation_id"]) for assignment in assignments]}}
+            )
+            return self._ordered_consultations(assignments[::-1] if reverse else assignments, consultations)
+        except Exception as e:
+            print(f"获取医生咨询列表时出错: {e}")
+            return []
+    
+    async def get_doctor_earnings(self, doctor_id: str) -> Optional[DoctorEarnings]:
+        """
+        获取医生收入统计：总额和完成数量来自医生文档，本月/本周/今日来自日汇总，
+        不再遍历医生的全部历史咨询
+        """
+        try:
+            doctor = await self.get_doctor_by_id(doctor_id)
+            if not doctor:
+                return None
+            
+            now = datetime.utcnow()
+            periods = await async_earnings_service.get_period_earnings(doctor_id, now)
+            
+            return DoctorEarnings(
+                doctor_id=doctor_id,
+                total_earnings=doctor.total_earnings,
+                total_consultations=doctor.total_consultations,
+                completed_consultations=doctor.total_consultations,
+                pending_consultations=doctor.current_consultation_count,
+                last_updated=now,
+                **periods
+            )
+        except Exception as e:
+            print(f"获取医生收入统计时出错: {e}")
+            return None
+    
+    async def update_doctor_consultation_count(self, doctor_id: str):
+        """更新医生当前咨询数量"""
+        try:
+            current_count = await self.dao.count("consultations", {
+                "assigned_doctor_id": doctor_id,
+                "status": {"$in": [ConsultationStatus.IN_PROGRESS.value, ConsultationStatus.PAID.value]}
+            })
+            await self.dao.update_one(
+                self.COLLECTION_NAME,
+                {"_id": ObjectId(doctor_id)},
+                {"$set": {"current_consultation_count": current_count, "updated_at": datetime.utcnow()}}
+            )
+        except Exception as e:
+            print(f"更新医生咨询数量时出错: {e}")
+    
+    async def set_doctor_status(self, doctor_id: str, status: DoctorStatus):
+        """设置医生状态"""
+        try:
+            await self.dao.update(self.COLLECTION_NAME, "_id", ObjectId(doctor_id), {
+                "status": status,
+                "updated_at": datetime.utcnow()
+            })
+            await self.track_doctor_status(doctor_id, status)
+            if status == DoctorStatus.ACTIVE:
+                # 有医生可以接诊，检查等待分配的咨询
+                from services.assignment_engine import assignment_engine
+                assignment_engine.trigger_sweep()
+            return True
+        except Exception as e:
+            print(f"设置医生状态时出错: {e}")
+            return False
+    
+    async def track_doctor_status(self, doctor_id: str, status: DoctorStatus):
+        """同步负载索引中的医生状态，索引中没有的医生（如新注册）补充进去"""
+        if not doctor_load_index.loaded or doctor_load_index.set_status(doctor_id, status):
+            return
+        doctor = await self.dao.find_one(
+            self.COLLECTION_NAME, {"_id": ObjectId(doctor_id), "is_active": True},
+            projection=self.LOAD_INDEX_PROJECTION
+        )
+        if doctor:
+            loads = await self.get_doctor_loads([doctor_id])
+            doctor_load_index.upsert(doctor_id, doctor["level"], status,
+                                     load=loads.get(doctor_id, 0), name=doctor.get("name"))
+    
+    async def get_doctor_loads(self, doctor_ids: Optional[List[str]] = None) -> Dict[str, int]:
+        """医生ID -> 当前进行中（已支付/进行中）的咨询数量，一次聚合查询"""
+        rows = await self.dao.aggregate("consultations", load_pipeline(doctor_ids))
+        return {row["_id"]: row["count"] for row in rows}
+    
+    async def reconcile_load_index(self):
+        """用数据库状态重建医生负载索引"""
+        doctors = await self.dao.find(self.COLLECTION_NAME, {"is_active": True}, projection=self.LOAD_INDEX_PROJECTION)
+        for doctor in doctors:
+            doctor["id"] = str(doctor.pop("_id"))
+        doctor_load_index.reconcile(doctors, await self.get_doctor_loads())
+    
+    async def get_all_doctors(self, skip: int = 0, limit: int = 100,
+                              after: Optional[str] = None, before: Optional[str] = None) -> List[DoctorInDB]:
+        """获取所有医生（按注册时间分页），after/before 为游标分页参数"""
+        query, sort, reverse = self.LIST_KEYSET.page({}, after, before)
+        doctors = await self.search_doctors(query, skip, limit, sort=sort)
+        return doctors[::-1] if reverse else doctors
+    
+    async def search_doctors(self, query: dict, skip: int = 0, limit: int = 100, sort=None) -> List[DoctorInDB]:
+        """搜索医生"""
+        result = []
+        try:
+            async for doctor in self.dao.iterate(self.COLLECTION_NAME, query, sort=sort, skip=skip, limit=limit,
+                                                 secondary=True):
+                doctor["id"] = doctor.pop("_id")
+                result.append(DoctorInDB(**doctor))
+        except Exception as e:
+            print(f"搜索医生时出错: {e}")
+        return result
+
 # 创建全局医生服务实例
-doctor_service = DoctorService()
+doctor_service = LazyInstance(DoctorService)
+async_doctor_service = LazyInstance(AsyncDoctorService)
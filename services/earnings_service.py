@@ -0,0 +1,392 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+医生收入统计
+
+已完成咨询的收入按 医生+日期 汇总在 doctor_earnings_daily 集合中（咨询完成时增量更新，
+每个咨询只计入一次），总收入和完成数量累加在医生文档的 total_earnings / total_consultations 上。
+收入面板只读取医生文档和本月的日汇总，耗时与医生的历史咨询数量无关。
+
+收入日期按咨询完成时间（UTC）计算，旧数据没有完成时间时使用创建时间。
+计入标记和两处累加在同一个事务中写入（需要副本集，见 MONGODB_TRANSACTIONS）；单机部署没有事务，中途失败时需要重建。
+收入趋势（按日/周/月分桶）和管理员导出同样只读取日汇总，导出逐批读取游标，不会一次载入全部数据。
+上线前已有的数据、或汇总与咨询记录不一致时，用聚合结果重建：
+    python -m services.earnings_service --rebuild
+"""
+
+import argparse
+from datetime import datetime, timedelta
+from pymongo import ReplaceOne, UpdateOne
+from bson import ObjectId
+from utils.mongo_dao import mongo_dao
+from utils.async_mongo_dao import async_mongo_dao
+from utils.lazy_instance import LazyInstance
+from utils.mongo_indexes import IndexSpec
+from models.consultation import ConsultationStatus
+
+DAY_FORMAT = "%Y-%m-%d"
+# 咨询上没有医生等级时的汇总键
+UNKNOWN_LEVEL = "unknown"
+SERIES_GRANULARITIES = ("day", "week", "month")
+# 收入趋势一次最多查询的天数；导出不受限制
+MAX_SERIES_DAYS = 731
+EXPORT_BATCH_SIZE = 1000
+# 导出的列：(列名, 类型)，类型见 utils.tabular_export
+EXPORT_COLUMNS = [("day", "string"), ("doctor_id", "string"), ("level", "string"),
+                  ("earnings", "float"), ("consultations", "int")]
+
+
+def earned_at_expression():
+    return {"$ifNull": ["$completed_at", "$created_at"]}
+
+
+def period_starts(now):
+    """
+    :return: (today_start, week_start, month_start), weeks start on Monday
+    """
+    today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    week_start = today_start - timedelta(days=today_start.weekday())
+    month_start = today_start.replace(day=1)
+    return today_start, week_start, month_start
+
+
+def parse_day(value):
+    """
+    :param value: "YYYY-MM-DD"
+    :raise ValueError: invalid date
+    """
+    try:
+        return datetime.strptime(value, DAY_FORMAT)
+    except (TypeError, ValueError):
+        raise ValueError(f"日期格式应为YYYY-MM-DD: {value}")
+
+
+def parse_range(start, end, default_days, max_days=None, now=None):
+    """
+    :param start: "YYYY-MM-DD" or None for default_days before end
+    :param end: "YYYY-MM-DD" or None for today
+    :return: (start_day, end_day), both inclusive
+    :raise ValueError: invalid date, start after end, or more than max_days
+    """
+    today = (now or datetime.utcnow()).replace(hour=0, minute=0, second=0, microsecond=0)
+    end_day = parse_day(end) if end else today
+    start_day = parse_day(start) if start else end_day - timedelta(days=default_days - 1)
+    if start_day > end_day:
+        raise ValueError("开始日期不能晚于结束日期")
+    if max_days and (end_day - start_day).days + 1 > max_days:
+        raise ValueError(f"查询范围不能超过{max_days}天")
+    return start_day, end_day
+
+
+def bucket_start(day, granularity):
+    """
+    :param granularity: "day", "week" (starting on Monday) or "month"
+    :return: first day of the bucket containing day
+    """
+    if granularity == "week":
+        return day - timedelta(days=day.weekday())
+    if granularity == "month":
+        return day.replace(day=1)
+    return day
+
+
+def series_buckets(start_day, end_day, granularity):
+    """
+    :return: starts of every bucket overlapping [start_day, end_day], in order
+    """
+    buckets = []
+    current = bucket_start(start_day, granularity)
+    while current <= end_day:
+        buckets.append(current)
+        if granularity == "month":
+            current = (current + timedelta(days=32)).replace(day=1)
+        else:
+            current += timedelta(days=7 if granularity == "week" else 1)
+    return buckets
+
+
+def earnings_facet_pipeline(doctor_id, now):
+    """
+    baseline: totals and month/week/day sums of one doctor in a single aggregation
+    """
+    today_start, week_start, month_start = period_starts(now)
+
+    def period(start):
+        return [{"$match": {"earned_at": {"$gte": start}}},
+                {"$group": {"_id": None, "earnings": {"$sum": "$price_usdt"}}}]
+
+    return [
+        {"$match": {"assigned_doctor_id": doctor_id, "status": ConsultationStatus.COMPLETED.value}},
+        {"$project": {"price_usdt": 1, "earned_at": earned_at_expression()}},
+        {"$facet": {
+            "total": [{"$group": {"_id": None, "earnings": {"$sum": "$price_usdt"}, "count": {"$sum": 1}}}],
+            "monthly": period(month_start),
+            "weekly": period(week_start),
+            "daily": period(today_start),
+        }},
+    ]
+
+
+def rollup_pipeline(match=None):
+    """
+    completed consultations grouped by doctor, day and level, the source of a rollup rebuild
+    """
+    return [
+        {"$match": dict(match or {}, status=ConsultationStatus.COMPLETED.value,
+                        assigned_doctor_id={"$ne": None})},
+        {"$group": {
+            "_id": {
+                "doctor_id": "$assigned_doctor_id",
+                "day": {"$dateToString": {"format": DAY_FORMAT, "date": earned_at_expression()}},
+                "level": {"$ifNull": ["$doctor_level", UNKNOWN_LEVEL]},
+            },
+            "earnings": {"$sum": "$price_usdt"},
+            "consultations": {"$sum": 1},
+        }},
+    ]
+
+
+def _facet_sum(result, name, field="earnings"):
+    rows = result.get(name) or []
+    return rows[0][field] if rows else 0
+
+
+class EarningsService:
+    """医生收入统计服务类"""
+
+    ROLLUP_COLLECTION = "doctor_earnings_daily"
+    CONSULTATION_COLLECTION = "consultations"
+    DOCTOR_COLLECTION = "doctors"
+
+    # 日汇总以 "<医生ID>:<日期>" 为 _id；按医生和日期范围读取，导出按日期顺序读取所有医生
+    INDEXES = {
+        ROLLUP_COLLECTION: [
+            IndexSpec([("doctor_id", 1), ("day", 1)]),
+            IndexSpec([("day", 1), ("doctor_id", 1)]),
+        ]
+    }
+
+    def __init__(self):
+        self.dao = mongo_dao
+
+    @staticmethod
+    def rollup_id(doctor_id, day):
+        return f"{doctor_id}:{day.strftime(DAY_FORMAT)}"
+
+    @staticmethod
+    def _summary(result):
+        return {
+            "total_earnings": _facet_sum(result, "total"),
+            "completed_consultations": _facet_sum(result, "total", "count"),
+            "monthly_earnings": _facet_sum(result, "monthly"),
+            "weekly_earnings": _facet_sum(result, "weekly"),
+            "daily_earnings": _facet_sum(result, "daily"),
+        }
+
+    def compute_doctor_earnings(self, doctor_id, now=None):
+        """
+        earnings computed from the consultations with one $facet aggregation
+        :return: dict with total/monthly/weekly/daily earnings and completed_consultations
+        """
+        result = self.dao.aggregate(self.CONSULTATION_COLLECTION,
+                                    earnings_facet_pipeline(doctor_id, now or datetime.utcnow()),
+                                    secondary=True)
+        return self._summary(result[0] if result else {})
+
+    def _rollup_updates(self, doctor_id, price_usdt, level, earned_at, now):
+        day = earned_at.replace(hour=0, minute=0, second=0, microsecond=0)
+        level = level or UNKNOWN_LEVEL
+        rollup = (
+            {"_id": self.rollup_id(doctor_id, day)},
+            {"$inc": {"earnings": price_usdt, "consultations": 1,
+                      f"levels.{level}.earnings": price_usdt, f"levels.{level}.consultations": 1},
+             "$setOnInsert": {"doctor_id": doctor_id, "day": day},
+             "$set": {"updated_at": now}},
+        )
+        totals = (
+            {"_id": ObjectId(doctor_id)},
+            {"$inc": {"total_earnings": price_usdt, "total_consultations": 1}, "$set": {"updated_at": now}},
+        )
+        return rollup, totals
+
+    def _claim_query(self, consultation_id):
+        # 咨询上的标记保证同一个咨询只计入一次，重复完成或重试不会重复累加
+        return ({"_id": ObjectId(consultation_id), "status": ConsultationStatus.COMPLETED.value,
+                 "earnings_recorded_at": {"$exists": False}},
+                {"$set": {"earnings_recorded_at": datetime.utcnow()}})
+
+    def record_completion(self, consultation_id, doctor_id, price_usdt, level=None, completed_at=None):
+        """
+        add a completed consultation to the daily rollup and the doctor's totals; the claim and both
+        increments are written in one transaction (replica set), so a failure in between never leaves
+        a claimed consultation missing from the rollup
+        :return: True if recorded, False if it was already recorded
+        """
+        now = datetime.utcnow()
+        rollup, totals = self._rollup_updates(doctor_id, price_usdt, level, completed_at or now, now)
+        with self.dao.transaction() as session:
+            result = self.dao.update_one(self.CONSULTATION_COLLECTION, *self._claim_query(consultation_id),
+                                         session=session)
+            if not result.modified_count:
+                return False
+            self.dao.update_one(self.ROLLUP_COLLECTION, *rollup, upsert=True, session=session)
+            self.dao.update_one(self.DOCTOR_COLLECTION, *totals, session=session)
+        return True
+
+    def rebuild(self):
+        """
+        rebuild the daily rollup and doctor totals from the consultations; run while no consultations
+        are being completed
+        :return: {"days": ..., "doctors": ...}
+        """
+        now = datetime.utcnow()
+        self.dao.update_many(self.CONSULTATION_COLLECTION,
+                             {"status": ConsultationStatus.COMPLETED.value,
+                              "earnings_recorded_at": {"$exists": False}},
+                             {"$set": {"earnings_recorded_at": now}})
+
+        rollups, totals = {}, {}
+        for row in self.dao.aggregate(self.CONSULTATION_COLLECTION, rollup_pipeline(), allow_disk_use=True):
+            doctor_id, level = row["_id"]["doctor_id"], row["_id"]["level"]
+            day = datetime.strptime(row["_id"]["day"], DAY_FORMAT)
+            rollup = rollups.setdefault(self.rollup_id(doctor_id, day), {
+                "doctor_id": doctor_id, "day": day, "earnings": 0, "consultations": 0, "levels": {},
+                "updated_at": now,
+            })
+            rollup["earnings"] += row["earnings"]
+            rollup["consultations"] += row["consultations"]
+            rollup["levels"][level] = {"earnings": row["earnings"], "consultations": row["consultations"]}
+            total = totals.setdefault(doctor_id, {"total_earnings": 0, "total_consultations": 0})
+            total["total_earnings"] += row["earnings"]
+            total["total_consultations"] += row["consultations"]
+
+        self.dao.bulk_write(self.ROLLUP_COLLECTION, [
+            ReplaceOne({"_id": rollup_id}, rollup, upsert=True) for rollup_id, rollup in rollups.items()
+        ])
+        self.dao.delete(self.ROLLUP_COLLECTION, "_id", {"$nin": list(rollups)})
+        # 先清零所有医生的总额：已完成咨询全部被删除或改派的医生不会出现在聚合结果中
+        self.dao.update_many(self.DOCTOR_COLLECTION, {}, {"$set": {"total_earnings": 0, "total_consultations": 0}})
+        self.dao.bulk_write(self.DOCTOR_COLLECTION, [
+            UpdateOne({"_id": ObjectId(doctor_id)}, {"$set": dict(total, updated_at=now)})
+            for doctor_id, total in totals.items() if ObjectId.is_valid(doctor_id)
+        ])
+        return {"days": len(rollups), "doctors": len(totals)}
+
+    @staticmethod
+    def _series(days, start_day, end_day, granularity):
+        """
+        sum daily rollup documents into buckets; buckets without earnings are reported as zero
+        """
+        points = {bucket: {"start": bucket.strftime(DAY_FORMAT), "earnings": 0, "consultations": 0, "levels": {}}
+                  for bucket in series_buckets(start_day, end_day, granularity)}
+        for day in days:
+            point = points[bucket_start(day["day"], granularity)]
+            point["earnings"] += day["earnings"]
+            point["consultations"] += day["consultations"]
+            for level, values in (day.get("levels") or {}).items():
+                total = point["levels"].setdefault(level, {"earnings": 0, "consultations": 0})
+                total["earnings"] += values["earnings"]
+                total["consultations"] += values["consultations"]
+        return list(points.values())
+
+    def _series_query(self, doctor_id, start_day, end_day, granularity):
+        if granularity not in SERIES_GRANULARITIES:
+            raise ValueError(f"不支持的统计粒度: {granularity}")
+        return {"doctor_id": doctor_id, "day": {"$gte": start_day, "$lte": end_day}}
+
+    def get_series(self, doctor_id, start_day, end_day, granularity="day"):
+        """
+        earnings of one doctor between two days (inclusive) in day/week/month buckets
+        :return: list of {"start", "earnings", "consultations", "levels"}
+        :raise ValueError: unknown granularity
+        """
+        days = self.dao.find(self.ROLLUP_COLLECTION,
+                             self._series_query(doctor_id, start_day, end_day, granularity),
+                             projection={"day": 1, "earnings": 1, "consultations": 1, "levels": 1},
+                             sort=[("day", 1)])
+        return self._series(days, start_day, end_day, granularity)
+
+    @staticmethod
+    def _export_rows(rollup):
+        day = rollup["day"].strftime(DAY_FORMAT)
+        for level, values in sorted((rollup.get("levels") or {}).items()):
+            yield {"day": day, "doctor_id": rollup["doctor_id"], "level": level,
+                   "earnings": float(values["earnings"]), "consultations": int(values["consultations"])}
+
+
+class AsyncEarningsService(EarningsService):
+    """医生收入统计服务类（异步版本）"""
+
+    def __init__(self):
+        self.dao = async_mongo_dao
+
+    async def compute_doctor_earnings(self, doctor_id, now=None):
+        result = await self.dao.aggregate(self.CONSULTATION_COLLECTION,
+                                          earnings_facet_pipeline(doctor_id, now or datetime.utcnow()),
+                                          secondary=True)
+        return self._summary(result[0] if result else {})
+
+    async def record_completion(self, consultation_id, doctor_id, price_usdt, level=None, completed_at=None):
+        now = datetime.utcnow()
+        rollup, totals = self._rollup_updates(doctor_id, price_usdt, level, completed_at or now, now)
+        async with self.dao.transaction() as session:
+            result = await self.dao.update_one(self.CONSULTATION_COLLECTION, *self._claim_query(consultation_id),
+                                               session=session)
+            if not result.modified_count:
+                return False
+            await self.dao.update_one(self.ROLLUP_COLLECTION, *rollup, upsert=True, session=session)
+            await self.dao.update_one(self.DOCTOR_COLLECTION, *totals, session=session)
+        return True
+
+    async def get_period_earnings(self, doctor_id, now=None):
+        """
+        month/week/day earnings summed from at most ~37 daily rollup documents
+        :return: {"monthly_earnings", "weekly_earnings", "daily_earnings"}
+        """
+        today_start, week_start, month_start = period_starts(now or datetime.utcnow())
+        days = await self.dao.find(self.ROLLUP_COLLECTION,
+                                   {"doctor_id": doctor_id, "day": {"$gte": min(week_start, month_start)}},
+                                   projection={"day": 1, "earnings": 1})
+        return {
+            "monthly_earnings": sum(day["earnings"] for day in days if day["day"] >= month_start),
+            "weekly_earnings": sum(day["earnings"] for day in days if day["day"] >= week_start),
+            "daily_earnings": sum(day["earnings"] for day in days if day["day"] >= today_start),
+        }
+
+    async def get_series(self, doctor_id, start_day, end_day, granularity="day"):
+        days = await self.dao.find(self.ROLLUP_COLLECTION,
+                                   self._series_query(doctor_id, start_day, end_day, granularity),
+                                   projection={"day": 1, "earnings": 1, "consultations": 1, "levels": 1},
+                                   sort=[("day", 1)])
+        return self._series(days, start_day, end_day, granularity)
+
+    async def iterate_rollup(self, start_day, end_day, doctor_id=None, batch_size=EXPORT_BATCH_SIZE):
+        """
+        daily rollup between two days (inclusive), one row per doctor, day and level,
+        read from the cursor batch by batch
+        :param doctor_id: only this doctor's rows; None for all doctors
+        :return: async generator of dicts with the EXPORT_COLUMNS keys
+        """
+        query = {"day": {"$gte": start_day, "$lte": end_day}}
+        if doctor_id is not None:
+            query["doctor_id"] = doctor_id
+        async for rollup in self.dao.iterate(self.ROLLUP_COLLECTION, query,
+                                             projection={"day": 1, "doctor_id": 1, "levels": 1},
+                                             sort=[("day", 1), ("doctor_id", 1)],
+                                             batch_size=batch_size, secondary=True):
+            for row in self._export_rows(rollup):
+                yield row
+
+
+earnings_service = LazyInstance(EarningsService)
+async_earnings_service = LazyInstance(AsyncEarningsService)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="医生收入日汇总")
+    parser.add_argument("--rebuild", action="store_true", help="从咨询记录重建日汇总和医生总收入")
+    args = parser.parse_args()
+    if args.rebuild:
+        print(f"✅ 收入汇总已重建: {earnings_service.rebuild()}")
+    else:
+        parser.print_help()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+数据库索引管理
+
+各服务类通过 INDEXES 声明期望的索引，这里与线上索引比较后幂等地应用。
+索引不在导入服务模块时创建，而是由应用启动钩子或命令行显式执行：
+    python -m services.index_service            # 应用索引
+    python -m services.index_service --plan     # 只查看差异
+    python -m services.index_service --drop-extra  # 同时删除未声明的索引
+"""
+
+import argparse
+from utils.mongo_dao import mongo_dao, query_stats
+from utils.mongo_indexes import IndexManager
+from services.user_service import UserService
+from services.doctor_service import DoctorService
+from services.consultation_service import ConsultationService
+from services.attachment_service import AttachmentService
+from services.earnings_service import EarningsService
+from utils.session_store import MongoSessionStore
+
+INDEXED_SERVICES = (UserService, DoctorService, ConsultationService, AttachmentService, EarningsService,
+                    MongoSessionStore)
+
+
+def get_index_specs():
+    """合并所有服务声明的索引：集合名 -> IndexSpec列表"""
+    specs = {}
+    for service_class in INDEXED_SERVICES:
+        for collection_name, collection_specs in service_class.INDEXES.items():
+            specs.setdefault(collection_name, []).extend(collection_specs)
+    return specs
+
+
+def plan_indexes():
+    """查看声明索引与线上索引的差异"""
+    return IndexManager(mongo_dao).plan(get_index_specs())
+
+
+def ensure_all_indexes(drop_extra=False):
+    """为所有服务创建所需索引"""
+    actions = IndexManager(mongo_dao).apply(get_index_specs(), drop_extra=drop_extra)
+    changed = [item for item in actions if item["action"] not in ("ok", "extra")]
+    print(f"✅ 索引检查完成，变更 {len(changed)} 个")
+    return actions
+
+
+def collscan_report():
+    """对本进程执行过的查询做explain，返回走全表扫描(COLLSCAN)的查询"""
+    return IndexManager(mongo_dao).collscan_report(query_stats.query_shapes())
+
+
+def format_actions(actions):
+    return [
+        {key: value for key, value in item.items() if key != "spec"}
+        for item in actions
+    ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="数据库索引管理")
+    parser.add_argument("--plan", action="store_true", help="只显示差异，不做修改")
+    parser.add_argument("--drop-extra", action="store_true", help="删除未声明的索引")
+    args = parser.parse_args()
+
+    result = plan_indexes() if args.plan else ensure_all_indexes(drop_extra=args.drop_extra)
+    for item in format_actions(result):
+        print(f"{item['action']:>8}  {item['collection']}.{item['name']}"
+              + (f"  错误: {item['error']}" if item.get("error") else ""))
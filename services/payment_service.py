@@ -6,16 +6,52 @@ USDT(TRC20)支付服务
 
 import os
 import qrcode
+import qrcode.image.svg
 import io
 import base64
+from functools import lru_cache
 from typing import Optional, Dict, Any
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
-from services.consultation_service import consultation_service
+from fastapi.concurrency import run_in_threadpool
+from services.consultation_service import ConsultationService, consultation_service, async_consultation_service
 from models.consultation import PaymentOrder, PaymentStatus
+from utils.lazy_instance import LazyInstance
+from utils.tron_client import chain_client, usdt_to_sun
 
 load_dotenv(".env")
 
+# 二维码缓存条目数：内容只取决于收款地址和金额，固定套餐下命中率很高
+QR_CACHE_SIZE = int(os.getenv('QR_CACHE_SIZE', 256))
+QR_CONTENT_TYPES = {"png": "image/png", "svg": "image/svg+xml"}
+
+
+@lru_cache(maxsize=QR_CACHE_SIZE)
+def render_qr_code(payment_url: str, image_format: str = "png") -> bytes:
+    """
+    render a payment QR code, cached per (payment_url, image_format)
+    :param image_format: "png" or "svg"
+    :return: image bytes
+    """
+    if image_format not in QR_CONTENT_TYPES:
+        raise ValueError(f"不支持的二维码格式: {image_format}")
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=10,
+        border=4,
+    )
+    qr.add_data(payment_url)
+    qr.make(fit=True)
+    
+    buffer = io.BytesIO()
+    if image_format == "svg":
+        qr.make_image(image_factory=qrcode.image.svg.SvgPathImage).save(buffer)
+    else:
+        qr.make_image(fill_color="black", back_color="white").save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
 class PaymentService:
     """USDT(TRC20)支付服务类"""
     
@@ -24,31 +60,38 @@ class PaymentService:
         self.usdt_account = os.getenv('USDT_ACCOUNT', 'TQn9Y2khEsLJW1ChVWFMSMeRDow5KcbLSE')
         self.usdt_private_key = os.getenv('USDT_PRIVATE_KEY', '')  # 私钥（生产环境需要安全存储）
         
+    def payment_url(self, usdt_address: str, amount_usdt: float) -> str:
+        """支付URL（使用TRON标准）"""
+        return f"tronlink://send?address={usdt_address}&amount={amount_usdt}&token=USDT"
+    
+    def qr_code_image(self, usdt_address: str, amount_usdt: float, image_format: str = "png") -> bytes:
+        """支付二维码图片（PNG或SVG），相同地址和金额直接返回缓存"""
+        return render_qr_code(self.payment_url(usdt_address, amount_usdt), image_format)
+    
     def generate_qr_code(self, usdt_address: str, amount_usdt: float) -> str:
-        """生成USDT(TRC20)支付二维码"""
-        # 创建支付URL（使用TRON标准）
-        payment_url = f"tronlink://send?address={usdt_address}&amount={amount_usdt}&token=USDT"
-        
-        # 生成二维码
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_L,
-            box_size=10,
-            border=4,
-        )
-        qr.add_data(payment_url)
-        qr.make(fit=True)
-        
-        # 创建二维码图片
-        img = qr.make_image(fill_color="black", back_color="white")
-        
-        # 转换为base64字符串
-        buffer = io.BytesIO()
-        img.save(buffer, format='PNG')
-        img_str = base64.b64encode(buffer.getvalue()).decode()
-        
+        """生成USDT(TRC20)支付二维码（base64 data URI）"""
+        img_str = base64.b64encode(render_qr_code(self.payment_url(usdt_address, amount_usdt), "png")).decode()
         return f"data:image/png;base64,{img_str}"
     
+    def _payment_info(self, payment_order: PaymentOrder, consultation_id: str) -> Dict[str, Any]:
+        """
+        支付订单响应：二维码以URL返回（/api/payment/qr/{order_id}.png|svg），不再内联base64图片；
+        金额是订单占用的唯一金额（套餐价格加小数尾数），用户需按该金额支付
+        """
+        order_id = str(payment_order.id)
+        amount_usdt = payment_order.amount_usdt
+        return {
+            "order_id": order_id,
+            "consultation_id": consultation_id,
+            "amount_usdt": amount_usdt,
+            "usdt_address": self.usdt_account,
+            "qr_code": ConsultationService.PAYMENT_QR_PATH.format(order_id=order_id, image_format="png"),
+            "qr_code_svg": ConsultationService.PAYMENT_QR_PATH.format(order_id=order_id, image_format="svg"),
+            "payment_url": self.payment_url(self.usdt_account, amount_usdt),
+            "expires_at": payment_order.expires_at.isoformat(),
+            "status": payment_order.status.value
+        }
+    
     def create_payment_order(self, consultation_id: str, user_id: str) -> Dict[str, Any]:
         """创建支付订单"""
         # 获取咨询记录
@@ -59,9 +102,6 @@ class PaymentService:
         if consultation.user_id != user_id:
             raise ValueError("无权限访问此咨询记录")
         
-        # 生成二维码
-        qr_code_data = self.generate_qr_code(self.usdt_account, consultation.price_usdt)
-        
         # 创建支付订单
         payment_order = consultation_service.create_payment_order(
             consultation_id=consultation_id,
@@ -69,16 +109,7 @@ class PaymentService:
             usdt_address=self.usdt_account
         )
         
-        return {
-            "order_id": str(payment_order.id),
-            "consultation_id": consultation_id,
-            "amount_usdt": consultation.price_usdt,
-            "usdt_address": self.usdt_account,
-            "qr_code": qr_code_data,
-            "payment_url": f"tronlink://send?address={self.usdt_account}&amount={consultation.price_usdt}&token=USDT",
-            "expires_at": payment_order.expires_at.isoformat(),
-            "status": payment_order.status.value
-        }
+        return self._payment_info(payment_order, consultation_id)
     
     def check_payment_status(self, consultation_id: str) -> Dict[str, Any]:
         """检查支付状态"""
@@ -92,23 +123,17 @@ class PaymentService:
         }
     
     def verify_tron_transaction(self, transaction_hash: str, expected_amount_usdt: float) -> bool:
-        """验证TRON交易（模拟实现）"""
-        # 实际实现需要：
-        # 1. 连接到TRON网络（如TronGrid、TronScan等）
-        # 2. 获取交易详情
-        # 3. 验证交易金额和收款地址
-        # 4. 确认交易状态
-        
-        # 这里为了演示，返回模拟结果
-        import random
-        return random.random() > 0.3  # 70%的概率验证成功
+        """交易是否已被支付监听确认为某个订单的付款，且金额一致（只读数据库，不访问链上）"""
+        order = consultation_service.dao.find_one(
+            ConsultationService.PAYMENT_ORDER_COLLECTION,
+            {"transaction_hash": transaction_hash, "status": PaymentStatus.PAID},
+            projection={"amount_usdt": 1}
+        )
+        return bool(order) and usdt_to_sun(order["amount_usdt"]) == usdt_to_sun(expected_amount_usdt)
     
     def get_usdt_balance(self, address: str) -> float:
-        """获取USDT地址余额（模拟实现）"""
-        # 实际实现需要连接TRON网络查询USDT余额
-        # 这里返回模拟数据
-        import random
-        return round(random.uniform(10, 1000), 2)
+        """获取USDT地址余额（通过 utils.tron_client 查询链上）"""
+        return chain_client.usdt_balance(address)
     
     def format_usdt_amount(self, amount_sun: int) -> float:
         """将Sun转换为USDT"""
@@ -116,7 +141,45 @@ class PaymentService:
     
     def format_usdt_to_sun(self, amount_usdt: float) -> int:
         """将USDT转换为Sun"""
-        return int(amount_usdt * (10 ** 6))
+        return usdt_to_sun(amount_usdt)
+
+
+class AsyncPaymentService(PaymentService):
+    """USDT(TRC20)支付服务类（异步版本）"""
+    
+    async def create_payment_order(self, consultation_id: str, user_id: str) -> Dict[str, Any]:
+        """创建支付订单"""
+        consultation = await async_consultation_service.get_consultation_by_id(consultation_id)
+        if not consultation:
+            raise ValueError("咨询记录不存在")
+        
+        if consultation.user_id != user_id:
+            raise ValueError("无权限访问此咨询记录")
+        
+        payment_order = await async_consultation_service.create_payment_order(
+            consultation_id=consultation_id,
+            user_id=user_id,
+            usdt_address=self.usdt_account
+        )
+        
+        return self._payment_info(payment_order, consultation_id)
+    
+    async def qr_code_image(self, usdt_address: str, amount_usdt: float, image_format: str = "png") -> bytes:
+        """支付二维码图片；未命中缓存时渲染是CPU密集操作，放到线程池中执行"""
+        return await run_in_threadpool(super().qr_code_image, usdt_address, amount_usdt, image_format)
+    
+    async def check_payment_status(self, consultation_id: str) -> Dict[str, Any]:
+        """检查支付状态，待支付时附带订单过期时间"""
+        status, payment_order = await async_consultation_service.check_payment_order(consultation_id)
+        
+        result = {
+            "status": status.value,
+            "checked_at": datetime.utcnow().isoformat()
+        }
+        if status == PaymentStatus.PENDING:
+            result["expires_at"] = payment_order.expires_at.isoformat()
+        return result
 
 # 创建全局支付服务实例
-payment_service = PaymentService()
+payment_service = LazyInstance(PaymentService)
+async_payment_service = LazyInstance(AsyncPaymentService)
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+USDT(TRC20)支付监听
+
+后台任务每隔 PAYMENT_WATCH_INTERVAL 秒向链客户端（utils.tron_client）查询一次收款地址
+自上次扫描以来的转账。每个订单创建时占用了一个唯一金额（收款键，见 ConsultationService），
+一批转账用一次查询按金额找到各自的订单，匹配到的订单标记为已支付并进入分配队列。
+链上查询次数只取决于扫描间隔（出块速度），与等待支付的用户数量无关；
+没有待支付订单时不查询链上。支付状态接口只读取数据库中的订单状态。
+多进程部署时每个进程都会启动监听，但只有持有后台任务租约（utils.leader_lease）的进程扫描。
+
+    PAYMENT_WATCH_INTERVAL=6      # 扫描间隔（秒），TRON约3秒出一个块
+    PAYMENT_WATCH_BATCH=1000      # 每次扫描最多处理的转账数，超出部分下次继续
+"""
+
+import os
+import asyncio
+from datetime import datetime
+from fastapi.concurrency import run_in_threadpool
+from utils.lazy_instance import LazyInstance
+from utils.leader_lease import background_lease
+from utils.tron_client import chain_client, usdt_to_sun
+
+PAYMENT_WATCH_INTERVAL = float(os.getenv('PAYMENT_WATCH_INTERVAL', 6))
+PAYMENT_WATCH_BATCH = int(os.getenv('PAYMENT_WATCH_BATCH', 1000))
+# 本机时钟与区块时间的允许偏差：早于订单创建时间超过该值的转账不会匹配该订单
+CLOCK_SKEW_MS = 60 * 1000
+
+
+def _timestamp_ms(value):
+    return int((value - datetime(1970, 1, 1)).total_seconds() * 1000)
+
+
+def _within(key, transfer, skew_ms=CLOCK_SKEW_MS):
+    """
+    the transfer happened while the key was held by its order
+    """
+    return (_timestamp_ms(key["created_at"]) - skew_ms <= transfer["timestamp"]
+            <= _timestamp_ms(key["expires_at"]) + skew_ms)
+
+
+def match_transfers(transfers, orders, skew_ms=CLOCK_SKEW_MS):
+    """
+    fallback for orders without a deposit key: pair transfers with pending orders of exactly
+    the same amount; among orders with equal amounts the oldest one created before the transfer wins
+    :param transfers: transfer dicts in ascending timestamp order
+    :param orders: pending order documents with "_id", "amount_usdt", "created_at"
+    :return: list of (order, transfer)
+    """
+    by_amount = {}
+    for order in sorted(orders, key=lambda item: item["created_at"]):
+        by_amount.setdefault(usdt_to_sun(order["amount_usdt"]), []).append(order)
+
+    matches = []
+    for transfer in transfers:
+        candidates = by_amount.get(transfer["amount_sun"], [])
+        for index, order in enumerate(candidates):
+            if _timestamp_ms(order["created_at"]) - skew_ms <= transfer["timestamp"]:
+                matches.append((candidates.pop(index), transfer))
+                break
+    return matches
+
+
+class PaymentWatcher:
+    """
+    :param client: ChainClient, defaults to the global chain_client
+    :param service: AsyncConsultationService, defaults to the global async_consultation_service
+    :param address: receiving address, defaults to USDT_ACCOUNT
+    :param interval: seconds between scans
+    :param batch: max transfers per scan
+    :param lease: LeaderLease, only the process holding it scans; defaults to the global background_lease
+    """
+    def __init__(self, client=None, service=None, address=None, interval=PAYMENT_WATCH_INTERVAL,
+                 batch=PAYMENT_WATCH_BATCH, lease=None):
+        if service is None:
+            from services.consultation_service import async_consultation_service
+            service = async_consultation_service
+        if address is None:
+            from services.payment_service import payment_service
+            address = payment_service.usdt_account
+        self.client = client or chain_client
+        self.service = service
+        self.address = address
+        self.interval = interval
+        self.batch = batch
+        self.lease = lease or background_lease
+        self._leader = False
+        self._task = None
+        self._last_scan = None
+        self._counters = {"scans": 0, "idle": 0, "chain_requests": 0, "transfers": 0,
+                          "paid": 0, "unmatched": 0, "errors": 0}
+
+    @property
+    def running(self):
+        return self._task is not None
+
+    async def start(self):
+        if self.running:
+            return
+        self._task = asyncio.create_task(self._run())
+        print(f"✅ 支付监听已启动，收款地址: {self.address}，扫描间隔: {self.interval}秒")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def scan(self):
+        """
+        one scan: fetch new transfers once and resolve each to its order by amount
+        :return: number of orders marked paid
+        """
+        self._counters["scans"] += 1
+        oldest = await self.service.get_oldest_pending_payment(self.address)
+        if not oldest:
+            self._counters["idle"] += 1
+            return 0
+
+        # 从上次扫描的位置继续；第一次扫描（或进度早于所有待支付订单）从最早的待支付订单开始
+        cursor = await self.service.get_payment_watch_cursor(self.address)
+        since = max(cursor or 0, _timestamp_ms(oldest["created_at"]) - CLOCK_SKEW_MS)
+        transfers = await run_in_threadpool(self.client.incoming_transfers, self.address, since, self.batch)
+        self._counters["chain_requests"] += 1
+        self._last_scan = datetime.utcnow()
+        if not transfers:
+            return 0
+
+        # 起始时间是包含的，上次扫描的最后一个区块会再次返回，已使用的交易直接跳过
+        used = await self.service.get_used_transaction_hashes([transfer["tx_hash"] for transfer in transfers])
+        fresh = [transfer for transfer in transfers if transfer["tx_hash"] not in used]
+        self._counters["transfers"] += len(fresh)
+
+        matches = []
+        keys = await self.service.get_deposit_keys(self.address, [transfer["amount_sun"] for transfer in fresh])
+        unresolved = []
+        for transfer in fresh:
+            key = keys.get(transfer["amount_sun"])
+            if key and _within(key, transfer):
+                matches.append((key["order_id"], transfer))
+            else:
+                unresolved.append(transfer)
+        if unresolved:
+            legacy = await self.service.get_untagged_pending_orders(self.address)
+            matches += [(order["_id"], transfer) for order, transfer in match_transfers(unresolved, legacy)]
+
+        paid = 0
+        for order_id, transfer in matches:
+            if await self.service.confirm_payment(order_id, transfer["tx_hash"]):
+                paid += 1
+                print(f"订单 {order_id} 已到账，交易: {transfer['tx_hash']}")
+        self._counters["paid"] += paid
+        self._counters["unmatched"] += len(fresh) - paid
+
+        await self.service.save_payment_watch_cursor(self.address, transfers[-1]["timestamp"])
+        return paid
+
+    async def _run(self):
+        while True:
+            try:
+                self._leader = await self.lease.held()
+                if self._leader:
+                    await self.scan()
+            except Exception as e:
+                self._counters["errors"] += 1
+                print(f"支付监听扫描失败: {e}")
+            await asyncio.sleep(self.interval)
+
+    def metrics(self):
+        return dict(
+            self._counters,
+            running=self.running,
+            leader=self._leader,
+            address=self.address,
+            interval=self.interval,
+            last_scan=self._last_scan.isoformat() if self._last_scan else None,
+        )
+
+
+payment_watcher = LazyInstance(PaymentWatcher)
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+附件预览生成
+
+上传完成后把图片/PDF附件放入队列，由固定数量的worker在线程池中生成预览图，
+结果作为 "<附件ID>.preview.jpg" 保存在原附件旁边，并在 blobs 集合中记录状态。
+启动时补做进程重启前未完成的附件（preview.status=pending）。
+
+    PREVIEW_WORKERS=2        # 并发生成预览的线程数
+    PREVIEW_QUEUE_SIZE=1000  # 队列上限，超出的附件等下次启动时补做
+"""
+
+import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from utils.lazy_instance import LazyInstance
+from utils.previews import render_preview, UnsupportedPreview, PREVIEW_SUFFIX
+
+PREVIEW_WORKERS = int(os.getenv('PREVIEW_WORKERS', 2))
+PREVIEW_QUEUE_SIZE = int(os.getenv('PREVIEW_QUEUE_SIZE', 1000))
+PREVIEW_SWEEP_LIMIT = int(os.getenv('PREVIEW_SWEEP_LIMIT', 500))
+
+
+class PreviewWorker:
+    """
+    :param service: AttachmentService, defaults to the global attachment_service
+    :param render: blocking callable(source_path, target_path, content_type) -> {"width", "height", "size"}
+    :param workers: number of concurrent previews, also the size of the render thread pool
+    :param max_queue: queue bound; submissions beyond it are dropped and picked up by the next sweep
+    """
+    def __init__(self, service=None, render=render_preview, workers=PREVIEW_WORKERS,
+                 max_queue=PREVIEW_QUEUE_SIZE, sweep_limit=PREVIEW_SWEEP_LIMIT):
+        if service is None:
+            from services.attachment_service import attachment_service
+            service = attachment_service
+        self.service = service
+        self.render = render
+        self.worker_count = workers
+        self.max_queue = max_queue
+        self.sweep_limit = sweep_limit
+        self._queue = None
+        self._workers = []
+        self._executor = None
+        self._pending = set()
+        self._counters = {"submitted": 0, "ready": 0, "unsupported": 0, "failed": 0, "dropped": 0}
+
+    @property
+    def running(self):
+        return bool(self._workers)
+
+    async def start(self):
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        # 解码和缩放在独立线程池中进行，不占用请求使用的默认线程池
+        self._executor = ThreadPoolExecutor(max_workers=self.worker_count, thread_name_prefix="preview")
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.worker_count)]
+        print(f"✅ 预览生成已启动，worker数量: {self.worker_count}")
+
+    async def stop(self):
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._queue = None
+        self._pending.clear()
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def submit(self, blob_id, content_type):
+        """
+        queue a blob for preview generation
+        :return: True if queued, False if already pending, the worker is not running or the queue is full
+        """
+        if not self.running or blob_id in self._pending:
+            return False
+        try:
+            self._queue.put_nowait((blob_id, content_type))
+        except asyncio.QueueFull:
+            self._counters["dropped"] += 1
+            return False
+        self._pending.add(blob_id)
+        self._counters["submitted"] += 1
+        return True
+
+    async def sweep(self):
+        """
+        queue blobs whose preview is still pending, e.g. after a restart
+        :return: number of newly queued blobs
+        """
+        blobs = await self.service.pending_previews(limit=self.sweep_limit)
+        return sum(1 for blob in blobs if self.submit(blob["_id"], blob.get("content_type")))
+
+    async def generate(self, blob_id, content_type):
+        """
+        render one preview and store it next to the blob
+        :return: preview status
+        """
+        store = self.service.store
+        staging_path = store.staging_path()
+        try:
+            async with store.open_local(blob_id) as source_path:
+                info = await asyncio.get_running_loop().run_in_executor(
+                    self._executor, self.render, source_path, staging_path, content_type
+                )
+            await store.put(staging_path, blob_id, PREVIEW_SUFFIX)
+            status = "ready"
+            await self.service.set_preview(blob_id, status, **info)
+        except UnsupportedPreview as e:
+            status = "unsupported"
+            await self.service.set_preview(blob_id, status, error=str(e))
+        except Exception as e:
+            print(f"生成附件 {blob_id} 预览失败: {e}")
+            status = "failed"
+            await self.service.set_preview(blob_id, status, error=str(e))
+        finally:
+            if os.path.exists(staging_path):
+                os.remove(staging_path)
+        return status
+
+    async def _worker(self):
+        while True:
+            blob_id, content_type = await self._queue.get()
+            try:
+                status = await self.generate(blob_id, content_type)
+            except Exception as e:
+                print(f"记录附件 {blob_id} 预览状态失败: {e}")
+                status = "failed"
+            finally:
+                self._pending.discard(blob_id)
+                self._queue.task_done()
+            self._counters[status] += 1
+
+    async def join(self):
+        """
+        wait until the queue is drained (tests, shutdown)
+        """
+        if self._queue:
+            await self._queue.join()
+
+    def metrics(self):
+        return dict(
+            self._counters,
+            running=self.running,
+            workers=len(self._workers),
+            queue_depth=self._queue.qsize() if self._queue else 0,
+        )
+
+
+preview_worker = LazyInstance(PreviewWorker)
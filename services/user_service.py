@@ -8,6 +8,10 @@ from typing import Optional, List
 from datetime import datetime
 from bson import ObjectId
 from utils.mongo_dao import mongo_dao
+from utils.async_mongo_dao import async_mongo_dao
+from utils.lazy_instance import LazyInstance
+from utils.mongo_indexes import IndexSpec
+from utils.pagination import Keyset
 from models.user import UserInDB, UserCreate, UserUpdate, UserResponse
 
 class UserService:
@@ -15,19 +19,21 @@ class UserService:
     
     COLLECTION_NAME = "users"
     
+    # 声明式索引，由 services.index_service 统一应用
+    INDEXES = {
+        COLLECTION_NAME: [
+            IndexSpec("google_id", unique=True),
+            IndexSpec("email"),
+            # 用户列表游标分页
+            IndexSpec([("created_at", 1), ("_id", 1)]),
+        ]
+    }
+    
+    # 用户列表按注册时间分页
+    LIST_KEYSET = Keyset("created_at", "_id")
+    
     def __init__(self):
         self.dao = mongo_dao
-        self._ensure_indexes()
-    
-    def _ensure_indexes(self):
-        """确保数据库索引存在"""
-        try:
-            # 为google_id创建唯一索引
-            self.dao.create_index(self.COLLECTION_NAME, "google_id")
-            # 为email创建索引
-            self.dao.create_index(self.COLLECTION_NAME, "email")
-        except Exception as e:
-            print(f"创建索引时出错: {e}")
     
     def create_user(self, user_data: UserCreate) -> UserInDB:
         """创建新用户"""
@@ -72,9 +78,8 @@ class UserService:
     
     def get_user_by_google_id(self, google_id: str) -> Optional[UserInDB]:
         """根据Google ID获取用户"""
-        users = self.dao.search(self.COLLECTION_NAME, "google_id", google_id)
-        if users:
-            user_data = users[0]
+        user_data = self.dao.find_one(self.COLLECTION_NAME, {"google_id": google_id})
+        if user_data:
             user_data["id"] = user_data.pop("_id")
             return UserInDB(**user_data)
         return None
@@ -86,9 +91,8 @@ class UserService:
             if isinstance(user_id, str):
                 user_id = ObjectId(user_id)
             
-            users = self.dao.search(self.COLLECTION_NAME, "_id", user_id)
-            if users:
-                user_data = users[0]
+            user_data = self.dao.find_one(self.COLLECTION_NAME, {"_id": user_id})
+            if user_data:
                 user_data["id"] = user_data.pop("_id")
                 return UserInDB(**user_data)
         except Exception as e:
@@ -97,9 +101,8 @@ class UserService:
     
     def get_user_by_email(self, email: str) -> Optional[UserInDB]:
         """根据邮箱获取用户"""
-        users = self.dao.search(self.COLLECTION_NAME, "email", email)
-        if users:
-            user_data = users[0]
+        user_data = self.dao.find_one(self.COLLECTION_NAME, {"email": email})
+        if user_data:
             user_data["id"] = user_data.pop("_id")
             return UserInDB(**user_data)
         return None
@@ -108,7 +111,8 @@ class UserService:
         """更新用户登录信息"""
         try:
             # 使用MongoDB的$inc操作符增加登录次数
-            result = self.dao._MongoDao__db[self.COLLECTION_NAME].update_one(
+            result = self.dao.update_one(
+                self.COLLECTION_NAME,
                 {"_id": ObjectId(user_id)}, 
                 {
                     "$set": {"last_login": datetime.utcnow(), "updated_at": datetime.utcnow()}, 
@@ -157,10 +161,14 @@ class UserService:
             print(f"停用用户时出错: {e}")
             return False
     
-    def get_all_users(self, skip: int = 0, limit: int = 100) -> List[UserInDB]:
-        """获取所有用户（分页）"""
+    def get_all_users(self, skip: int = 0, limit: int = 100,
+                      after: Optional[str] = None, before: Optional[str] = None) -> List[UserInDB]:
+        """获取所有用户（按注册时间分页），after/before 为游标分页参数"""
+        query, sort, reverse = self.LIST_KEYSET.page({}, after, before)
         try:
-            users = self.dao._MongoDao__db[self.COLLECTION_NAME].find({}).skip(skip).limit(limit)
+            users = self.dao.find(self.COLLECTION_NAME, query, sort=sort, skip=skip, limit=limit, secondary=True)
+            if reverse:
+                users = users[::-1]
             result = []
             for user in users:
                 user["id"] = user.pop("_id")
@@ -173,7 +181,7 @@ class UserService:
     def search_users(self, query: dict, skip: int = 0, limit: int = 100) -> List[UserInDB]:
         """搜索用户"""
         try:
-            users = self.dao._MongoDao__db[self.COLLECTION_NAME].find(query).skip(skip).limit(limit)
+            users = self.dao.find(self.COLLECTION_NAME, query, skip=skip, limit=limit, secondary=True)
             result = []
             for user in users:
                 user["id"] = user.pop("_id")
@@ -186,16 +194,156 @@ class UserService:
     def get_user_stats(self) -> dict:
         """获取用户统计信息"""
         try:
-            total_users = self.dao._MongoDao__db[self.COLLECTION_NAME].count_documents({})
-            active_users = self.dao._MongoDao__db[self.COLLECTION_NAME].count_documents({"is_active": True})
+            total_users = self.dao.count(self.COLLECTION_NAME, secondary=True)
+            active_users = self.dao.count(self.COLLECTION_NAME, {"is_active": True}, secondary=True)
             
             # 获取最近7天注册的用户数
             from datetime import timedelta
             seven_days_ago = datetime.utcnow() - timedelta(days=7)
-            recent_users = self.dao._MongoDao__db[self.COLLECTION_NAME].count_documents({
+            recent_users = self.dao.count(self.COLLECTION_NAME, {
                 "created_at": {"$gte": seven_days_ago}
+            }, secondary=True)
+            
+            return {
+                "total_users": total_users,
+                "active_users": active_users,
+                "inactive_users": total_users - active_users,
+                "recent_users": recent_users
+            }
+        except Exception as e:
+            print(f"获取用户统计时出错: {e}")
+            return {}
+
+
+class AsyncUserService(UserService):
+    """用户服务类（异步版本，基于Motor，供async路由使用）"""
+    
+    def __init__(self):
+        self.dao = async_mongo_dao
+    
+    async def create_user(self, user_data: UserCreate) -> Optional[UserInDB]:
+        """创建新用户"""
+        try:
+            existing_user = await self.get_user_by_google_id(user_data.google_id)
+            if existing_user:
+                print(f"用户已存在，更新登录信息: {existing_user.id}")
+                updated_user = await self.update_user_login(str(existing_user.id))
+                return updated_user or existing_user
+            
+            now = datetime.utcnow()
+            user_dict = user_data.dict()
+            user_dict.update({
+                "created_at": now,
+                "updated_at": now,
+                "last_login": now,
+                "login_count": 1,
+                "is_active": True
             })
             
+            await self.dao.insert(self.COLLECTION_NAME, user_dict)
+            print(f"新用户创建成功: {user_data.email}")
+            return await self.get_user_by_google_id(user_data.google_id)
+        except Exception as e:
+            print(f"创建用户时出错: {e}")
+            return None
+    
+    async def get_user_by_google_id(self, google_id: str) -> Optional[UserInDB]:
+        """根据Google ID获取用户"""
+        user_data = await self.dao.find_one(self.COLLECTION_NAME, {"google_id": google_id})
+        if user_data:
+            user_data["id"] = user_data.pop("_id")
+            return UserInDB(**user_data)
+        return None
+    
+    async def get_user_by_id(self, user_id: str) -> Optional[UserInDB]:
+        """根据用户ID获取用户"""
+        try:
+            user_data = await self.dao.find_one(self.COLLECTION_NAME, {"_id": ObjectId(user_id)})
+            if user_data:
+                user_data["id"] = user_data.pop("_id")
+                return UserInDB(**user_data)
+        except Exception as e:
+            print(f"获取用户时出错: {e}, user_id: {user_id}")
+        return None
+    
+    async def get_user_by_email(self, email: str) -> Optional[UserInDB]:
+        """根据邮箱获取用户"""
+        user_data = await self.dao.find_one(self.COLLECTION_NAME, {"email": email})
+        if user_data:
+            user_data["id"] = user_data.pop("_id")
+            return UserInDB(**user_data)
+        return None
+    
+    async def update_user_login(self, user_id: str) -> Optional[UserInDB]:
+        """更新用户登录信息"""
+        try:
+            result = await self.dao.update_one(
+                self.COLLECTION_NAME,
+                {"_id": ObjectId(user_id)}, 
+                {
+                    "$set": {"last_login": datetime.utcnow(), "updated_at": datetime.utcnow()}, 
+                    "$inc": {"login_count": 1}
+                }
+            )
+            if result.modified_count > 0:
+                return await self.get_user_by_id(user_id)
+            print(f"更新用户登录信息失败，用户ID: {user_id}")
+        except Exception as e:
+            print(f"更新用户登录信息时出错: {e}")
+        return None
+    
+    async def update_user(self, user_id: str, user_data: UserUpdate) -> Optional[UserInDB]:
+        """更新用户信息"""
+        try:
+            update_dict = user_data.dict(exclude_unset=True)
+            update_dict["updated_at"] = datetime.utcnow()
+            if await self.dao.update(self.COLLECTION_NAME, "_id", ObjectId(user_id), update_dict):
+                return await self.get_user_by_id(user_id)
+        except Exception as e:
+            print(f"更新用户时出错: {e}")
+        return None
+    
+    async def deactivate_user(self, user_id: str) -> bool:
+        """停用用户"""
+        try:
+            return await self.dao.update(
+                self.COLLECTION_NAME,
+                "_id",
+                ObjectId(user_id),
+                {"is_active": False, "updated_at": datetime.utcnow()}
+            )
+        except Exception as e:
+            print(f"停用用户时出错: {e}")
+            return False
+    
+    async def get_all_users(self, skip: int = 0, limit: int = 100,
+                            after: Optional[str] = None, before: Optional[str] = None) -> List[UserInDB]:
+        """获取所有用户（按注册时间分页），after/before 为游标分页参数"""
+        query, sort, reverse = self.LIST_KEYSET.page({}, after, before)
+        users = await self.search_users(query, skip, limit, sort=sort)
+        return users[::-1] if reverse else users
+    
+    async def search_users(self, query: dict, skip: int = 0, limit: int = 100, sort=None) -> List[UserInDB]:
+        """搜索用户"""
+        result = []
+        try:
+            async for user in self.dao.iterate(self.COLLECTION_NAME, query, sort=sort, skip=skip, limit=limit,
+                                               secondary=True):
+                user["id"] = user.pop("_id")
+                result.append(UserInDB(**user))
+        except Exception as e:
+            print(f"搜索用户时出错: {e}")
+        return result
+    
+    async def get_user_stats(self) -> dict:
+        """获取用户统计信息"""
+        try:
+            from datetime import timedelta
+            seven_days_ago = datetime.utcnow() - timedelta(days=7)
+            total_users = await self.dao.count(self.COLLECTION_NAME, secondary=True)
+            active_users = await self.dao.count(self.COLLECTION_NAME, {"is_active": True}, secondary=True)
+            recent_users = await self.dao.count(self.COLLECTION_NAME, {"created_at": {"$gte": seven_days_ago}}, secondary=True)
+            
             return {
                 "total_users": total_users,
                 "active_users": active_users,
@@ -207,4 +355,5 @@ class UserService:
             return {}
 
 # 创建全局用户服务实例
-user_service = UserService()
+user_service = LazyInstance(UserService)
+async_user_service = LazyInstance(AsyncUserService)
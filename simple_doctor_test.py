@@ -15,8 +15,7 @@ def test_doctor_simple():
         from models.doctor import DoctorInDB
         
         # 直接使用MongoDB查询获取医生
-        doctors = doctor_service.dao._MongoDao__db["doctors"].find({})
-        doctor_list = list(doctors)
+        doctor_list = doctor_service.dao.find("doctors", {})
         print(f"数据库中的医生数量: {len(doctor_list)}")
         
         if doctor_list:
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+测试事件驱动的医生分配引擎
+"""
+
+import sys
+import os
+import asyncio
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from services.assignment_engine import AssignmentEngine
+
+
+class FakeAssigner:
+    """记录分配调用与最大并发数"""
+
+    def __init__(self, unassigned=None, fail=()):
+        self.calls = []
+        self.active = 0
+        self.max_active = 0
+        self.unassigned = unassigned or []
+        self.fail = set(fail)
+
+    async def assign(self, consultation_id):
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        await asyncio.sleep(0.01)
+        self.calls.append(consultation_id)
+        self.active -= 1
+        return consultation_id not in self.fail
+
+    async def fetch_unassigned(self, limit):
+        return [{"id": consultation_id} for consultation_id in self.unassigned[:limit]]
+
+
+async def wait_idle(engine):
+    await engine._queue.join()
+
+
+def test_submit_dedupes_and_bounds_workers():
+    """重复提交只分配一次，并发数不超过worker数量"""
+    print("🧪 测试去重与并发限制...")
+    fake = FakeAssigner(fail=["c3"])
+    engine = AssignmentEngine(assign=fake.assign, fetch_unassigned=fake.fetch_unassigned, workers=2)
+
+    async def run():
+        assert not engine.submit("c0")  # 未启动时不入队
+        await engine.start()
+        for consultation_id in ["c1", "c2", "c1", "c3", "c4", "c2"]:
+            engine.submit(consultation_id)
+        await wait_idle(engine)
+        metrics = engine.metrics()
+        await engine.stop()
+        return metrics
+
+    metrics = asyncio.run(run())
+    assert sorted(fake.calls) == ["c1", "c2", "c3", "c4"]
+    assert fake.max_active == 2
+    assert metrics["assigned"] == 3 and metrics["failed"] == 1
+    assert metrics["queue_depth"] == 0 and metrics["time_to_assign"]["count"] == 3
+    print("✅ 去重与并发限制正确")
+
+
+def test_sweep_and_trigger():
+    """扫描把未分配的咨询入队，连续触发只执行一次扫描"""
+    print("🧪 测试兜底扫描...")
+    fake = FakeAssigner(unassigned=["c1", "c2", "c3"])
+    engine = AssignmentEngine(assign=fake.assign, fetch_unassigned=fake.fetch_unassigned, workers=3)
+
+    async def run():
+        await engine.start()
+        engine.trigger_sweep()
+        engine.trigger_sweep()
+        await engine._sweep_task
+        await wait_idle(engine)
+        sweeps = engine.metrics()["sweeps"]
+        await engine.stop()
+        return sweeps
+
+    assert asyncio.run(run()) == 1
+    assert sorted(fake.calls) == ["c1", "c2", "c3"]
+    print("✅ 扫描入队正确")
+
+
+if __name__ == "__main__":
+    test_submit_dedupes_and_bounds_workers()
+    test_sweep_and_trigger()
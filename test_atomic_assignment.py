@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+测试医生分配的原子认领：同一咨询被多次认领时只有一次成功
+"""
+
+import sys
+import os
+from concurrent.futures import ThreadPoolExecutor
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import mongomock
+from bson import ObjectId
+from utils.mongo_dao import MongoDao
+from services.doctor_service import DoctorService
+
+
+def make_service():
+    service = DoctorService()
+    db = mongomock.MongoClient()["medical_test"]
+    service.dao = MongoDao(db=db)
+    consultation_id = db["consultations"].insert_one({"status": "paid", "assigned_doctor_id": None}).inserted_id
+    doctor_ids = [
+        str(db["doctors"].insert_one({"name": f"医生{i}", "status": "active", "current_consultation_count": 0}).inserted_id)
+        for i in range(8)
+    ]
+    return service, db, str(consultation_id), doctor_ids
+
+
+def test_only_one_claim_wins():
+    """多个医生同时认领同一咨询，只有一个成功"""
+    print("🧪 测试并发认领...")
+    service, db, consultation_id, doctor_ids = make_service()
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(lambda doctor_id: service.assign_doctor_to_consultation(doctor_id, consultation_id),
+                                doctor_ids))
+
+    assert results.count(True) == 1
+    winner = doctor_ids[results.index(True)]
+    consultation = db["consultations"].find_one({"_id": ObjectId(consultation_id)})
+    assert consultation["assigned_doctor_id"] == winner
+    assert consultation["status"] == "in_progress"
+    assert db["doctor_assignments"].count_documents({"consultation_id": consultation_id}) == 1
+
+    busy = list(db["doctors"].find({"status": "busy"}))
+    assert [str(doctor["_id"]) for doctor in busy] == [winner]
+    assert busy[0]["current_consultation_count"] == 1
+    print("✅ 只有一个医生认领成功")
+
+
+def test_unpaid_consultation_not_claimed():
+    """未支付（或已取消）的咨询不能被认领，咨询状态和医生负载保持不变"""
+    print("🧪 测试未支付咨询认领...")
+    service, db, _, doctor_ids = make_service()
+    for status in ("pending", "cancelled"):
+        consultation_id = str(db["consultations"].insert_one({"status": status, "assigned_doctor_id": None}).inserted_id)
+        assert service.assign_doctor_to_consultation(doctor_ids[0], consultation_id) is False
+        consultation = db["consultations"].find_one({"_id": ObjectId(consultation_id)})
+        assert consultation["status"] == status and consultation["assigned_doctor_id"] is None
+
+    assert db["doctor_assignments"].count_documents({}) == 0
+    assert db["doctors"].count_documents({"status": "busy"}) == 0
+    assert db["doctors"].find_one({"_id": ObjectId(doctor_ids[0])})["current_consultation_count"] == 0
+    print("✅ 未支付咨询不会被认领")
+
+
+def test_doctor_not_over_assigned():
+    """自动分配时同一医生被并发选中，只有一个咨询分配成功，其余咨询退回待分配"""
+    print("🧪 测试同一医生并发分配...")
+    service, db, _, doctor_ids = make_service()
+    consultation_ids = [str(db["consultations"].insert_one({"status": "paid", "assigned_doctor_id": None}).inserted_id)
+                        for _ in range(8)]
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(
+            lambda consultation_id: service.assign_doctor_to_consultation(doctor_ids[0], consultation_id,
+                                                                          available_only=True),
+            consultation_ids))
+
+    assert results.count(True) == 1
+    assert db["consultations"].count_documents({"assigned_doctor_id": doctor_ids[0]}) == 1
+    released = db["consultations"].find({"_id": {"$in": [ObjectId(consultation_id) for consultation_id, ok
+                                                          in zip(consultation_ids, results) if not ok]}})
+    assert all(item["status"] == "paid" and item["assigned_doctor_id"] is None and "started_at" not in item
+               for item in released)
+    assert db["doctor_assignments"].count_documents({}) == 1
+    assert db["doctors"].find_one({"_id": ObjectId(doctor_ids[0])})["current_consultation_count"] == 1
+
+    # 手动认领不要求医生在线
+    assert service.assign_doctor_to_consultation(doctor_ids[0], consultation_ids[results.index(False)]) is True
+    print("✅ 医生不会被超额分配")
+
+
+if __name__ == "__main__":
+    test_only_one_claim_wins()
+    test_unpaid_consultation_not_claimed()
+    test_doctor_not_over_assigned()
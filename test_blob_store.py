@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+测试附件存储：内容寻址去重、本地/S3兼容后端、旧附件迁移
+"""
+
+import sys
+import os
+import io
+import asyncio
+import hashlib
+import tempfile
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from starlette.datastructures import UploadFile
+from utils.blob_store import LocalBlobStore, S3BlobStore, is_blob_id, hash_file
+
+
+class FakeS3Client:
+    """内存中的S3兼容客户端（代替MinIO），只实现用到的接口"""
+
+    class NotFound(Exception):
+        response = {"Error": {"Code": "404"}}
+
+    def __init__(self):
+        self.objects = {}
+        self.uploads = 0
+
+    def head_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise self.NotFound()
+        return {"ContentLength": len(self.objects[(Bucket, Key)])}
+
+    def upload_file(self, Filename, Bucket, Key):
+        with open(Filename, "rb") as source:
+            self.objects[(Bucket, Key)] = source.read()
+        self.uploads += 1
+
+    def download_file(self, Bucket, Key, Filename):
+        with open(Filename, "wb") as target:
+            target.write(self.objects[(Bucket, Key)])
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop((Bucket, Key), None)
+
+
+def stage(store, content):
+    path = store.staging_path()
+    with open(path, "wb") as target:
+        target.write(content)
+    return path, hashlib.sha256(content).hexdigest()
+
+
+def test_local_store_dedup():
+    """相同内容只存一份，暂存文件被消耗"""
+    print("🧪 测试本地附件存储...")
+    with tempfile.TemporaryDirectory() as root:
+        store = LocalBlobStore(root)
+        path, blob_id = stage(store, b"report")
+        assert asyncio.run(store.put(path, blob_id)) is True
+        again, _ = stage(store, b"report")
+        assert asyncio.run(store.put(again, blob_id)) is False
+        assert not os.path.exists(path) and not os.path.exists(again)
+        assert asyncio.run(store.exists(blob_id))
+        assert hash_file(store.local_path(blob_id)) == blob_id
+        assert store.local_path(blob_id).endswith(os.path.join(blob_id[:2], blob_id[2:4], blob_id))
+
+        asyncio.run(store.delete(blob_id))
+        assert not asyncio.run(store.exists(blob_id))
+        try:
+            store.local_path("../../etc/passwd")
+            assert False, "应当拒绝非法ID"
+        except ValueError:
+            pass
+    print("✅ 本地附件存储正常")
+
+
+def test_s3_store_dedup():
+    """S3后端：已存在的对象不再上传"""
+    print("🧪 测试S3附件存储...")
+    client = FakeS3Client()
+    with tempfile.TemporaryDirectory() as staging:
+        store = S3BlobStore(client=client, bucket="medical", prefix="blobs/", staging_dir=staging)
+        path, blob_id = stage(store, b"scan")
+        assert asyncio.run(store.put(path, blob_id)) is True
+        again, _ = stage(store, b"scan")
+        assert asyncio.run(store.put(again, blob_id)) is False
+        assert client.uploads == 1
+        assert client.objects[("medical", f"blobs/{blob_id}")] == b"scan"
+        assert os.listdir(staging) == []
+        assert store.local_path(blob_id) is None
+
+
+        async def read_local():
+            async with store.open_local(blob_id) as path:
+                with open(path, "rb") as source:
+                    return path, source.read()
+
+        path, content = asyncio.run(read_local())
+        assert content == b"scan" and not os.path.exists(path)
+
+        asyncio.run(store.delete(blob_id))
+        assert not asyncio.run(store.exists(blob_id))
+    print("✅ S3附件存储正常")
+
+
+def make_attachment_service(root, db=None):
+    """附件服务使用本地存储和内存数据库；db 为 mongomock_motor 数据库，需要直接读写时传入"""
+    from mongomock_motor import AsyncMongoMockClient
+    from utils.async_mongo_dao import AsyncMongoDao
+    from services.attachment_service import AttachmentService
+
+    service = AttachmentService(store=LocalBlobStore(root))
+    service.dao = AsyncMongoDao(db=db if db is not None else AsyncMongoMockClient()["medical_test"])
+    return service
+
+
+def test_save_attachments_records_metadata():
+    """上传返回附件ID，元数据保留首次上传的文件名"""
+    print("🧪 测试附件元数据...")
+    with tempfile.TemporaryDirectory() as root:
+        service = make_attachment_service(root)
+
+        async def run():
+            first = await service.save_attachments([UploadFile(io.BytesIO(b"x" * 100), filename="血常规.pdf")])
+            second = await service.save_attachments([UploadFile(io.BytesIO(b"x" * 100), filename="copy.pdf")])
+            return first, second, await service.get(first[0])
+
+        first, second, blob = asyncio.run(run())
+        assert first == second and is_blob_id(first[0])
+        assert blob["filename"] == "血常规.pdf" and blob["size"] == 100
+        assert blob["content_type"] == "application/pdf"
+        assert asyncio.run(service.get("uploads/a.pdf")) is None
+    print("✅ 附件元数据正常")
+
+
+def test_attachment_access_and_details():
+    """只有引用附件的咨询所属用户或已分配医生可以下载；详情一次查询返回文件名"""
+    print("🧪 测试附件权限与详情...")
+    from services.consultation_service import AsyncConsultationService
+
+    with tempfile.TemporaryDirectory() as root:
+        service = make_attachment_service(root)
+        consultations = AsyncConsultationService()
+        consultations.dao = service.dao
+
+        async def run():
+            blob_id, = await service.save_attachments([UploadFile(io.BytesIO(b"dicom"), filename="ct.dcm")])
+            await service.dao.insert("consultations", {"user_id": "u1", "assigned_doctor_id": "d1",
+                                                       "attachments": [blob_id, "uploads/old.pdf"]})
+            checks = [
+                await consultations.can_access_attachment(blob_id, user_id="u1"),
+                await consultations.can_access_attachment(blob_id, doctor_id="d1"),
+                await consultations.can_access_attachment(blob_id, user_id="u2", doctor_id="d2"),
+                await consultations.can_access_attachment(blob_id),
+            ]
+            return blob_id, checks, await service.describe([blob_id, "uploads/old.pdf"])
+
+        blob_id, checks, details = asyncio.run(run())
+        assert checks == [True, True, False, False]
+        assert details[0] == {"id": blob_id, "filename": "ct.dcm", "size": 5,
+                              "content_type": details[0]["content_type"], "url": f"/api/attachments/{blob_id}",
+                              "preview_url": None}
+        assert details[1]["filename"] == "old.pdf" and details[1]["url"] is None
+    print("✅ 附件权限与详情正常")
+
+
+def test_migrate_legacy_paths():
+    """旧路径替换为附件ID，重复文件只导入一次，缺失文件保留原路径"""
+    print("🧪 测试旧附件迁移...")
+    from mongomock_motor import AsyncMongoMockClient
+    from migrate_attachments import migrate_attachments
+
+    with tempfile.TemporaryDirectory() as root:
+        db = AsyncMongoMockClient()["medical_test"]
+        service = make_attachment_service(os.path.join(root, "blobs"), db)
+        os.makedirs(os.path.join(root, "uploads"))
+        with open(os.path.join(root, "uploads", "a.png"), "wb") as target:
+            target.write(b"png")
+
+        async def run():
+            await db.consultations.insert_many([
+                {"_id": 1, "attachments": ["uploads/a.png", "uploads/missing.pdf"]},
+                {"_id": 2, "attachments": ["uploads/a.png"]},
+                {"_id": 3, "attachments": []},
+            ])
+            planned = await migrate_attachments(service, dry_run=True, base_dir=root)
+            unchanged = await db.consultations.find_one({"_id": 2})
+            stats = await migrate_attachments(service, base_dir=root)
+            rerun = await migrate_attachments(service, base_dir=root)
+            return planned, unchanged, stats, rerun, await db.consultations.find().sort("_id").to_list(None)
+
+        planned, unchanged, stats, rerun, documents = asyncio.run(run())
+        blob_id = hashlib.sha256(b"png").hexdigest()
+        assert unchanged["attachments"] == ["uploads/a.png"]
+        assert planned["files"] == 1 and planned["documents"] == 2
+        assert stats == {"documents": 2, "files": 1, "missing": ["uploads/missing.pdf"]}
+        assert documents[0]["attachments"] == [blob_id, "uploads/missing.pdf"]
+        assert documents[1]["attachments"] == [blob_id]
+        assert rerun["documents"] == 0 and rerun["files"] == 0
+        assert os.path.exists(service.store.local_path(blob_id))
+    print("✅ 旧附件迁移正常")
+
+
+if __name__ == "__main__":
+    test_local_store_dedup()
+    test_s3_store_dedup()
+    test_save_attachments_records_metadata()
+    test_attachment_access_and_details()
+    test_migrate_legacy_paths()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+测试聊天消息实时推送
+"""
+
+import sys
+import os
+import asyncio
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from services.chat_hub import ChatHub, InProcessBroker, RedisBroker
+
+
+def test_fan_out_per_consultation():
+    """消息只推送给同一咨询的订阅者"""
+    print("🧪 测试按咨询分发...")
+    hub = ChatHub(broker=InProcessBroker())
+
+    async def run():
+        async with hub.subscribe("c1") as first, hub.subscribe("c1") as second, hub.subscribe("c2") as other:
+            assert hub.subscriber_count("c1") == 2
+            await hub.publish("c1", {"type": "message", "message": {"id": "m1"}})
+            received = [await first.get(), await second.get()]
+            assert other.empty()
+        assert hub.subscriber_count() == 0
+        await hub.stop()
+        return received
+
+    received = asyncio.run(run())
+    assert all(event["message"]["id"] == "m1" for event in received)
+    print("✅ 按咨询分发正常")
+
+
+def test_slow_subscriber_drops_oldest():
+    """慢订阅者的队列满时丢弃最早的消息"""
+    print("🧪 测试慢订阅者...")
+    hub = ChatHub(broker=InProcessBroker(), queue_size=2)
+
+    async def run():
+        async with hub.subscribe("c1") as queue:
+            for index in range(3):
+                await hub.publish("c1", {"type": "message", "message": {"id": f"m{index}"}})
+            return [(await queue.get())["message"]["id"] for _ in range(queue.qsize())]
+
+    assert asyncio.run(run()) == ["m1", "m2"]
+    print("✅ 慢订阅者只保留最新消息")
+
+
+def test_redis_broker_between_hubs():
+    """两个进程（两个hub）通过Redis互相推送"""
+    try:
+        from fakeredis import FakeServer
+        from fakeredis.aioredis import FakeRedis
+    except ImportError:
+        print("⚠️ 未安装fakeredis，跳过Redis推送测试")
+        return
+    print("🧪 测试Redis推送...")
+    server = FakeServer()
+
+    async def run():
+        publisher = ChatHub(broker=RedisBroker(client=FakeRedis(server=server)))
+        subscriber = ChatHub(broker=RedisBroker(client=FakeRedis(server=server)))
+        async with subscriber.subscribe("c1") as queue:
+            await publisher.publish("c1", {"type": "message", "message": {"id": "m1"}})
+            event = await asyncio.wait_for(queue.get(), timeout=5)
+        await publisher.stop()
+        await subscriber.stop()
+        return event
+
+    assert asyncio.run(run())["message"]["id"] == "m1"
+    print("✅ Redis推送正常")
+
+
+if __name__ == "__main__":
+    test_fan_out_per_consultation()
+    test_slow_subscriber_drops_oldest()
+    test_redis_broker_between_hubs()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+测试发送聊天消息：由插入结果直接返回消息，批量发送使用insert_many
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import mongomock
+from utils.mongo_dao import MongoDao
+from services.consultation_service import ConsultationService
+
+
+class MockMongoDao(MongoDao):
+    """底层使用mongomock的MongoDao，记录执行的操作"""
+
+    def __init__(self):
+        super().__init__(db=mongomock.MongoClient()["medical_test"])
+        self.calls = []
+
+    def insert(self, collection_name, parm):
+        self.calls.append("insert")
+        return super().insert(collection_name, parm)
+
+    def insert_many(self, collection_name, documents, ordered=True):
+        self.calls.append("insert_many")
+        return super().insert_many(collection_name, documents, ordered)
+
+    def find(self, *args, **kwargs):
+        self.calls.append("find")
+        return super().find(*args, **kwargs)
+
+
+def make_service():
+    service = ConsultationService()
+    service.dao = MockMongoDao()
+    return service
+
+
+def test_send_returns_inserted_message():
+    """发送消息只写一次库，返回的就是刚插入的消息"""
+    print("🧪 测试发送消息...")
+    service = make_service()
+    first = service.send_chat_message("c1", "u1", "user", "你好")
+    # 另一条同时发送的消息不会被当作返回值
+    second = service.send_chat_message("c1", "d1", "doctor", "您好")
+    assert service.dao.calls == ["insert", "insert"]
+    assert first.message == "你好" and second.sender_type == "doctor"
+    assert first.id != second.id
+
+    stored = service.get_chat_messages("c1")
+    assert [(str(m.id), m.created_at) for m in stored] == [(str(first.id), first.created_at),
+                                                        (str(second.id), second.created_at)]
+    print("✅ 发送消息正常")
+
+
+def test_send_many():
+    """批量发送一次insert_many"""
+    print("🧪 测试批量发送...")
+    service = make_service()
+    messages = service.send_chat_messages([
+        {"consultation_id": "c1", "sender_id": "system", "sender_type": "system", "message": "医生已接诊"},
+        {"consultation_id": "c2", "sender_id": "bot", "sender_type": "bot", "message": "请描述症状",
+         "message_type": "text"},
+    ])
+    assert service.dao.calls == ["insert_many"]
+    assert [m.consultation_id for m in messages] == ["c1", "c2"]
+    assert service.send_chat_messages([]) == []
+    assert str(service.get_chat_messages("c2")[0].id) == str(messages[1].id)
+    print("✅ 批量发送正常")
+
+
+if __name__ == "__main__":
+    test_send_returns_inserted_message()
+    test_send_many()
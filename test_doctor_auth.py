@@ -15,7 +15,7 @@ def test_doctor_auth():
         from models.doctor import DoctorInDB
         
         # 获取所有医生
-        doctors = list(doctor_service.dao._MongoDao__db["doctors"].find({}))
+        doctors = doctor_service.dao.find("doctors", {})
         print(f"数据库中的医生数量: {len(doctors)}")
         
         if doctors:
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+测试医生负载索引
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from concurrent.futures import ThreadPoolExecutor
+from services.doctor_load_index import DoctorLoadIndex
+
+DOCTORS = [
+    {"id": "d1", "name": "张医生", "level": "normal", "status": "active"},
+    {"id": "d2", "name": "李医生", "level": "normal", "status": "active"},
+    {"id": "d3", "name": "王医生", "level": "normal", "status": "offline"},
+    {"id": "d4", "name": "赵医生", "level": "expert", "status": "active"},
+]
+
+
+def test_least_loaded_after_reconcile():
+    """对齐后按等级返回负载最小的在线医生"""
+    print("🧪 测试负载最小医生选择...")
+    index = DoctorLoadIndex()
+    index.reconcile(DOCTORS, {"d1": 2, "d2": 1, "d3": 0})
+    assert index.least_loaded("normal")["id"] == "d2"
+    assert index.least_loaded("expert")["id"] == "d4"
+    assert index.least_loaded("senior") is None
+    print("✅ 选择正确，离线医生被忽略")
+
+
+def test_incremental_updates():
+    """分配、完成和状态变化增量更新，过期堆条目被跳过"""
+    print("🧪 测试增量更新...")
+    index = DoctorLoadIndex()
+    index.reconcile(DOCTORS, {})
+
+    index.adjust_load("d1", 1)
+    assert index.least_loaded("normal")["id"] == "d2"
+    index.adjust_load("d2", 2)
+    assert index.least_loaded("normal")["id"] == "d1"
+
+    index.set_status("d1", "busy")
+    assert index.least_loaded("normal")["id"] == "d2"
+    index.set_status("d3", "active")
+    assert index.least_loaded("normal")["id"] == "d3"
+
+    index.adjust_load("d2", -2)
+    index.set_status("d1", "active")
+    # d2与d3负载都为0时，最久未变化的d3优先
+    assert index.least_loaded("normal")["id"] == "d3"
+
+    assert not index.set_status("unknown", "active")
+    index.upsert("d5", "normal", "active", load=0, name="新医生")
+    index.adjust_load("d3", 1)
+    assert index.least_loaded("normal")["id"] == "d2"
+    print("✅ 增量更新正确")
+
+
+def test_heap_does_not_grow_without_bound():
+    """频繁变化时堆会被压缩"""
+    index = DoctorLoadIndex()
+    index.reconcile(DOCTORS, {})
+    for _ in range(1000):
+        index.adjust_load("d1", 1)
+        index.adjust_load("d1", -1)
+    assert len(index._heaps["normal"]) <= 2 * len(DOCTORS) + 17
+    assert index.least_loaded("normal")["id"] in ("d1", "d2")
+
+
+def test_reserve_is_exclusive():
+    """并发占用时每个在线医生只被选中一次，释放后可再次选中"""
+    print("🧪 测试并发占用医生...")
+    index = DoctorLoadIndex()
+    index.reconcile(DOCTORS, {"d2": 1})
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        reserved = list(pool.map(lambda _: index.reserve("normal"), range(8)))
+    picked = [doctor["id"] for doctor in reserved if doctor]
+    assert sorted(picked) == ["d1", "d2"]
+    assert index.least_loaded("normal") is None
+
+    index.release("d1")
+    assert index.reserve("normal")["id"] == "d1"
+    # 数据库中已离线的医生释放后不再被选中
+    index.release("d1", "offline")
+    assert index.reserve("normal") is None
+    # 达到上限的医生不会被选中
+    index.release("d2")
+    assert index.reserve("normal", max_load=1) is None
+    print("✅ 占用互斥，释放后恢复")
+
+
+if __name__ == "__main__":
+    test_least_loaded_after_reconcile()
+    test_incremental_updates()
+    test_heap_does_not_grow_without_bound()
+    test_reserve_is_exclusive()
@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+测试医生收入统计：$facet聚合、完成时增量更新的日汇总、汇总重建、收入趋势与导出
+"""
+
+import sys
+import os
+import asyncio
+from datetime import datetime, timedelta
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from bson import ObjectId
+from services.earnings_service import EarningsService, AsyncEarningsService, EXPORT_COLUMNS, parse_range
+from utils import tabular_export
+
+
+def make_services():
+    """同步和异步服务共用一个内存数据库"""
+    from mongomock_motor import AsyncMongoMockClient
+    from utils.mongo_dao import MongoDao
+    from utils.async_mongo_dao import AsyncMongoDao
+    from services.consultation_service import AsyncConsultationService
+    from services.doctor_service import AsyncDoctorService
+    from services import consultation_service as consultation_module
+
+    db = AsyncMongoMockClient()["medical_test"]
+    dao = AsyncMongoDao(db=db)
+    earnings = AsyncEarningsService()
+    earnings.dao = dao
+    consultations = AsyncConsultationService()
+    consultations.dao = dao
+    doctors = AsyncDoctorService()
+    doctors.dao = dao
+    sync_earnings = EarningsService()
+    # mongomock_motor 包装的是 mongomock 数据库，同步DAO直接使用同一个
+    sync_earnings.dao = MongoDao(db=db.delegate)
+    consultation_module.async_earnings_service.reset(earnings)
+    return dao, earnings, sync_earnings, consultations, doctors
+
+
+async def seed(dao, now):
+    doctor_id = ObjectId()
+    await dao.insert("doctors", {"_id": doctor_id, "name": "王医生", "email": "d@x", "google_id": "g",
+                                 "level": "expert", "status": "active", "is_active": True,
+                                 "license_number": "L1", "phone": "1", "hospital": "h", "department": "d",
+                                 "specialties": [], "experience_years": 10, "introduction": "",
+                                 "consultation_fee": 50.0, "current_consultation_count": 2, "total_consultations": 0,
+                                 "total_earnings": 0.0, "created_at": now, "updated_at": now})
+    ids = []
+    for price, level, status in ((10.0, "normal", "in_progress"), (50.0, "expert", "in_progress"),
+                                 (100.0, "expert", "paid")):
+        consultation_id = ObjectId()
+        await dao.insert("consultations", {"_id": consultation_id, "user_id": "u1", "mode": "onetime",
+                                           "disease_description": "d", "status": status, "price_usdt": price,
+                                           "doctor_level": level, "assigned_doctor_id": str(doctor_id),
+                                           "created_at": now, "updated_at": now})
+        ids.append(str(consultation_id))
+    # 完成于上个月的历史咨询（只有创建时间）
+    await dao.insert("consultations", {"_id": ObjectId(), "user_id": "u1", "mode": "onetime", "status": "completed",
+                                       "disease_description": "d", "price_usdt": 30.0, "doctor_level": "normal",
+                                       "assigned_doctor_id": str(doctor_id),
+                                       "created_at": now - timedelta(days=40), "updated_at": now})
+    return str(doctor_id), ids
+
+
+def test_completion_rollup():
+    """完成咨询时增量更新日汇总和医生总额，重复完成只计入一次；结果与$facet聚合一致"""
+    print("🧪 测试收入日汇总...")
+    from models.consultation import ConsultationStatus
+    dao, earnings, sync_earnings, consultations, doctors = make_services()
+
+    async def run():
+        now = datetime.utcnow()
+        doctor_id, ids = await seed(dao, now)
+        # 历史数据先重建一次
+        rebuilt = sync_earnings.rebuild()
+        for consultation_id in ids[:2] + ids[:1]:
+            await consultations.update_consultation_status(consultation_id, ConsultationStatus.COMPLETED)
+        summary = await doctors.get_doctor_earnings(doctor_id)
+        baseline = await earnings.compute_doctor_earnings(doctor_id)
+        rollup = await dao.find("doctor_earnings_daily", {"doctor_id": doctor_id}, sort=[("day", 1)])
+        return rebuilt, summary, baseline, rollup
+
+    try:
+        rebuilt, summary, baseline, rollup = asyncio.run(run())
+    finally:
+        from services import consultation_service as consultation_module
+        consultation_module.async_earnings_service.reset()
+
+    assert rebuilt == {"days": 1, "doctors": 1}
+    assert summary.total_earnings == 90.0 and summary.completed_consultations == 3
+    assert summary.daily_earnings == 60.0 and summary.monthly_earnings == 60.0
+    assert summary.pending_consultations == 0
+    assert baseline == {"total_earnings": 90.0, "completed_consultations": 3, "monthly_earnings": 60.0,
+                        "weekly_earnings": summary.weekly_earnings, "daily_earnings": 60.0}
+    assert [day["earnings"] for day in rollup] == [30.0, 60.0]
+    assert rollup[1]["levels"] == {"normal": {"earnings": 10.0, "consultations": 1},
+                                   "expert": {"earnings": 50.0, "consultations": 1}}
+    print("✅ 收入日汇总正常")
+
+
+def test_rebuild_matches_incremental():
+    """重建得到的日汇总和医生总额与增量更新的结果相同"""
+    print("🧪 测试收入汇总重建...")
+    from models.consultation import ConsultationStatus
+    dao, earnings, sync_earnings, consultations, doctors = make_services()
+
+    async def run():
+        doctor_id, ids = await seed(dao, datetime.utcnow())
+        sync_earnings.rebuild()
+        for consultation_id in ids:
+            await consultations.update_consultation_status(consultation_id, ConsultationStatus.COMPLETED)
+        incremental = await dao.find("doctor_earnings_daily", {}, projection={"updated_at": 0}, sort=[("_id", 1)])
+        await dao.update_one("doctor_earnings_daily", {"_id": incremental[-1]["_id"]}, {"$set": {"earnings": 0}})
+        sync_earnings.rebuild()
+        rebuilt = await dao.find("doctor_earnings_daily", {}, projection={"updated_at": 0}, sort=[("_id", 1)])
+        doctor = await dao.find_one("doctors", {"_id": ObjectId(doctor_id)})
+        # 已完成咨询全部改派给其他医生后，重建把原医生的总额清零
+        await dao.update_many("consultations", {"assigned_doctor_id": doctor_id},
+                              {"$set": {"assigned_doctor_id": "other"}})
+        sync_earnings.rebuild()
+        reassigned = await dao.find_one("doctors", {"_id": ObjectId(doctor_id)})
+        return incremental, rebuilt, doctor, reassigned
+
+    try:
+        incremental, rebuilt, doctor, reassigned = asyncio.run(run())
+    finally:
+        from services import consultation_service as consultation_module
+        consultation_module.async_earnings_service.reset()
+
+    assert rebuilt == incremental
+    assert doctor["total_earnings"] == 190.0 and doctor["total_consultations"] == 4
+    assert reassigned["total_earnings"] == 0 and reassigned["total_consultations"] == 0
+    print("✅ 收入汇总重建正常")
+
+
+async def seed_rollup(dao):
+    """两位医生三天的日汇总，2024-03-04 是周一"""
+    rollups = [
+        ("d1", datetime(2024, 2, 28), {"normal": (10.0, 1)}),
+        ("d1", datetime(2024, 3, 4), {"normal": (10.0, 1), "expert": (50.0, 1)}),
+        ("d2", datetime(2024, 3, 4), {"expert": (100.0, 2)}),
+        ("d1", datetime(2024, 3, 10), {"expert": (50.0, 1)}),
+    ]
+    for doctor_id, day, levels in rollups:
+        await dao.insert("doctor_earnings_daily", {
+            "_id": EarningsService.rollup_id(doctor_id, day), "doctor_id": doctor_id, "day": day,
+            "earnings": sum(earnings for earnings, _ in levels.values()),
+            "consultations": sum(count for _, count in levels.values()),
+            "levels": {level: {"earnings": earnings, "consultations": count}
+                       for level, (earnings, count) in levels.items()},
+        })
+
+
+def test_earnings_series():
+    """收入趋势按日/周/月分桶，没有收入的时段补0；日期范围校验"""
+    print("🧪 测试收入趋势...")
+    dao, earnings, _, _, _ = make_services()
+
+    async def run():
+        await seed_rollup(dao)
+        start, end = parse_range("2024-02-27", "2024-03-10", 30)
+        return {granularity: await earnings.get_series("d1", start, end, granularity)
+                for granularity in ("day", "week", "month")}
+
+    series = asyncio.run(run())
+    days = series["day"]
+    assert len(days) == 13 and days[0]["start"] == "2024-02-27" and days[-1]["start"] == "2024-03-10"
+    assert [day["earnings"] for day in days if day["earnings"]] == [10.0, 60.0, 50.0]
+    assert days[0] == {"start": "2024-02-27", "earnings": 0, "consultations": 0, "levels": {}}
+    assert [(week["start"], week["earnings"]) for week in series["week"]] == [
+        ("2024-02-26", 10.0), ("2024-03-04", 110.0)]
+    assert series["week"][1]["levels"] == {"normal": {"earnings": 10.0, "consultations": 1},
+                                           "expert": {"earnings": 100.0, "consultations": 2}}
+    assert [(month["start"], month["earnings"]) for month in series["month"]] == [
+        ("2024-02-01", 10.0), ("2024-03-01", 110.0)]
+
+    now = datetime(2024, 3, 10, 15)
+    assert parse_range(None, None, 30, now=now) == (datetime(2024, 2, 10), datetime(2024, 3, 10))
+    for start, end in (("2024-03-10", "2024-03-01"), ("2024/03/01", None), ("2022-01-01", "2024-03-01")):
+        try:
+            parse_range(start, end, 30, 731, now=now)
+            assert False, (start, end)
+        except ValueError:
+            pass
+    try:
+        asyncio.run(earnings.get_series("d1", now, now, "year"))
+        assert False, "不支持的粒度"
+    except ValueError:
+        pass
+    print("✅ 收入趋势正常")
+
+
+def test_earnings_export():
+    """导出按日期、医生、等级逐行输出，CSV分块返回；安装了pyarrow时Parquet每块一个行组"""
+    print("🧪 测试收入导出...")
+    dao, earnings, _, _, _ = make_services()
+
+    async def collect(format, chunk_rows):
+        rows = earnings.iterate_rollup(datetime(2024, 3, 1), datetime(2024, 3, 31), batch_size=2)
+        return [chunk async for chunk in tabular_export.export_stream(format, rows, EXPORT_COLUMNS, chunk_rows)]
+
+    asyncio.run(seed_rollup(dao))
+    chunks = asyncio.run(collect("csv", 2))
+    lines = b"".join(chunks).decode("utf-8-sig").splitlines()
+    assert len(chunks) == 3
+    assert lines == [
+        "day,doctor_id,level,earnings,consultations",
+        "2024-03-04,d1,expert,50.0,1",
+        "2024-03-04,d1,normal,10.0,1",
+        "2024-03-04,d2,expert,100.0,2",
+        "2024-03-10,d1,expert,50.0,1",
+    ]
+
+    async def scoped():
+        return [row async for row in earnings.iterate_rollup(datetime(2024, 3, 1), datetime(2024, 3, 31), "d2")]
+    assert asyncio.run(scoped()) == [
+        {"day": "2024-03-04", "doctor_id": "d2", "level": "expert", "earnings": 100.0, "consultations": 2}]
+
+    if tabular_export.pyarrow is None:
+        assert tabular_export.export_formats() == ("csv",)
+        print("⚠️ 未安装pyarrow，跳过Parquet导出")
+    else:
+        import io
+        import pyarrow.parquet as pq
+        parquet = pq.ParquetFile(io.BytesIO(b"".join(asyncio.run(collect("parquet", 3)))))
+        assert parquet.metadata.num_row_groups == 2
+        table = parquet.read()
+        assert table.column("earnings").to_pylist() == [50.0, 10.0, 100.0, 50.0]
+        assert table.column("consultations").to_pylist() == [1, 1, 2, 1]
+    print("✅ 收入导出正常")
+
+
+if __name__ == "__main__":
+    test_completion_rollup()
+    test_rebuild_matches_incremental()
+    test_earnings_series()
+    test_earnings_export()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+测试基于版本号的ETag，版本号由数据库派生
+"""
+
+import sys
+import os
+import time
+import asyncio
+from datetime import datetime, timedelta
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from bson import ObjectId
+from utils.etag import ETagSigner
+
+
+def test_match_requires_same_version_and_scope():
+    """版本号、请求范围都相同时才匹配"""
+    print("🧪 测试ETag匹配...")
+    signer = ETagSigner("secret")
+    etag = signer.make("r.3", "messages|u1|c1|limit=50")
+    assert signer.matches(etag, "r.3", "messages|u1|c1|limit=50") == etag
+    assert signer.matches(f'W/"other", {etag}', "r.3", "messages|u1|c1|limit=50") == etag
+    assert signer.matches(etag, "r.4", "messages|u1|c1|limit=50") is None
+    # 其他用户拿到同一个ETag也不能得到304
+    assert signer.matches(etag, "r.3", "messages|u2|c1|limit=50") is None
+    assert ETagSigner("other").matches(etag, "r.3", "messages|u1|c1|limit=50") is None
+    assert signer.matches(None, "r.3", "x") is None
+    assert signer.matches('W/"garbage"', "r.3", "x") is None
+    print("✅ ETag匹配正常")
+
+
+def test_valid_until():
+    """带过期时间的ETag过期后不再匹配"""
+    print("🧪 测试ETag过期...")
+    signer = ETagSigner("secret")
+    expires_at = datetime(2030, 1, 1)
+    etag = signer.make("a1.2", "payment|u1|c1", valid_until=expires_at)
+    deadline = int(etag.split(":")[1])
+    assert signer.matches(etag, "a1.2", "payment|u1|c1", now=deadline - 1) == etag
+    assert signer.matches(etag, "a1.2", "payment|u1|c1", now=deadline) is None
+    # 篡改过期时间会使签名失效
+    forged = etag.replace(f":{deadline}:", f":{deadline + 3600}:")
+    assert signer.matches(forged, "a1.2", "payment|u1|c1", now=time.time()) is None
+    print("✅ ETag过期正常")
+
+
+def test_poll_version_from_database():
+    """不同进程的服务读到相同的版本号；任何写入路径的新消息、状态和订单变化都会改变版本号"""
+    print("🧪 测试数据库派生的版本号...")
+    from mongomock_motor import AsyncMongoMockClient
+    from utils.async_mongo_dao import AsyncMongoDao
+    from services.consultation_service import AsyncConsultationService
+
+    db = AsyncMongoMockClient()["medical_test"]
+    workers = [AsyncConsultationService(), AsyncConsultationService()]
+    for service in workers:
+        service.dao = AsyncMongoDao(db=db)
+    now = datetime.utcnow()
+    consultation_id = ObjectId()
+
+    async def run():
+        versions = []
+
+        async def snapshot(scope):
+            current = [await service.get_poll_version(str(consultation_id), scope) for service in workers]
+            assert current[0] == current[1]
+            versions.append(current[0])
+
+        await db.consultations.insert_one({"_id": consultation_id, "status": "pending", "updated_at": now})
+        await db.payment_orders.insert_one({"consultation_id": str(consultation_id), "status": "pending",
+                                            "updated_at": now})
+        await snapshot("messages")
+        # 直接写库（如同步服务），且时间早于已有消息
+        await db.chat_messages.insert_one({"consultation_id": str(consultation_id), "created_at": now})
+        await snapshot("messages")
+        await db.chat_messages.insert_one({"consultation_id": str(consultation_id),
+                                           "created_at": now - timedelta(seconds=5)})
+        await snapshot("messages")
+        await db.consultations.update_one({"_id": consultation_id},
+                                          {"$set": {"updated_at": now + timedelta(seconds=1)}})
+        await snapshot("messages")
+        await snapshot("payment")
+        await db.payment_orders.update_one({"consultation_id": str(consultation_id)},
+                                           {"$set": {"status": "paid", "updated_at": now + timedelta(seconds=2)}})
+        await snapshot("payment")
+        return versions, await workers[0].get_poll_version("bad-id", "messages")
+
+    versions, invalid = asyncio.run(run())
+    assert len(set(versions)) == len(versions)
+    assert invalid == "0"
+    print("✅ 版本号随数据变化，各进程一致")
+
+
+if __name__ == "__main__":
+    test_match_requires_same_version_and_scope()
+    test_valid_until()
+    test_poll_version_from_database()
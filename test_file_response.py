@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+测试附件下载响应：Range解析、206/416、HEAD、零拷贝扩展
+"""
+
+import sys
+import os
+import asyncio
+import tempfile
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import httpx
+from starlette.applications import Starlette
+from starlette.routing import Route
+from utils.file_response import RangeFileResponse, RangeNotSatisfiable, parse_range
+
+CONTENT = bytes(range(256)) * 40
+
+
+def test_parse_range():
+    """单个范围、开放范围、后缀范围；多个范围忽略；越界抛出异常"""
+    print("🧪 测试Range解析...")
+    assert parse_range(None, 100) is None
+    assert parse_range("bytes=0-9", 100) == (0, 9)
+    assert parse_range("bytes=90-", 100) == (90, 99)
+    assert parse_range("bytes=90-500", 100) == (90, 99)
+    assert parse_range("bytes=-10", 100) == (90, 99)
+    assert parse_range("bytes=-500", 100) == (0, 99)
+    assert parse_range("bytes=0-1,5-6", 100) is None
+    assert parse_range("items=0-1", 100) is None
+    for header in ("bytes=100-", "bytes=5-1", "bytes=-0"):
+        try:
+            parse_range(header, 100)
+            assert False, f"应当无法满足: {header}"
+        except RangeNotSatisfiable:
+            pass
+    print("✅ Range解析正常")
+
+
+def make_client(path):
+    async def serve(request):
+        return RangeFileResponse(path, "application/pdf", request.headers.get("range"),
+                                 headers={"ETag": '"abc"'}, send_body=request.method != "HEAD")
+
+    app = Starlette(routes=[Route("/", serve, methods=["GET", "HEAD"])])
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://t")
+
+
+def test_range_responses():
+    """完整文件200、分段206、越界416、HEAD只返回头"""
+    print("🧪 测试Range响应...")
+    with tempfile.NamedTemporaryFile(suffix=".pdf") as file:
+        file.write(CONTENT)
+        file.flush()
+
+        async def run():
+            async with make_client(file.name) as client:
+                return (await client.get("/"),
+                        await client.get("/", headers={"Range": "bytes=100-199"}),
+                        await client.get("/", headers={"Range": "bytes=-10"}),
+                        await client.get("/", headers={"Range": "bytes=999999-"}),
+                        await client.head("/"))
+
+        full, part, tail, invalid, head = asyncio.run(run())
+        assert full.status_code == 200 and full.content == CONTENT
+        assert full.headers["accept-ranges"] == "bytes" and full.headers["etag"] == '"abc"'
+        assert part.status_code == 206 and part.content == CONTENT[100:200]
+        assert part.headers["content-range"] == f"bytes 100-199/{len(CONTENT)}"
+        assert part.headers["content-length"] == "100"
+        assert tail.status_code == 206 and tail.content == CONTENT[-10:]
+        assert invalid.status_code == 416 and invalid.headers["content-range"] == f"bytes */{len(CONTENT)}"
+        assert head.status_code == 200 and head.content == b""
+        assert head.headers["content-length"] == str(len(CONTENT))
+    print("✅ Range响应正常")
+
+
+def test_zero_copy_extension():
+    """服务器支持 http.response.zerocopysend 时把文件交给服务器发送"""
+    print("🧪 测试零拷贝发送...")
+    with tempfile.NamedTemporaryFile() as file:
+        file.write(CONTENT)
+        file.flush()
+        sent = []
+
+        async def send(message):
+            if message["type"] == "http.response.zerocopysend":
+                message = dict(message, file=message["file"].read())
+            sent.append(message)
+
+        scope = {"type": "http", "extensions": {"http.response.zerocopysend": {}}}
+        asyncio.run(RangeFileResponse(file.name, range_header="bytes=10-19")(scope, None, send))
+        assert sent[0]["status"] == 206
+        assert sent[1]["type"] == "http.response.zerocopysend"
+        assert (sent[1]["offset"], sent[1]["count"]) == (10, 10)
+    print("✅ 零拷贝发送正常")
+
+
+if __name__ == "__main__":
+    test_parse_range()
+    test_range_responses()
+    test_zero_copy_extension()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+测试Google证书缓存与ID token验证（离线，使用本地生成的证书）
+"""
+
+import sys
+import os
+import json
+import time
+import asyncio
+import datetime
+import tempfile
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from cryptography import x509
+from cryptography.x509.oid import NameOID
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from google.auth import crypt, jwt
+from utils.google_auth import GoogleCertCache, cert_file_fetcher, parse_max_age
+
+CLIENT_ID = "test-client.apps.googleusercontent.com"
+
+
+def make_key(kid):
+    """生成RSA私钥及对应的自签名证书"""
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, kid)])
+    now = datetime.datetime.utcnow()
+    cert = (x509.CertificateBuilder().subject_name(name).issuer_name(name)
+            .public_key(key.public_key()).serial_number(1)
+            .not_valid_before(now - datetime.timedelta(days=1))
+            .not_valid_after(now + datetime.timedelta(days=1))
+            .sign(key, hashes.SHA256()))
+    private_pem = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                    serialization.NoEncryption())
+    signer = crypt.RSASigner.from_string(private_pem, key_id=kid)
+    return signer, cert.public_bytes(serialization.Encoding.PEM).decode()
+
+
+def make_token(signer, **claims):
+    now = int(time.time())
+    payload = {"iss": "https://accounts.google.com", "aud": CLIENT_ID, "sub": "google-user-1",
+               "email": "doctor@example.com", "name": "测试医生", "iat": now, "exp": now + 600}
+    payload.update(claims)
+    return jwt.encode(signer, payload).decode()
+
+
+def write_certs(path, certs):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(certs, f)
+
+
+def test_parse_max_age():
+    assert parse_max_age("public, max-age=19845, must-revalidate, no-transform", 60) == 19845
+    assert parse_max_age(None, 60) == 60
+
+
+def test_verify_with_cached_certs():
+    """证书只下载一次，重复验证同一个token直接命中缓存"""
+    print("🧪 测试证书缓存...")
+    signer, cert = make_key("kid-1")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "certs.json")
+        write_certs(path, {"kid-1": cert})
+        cache = GoogleCertCache(fetcher=cert_file_fetcher(path))
+
+        token = make_token(signer)
+        other = make_token(signer, sub="google-user-2")
+        claims = asyncio.run(cache.verify_async(token, CLIENT_ID))
+        assert claims["sub"] == "google-user-1"
+        assert cache.verify(token, CLIENT_ID) is claims
+        assert cache.verify(other, CLIENT_ID)["sub"] == "google-user-2"
+        assert cache.fetch_count == 1
+    print("✅ 证书只获取了一次")
+
+
+def test_rejects_invalid_tokens():
+    """错误的audience、issuer或过期token验证失败"""
+    print("🧪 测试无效token...")
+    signer, cert = make_key("kid-1")
+    cache = GoogleCertCache(fetcher=lambda: ({"kid-1": cert}, 3600))
+    for token, audience in [
+        (make_token(signer), "another-client"),
+        (make_token(signer, iss="https://evil.example.com"), CLIENT_ID),
+        (make_token(signer, iat=int(time.time()) - 7200, exp=int(time.time()) - 3600), CLIENT_ID),
+    ]:
+        try:
+            cache.verify(token, audience)
+        except ValueError:
+            continue
+        raise AssertionError("无效token通过了验证")
+    print("✅ 无效token被拒绝")
+
+
+def test_key_rotation_refetches():
+    """遇到未知的key id时重新获取证书"""
+    print("🧪 测试密钥轮换...")
+    old_signer, old_cert = make_key("kid-old")
+    new_signer, new_cert = make_key("kid-new")
+    published = [{"kid-old": old_cert}]
+    cache = GoogleCertCache(fetcher=lambda: (published[0], 3600), min_refetch_interval=0)
+
+    assert cache.verify(make_token(old_signer), CLIENT_ID)
+    published[0] = {"kid-old": old_cert, "kid-new": new_cert}
+    time.sleep(0.01)
+    assert cache.verify(make_token(new_signer), CLIENT_ID)
+    assert cache.fetch_count == 2
+    print("✅ 轮换后的密钥验证成功")
+
+
+if __name__ == "__main__":
+    test_parse_max_age()
+    test_verify_with_cached_certs()
+    test_rejects_invalid_tokens()
+    test_key_rotation_refetches()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+测试声明式索引管理
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import time
+from datetime import datetime
+import mongomock
+from bson import ObjectId
+from utils.mongo_dao import QueryStats
+from utils.mongo_indexes import IndexSpec, IndexManager
+
+
+class MockIndexDao:
+    """只实现IndexManager需要的方法，底层使用mongomock"""
+
+    def __init__(self):
+        self.db = mongomock.MongoClient()["medical_test"]
+        self.plans = {}
+
+    def index_information(self, collection_name):
+        return self.db[collection_name].index_information()
+
+    def create_indexes(self, collection_name, index_models):
+        return self.db[collection_name].create_indexes(index_models)
+
+    def drop_index(self, collection_name, index_name):
+        self.db[collection_name].drop_index(index_name)
+
+    def explain(self, collection_name, query, sort=None):
+        stage = self.plans.get(collection_name, "COLLSCAN")
+        return {"queryPlanner": {"winningPlan": {"stage": "FETCH", "inputStage": {"stage": stage}}}}
+
+
+SPECS = {
+    "consultations": [
+        IndexSpec([("user_id", 1), ("created_at", -1)]),
+        IndexSpec([("assigned_doctor_id", 1), ("status", 1)]),
+    ],
+    "users": [
+        IndexSpec("google_id", unique=True),
+    ],
+}
+
+
+def test_apply_is_idempotent():
+    """第一次创建全部索引，第二次不做任何修改"""
+    print("🧪 测试索引幂等应用...")
+    dao = MockIndexDao()
+    manager = IndexManager(dao)
+
+    first = manager.apply(SPECS)
+    assert sorted(item["name"] for item in first if item["action"] == "create") == [
+        "assigned_doctor_id_1_status_1", "google_id_1", "user_id_1_created_at_-1"
+    ]
+    assert dao.index_information("users")["google_id_1"]["unique"]
+
+    second = manager.plan(SPECS)
+    assert all(item["action"] == "ok" for item in second)
+    print("✅ 重复应用无变更")
+
+
+def test_option_change_and_extra_index():
+    """选项变化时重建，未声明的索引只报告，drop_extra时删除"""
+    print("🧪 测试索引选项变更与多余索引...")
+    dao = MockIndexDao()
+    dao.db["users"].create_index("google_id")
+    dao.db["users"].create_index("legacy_field")
+
+    actions = {item["name"]: item["action"] for item in IndexManager(dao).plan(SPECS) if item["collection"] == "users"}
+    assert actions == {"google_id_1": "replace", "legacy_field_1": "extra"}
+
+    IndexManager(dao).apply(SPECS, drop_extra=True)
+    live = dao.index_information("users")
+    assert live["google_id_1"].get("unique")
+    assert "legacy_field_1" not in live
+    print("✅ 选项变更已重建，多余索引已删除")
+
+
+def test_collscan_report():
+    """只报告走全表扫描的查询"""
+    print("🧪 测试COLLSCAN报告...")
+    dao = MockIndexDao()
+    dao.plans["consultations"] = "IXSCAN"
+    shapes = [
+        {"collection": "consultations", "query": {"user_id": "u1"}, "sort": [("created_at", -1)], "count": 3},
+        {"collection": "chat_messages", "query": {"sender_id": "u1"}, "sort": None, "count": 1},
+    ]
+    report = IndexManager(dao).collscan_report(shapes)
+    assert [item["collection"] for item in report] == ["chat_messages"]
+    print("✅ COLLSCAN查询已识别")
+
+
+def test_samples_are_redacted():
+    """查询样本只保留字段名和操作符，取值替换为占位符"""
+    print("🧪 测试查询样本脱敏...")
+    stats = QueryStats()
+    query = {"user_id": "alice@example.com", "_id": ObjectId(), "status": {"$in": ["paid", "in_progress"]},
+             "amount": {"$gte": 12.5}, "created_at": {"$lt": datetime.utcnow()}, "deleted": {"$exists": False}}
+    stats.record("find", "consultations", time.perf_counter(), query, [("created_at", -1)])
+    [shape] = stats.query_shapes()
+    assert shape["query"] == {"user_id": "?", "_id": ObjectId("0" * 24), "status": {"$in": ["?"]},
+                              "amount": {"$gte": 0}, "created_at": {"$lt": datetime(1970, 1, 1)},
+                              "deleted": {"$exists": False}}
+    assert shape["sort"] == [("created_at", -1)]
+    print("✅ 样本不含原始取值")
+
+
+if __name__ == "__main__":
+    test_apply_is_idempotent()
+    test_option_change_and_extra_index()
+    test_collscan_report()
+    test_samples_are_redacted()
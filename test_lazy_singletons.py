@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+测试延迟单例：导入时不连接数据库，fork之后每个进程重新创建实例
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from utils.lazy_instance import LazyInstance
+
+
+class Counter:
+    created = 0
+
+    def __init__(self):
+        Counter.created += 1
+        self.pid = os.getpid()
+
+
+def test_import_does_not_connect():
+    """导入服务模块不应创建数据库客户端"""
+    print("🧪 测试导入不连接数据库...")
+    from utils.mongo_dao import mongo_dao
+    from utils.async_mongo_dao import async_mongo_dao
+    import services.consultation_service  # noqa: F401
+    import services.doctor_service  # noqa: F401
+    import services.user_service  # noqa: F401
+
+    assert not mongo_dao.is_built()
+    assert not async_mongo_dao.is_built()
+    print("✅ 导入服务模块时未建立连接")
+
+
+def test_built_once_on_first_use():
+    """首次访问属性时才构建，且只构建一次"""
+    print("🧪 测试首次访问时构建...")
+    Counter.created = 0
+    lazy = LazyInstance(Counter)
+    assert Counter.created == 0
+    assert lazy.pid == os.getpid()
+    assert lazy.pid == os.getpid()
+    assert Counter.created == 1
+    print("✅ 只构建了一次")
+
+
+def test_rebuilt_after_fork():
+    """fork之后子进程使用自己的实例"""
+    print("🧪 测试fork之后重新构建...")
+    lazy = LazyInstance(Counter)
+    parent_pid = lazy.pid
+
+    read_fd, write_fd = os.pipe()
+    child = os.fork()
+    if child == 0:
+        os.close(read_fd)
+        os.write(write_fd, str(lazy.pid).encode())
+        os._exit(0)
+
+    os.close(write_fd)
+    child_instance_pid = int(os.read(read_fd, 32).decode())
+    os.waitpid(child, 0)
+
+    assert child_instance_pid == child
+    assert lazy.pid == parent_pid
+    print("✅ 子进程创建了自己的实例")
+
+
+if __name__ == "__main__":
+    test_import_does_not_connect()
+    test_built_once_on_first_use()
+    test_rebuilt_after_fork()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+测试游标（keyset）分页
+"""
+
+import sys
+import os
+from datetime import datetime, timedelta
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import mongomock
+from bson import ObjectId
+from utils.pagination import Keyset, InvalidCursor, encode_cursor, decode_cursor, NEXT_CURSOR_HEADER, PREV_CURSOR_HEADER
+
+
+def make_collection():
+    collection = mongomock.MongoClient()["medical_test"]["chat_messages"]
+    start = datetime(2024, 1, 1)
+    # 每3条消息共用一个时间，验证次序键处理并列
+    collection.insert_many([
+        {"consultation_id": "c1", "seq": i, "created_at": start + timedelta(seconds=i // 3)}
+        for i in range(25)
+    ])
+    collection.insert_one({"consultation_id": "c2", "seq": 99, "created_at": start})
+    return collection
+
+
+def fetch(collection, keyset, limit, after=None, before=None):
+    query, sort, reverse = keyset.page({"consultation_id": "c1"}, after, before)
+    items = list(collection.find(query, sort=sort, limit=limit))
+    return items[::-1] if reverse else items
+
+
+def walk(keyset):
+    collection = make_collection()
+    pages, after = [], None
+    while True:
+        items = fetch(collection, keyset, 10, after=after)
+        if not items:
+            break
+        pages.append(items)
+        after = keyset.headers(items, 10, after).get(NEXT_CURSOR_HEADER)
+        if after is None:
+            break
+    return collection, pages
+
+
+def test_cursor_round_trip():
+    """游标编码可以还原时间与ObjectId"""
+    print("🧪 测试游标编码...")
+    created_at, object_id = datetime(2024, 5, 1, 12, 30, 0, 123000), ObjectId()
+    assert decode_cursor(encode_cursor(created_at, object_id)) == (created_at, object_id)
+    assert decode_cursor(encode_cursor(created_at, "c1")) == (created_at, "c1")
+    try:
+        decode_cursor("not-a-cursor")
+        assert False, "应当拒绝无效游标"
+    except InvalidCursor:
+        pass
+    print("✅ 游标编码正常")
+
+
+def test_forward_pages_ascending():
+    """按时间顺序翻页：不重不漏，只取同一咨询"""
+    print("🧪 测试正序翻页...")
+    _, pages = walk(Keyset("created_at", "_id"))
+    assert [len(page) for page in pages] == [10, 10, 5]
+    assert [item["seq"] for page in pages for item in page] == list(range(25))
+    print("✅ 正序翻页正常")
+
+
+def test_forward_pages_descending():
+    """最新在前翻页"""
+    print("🧪 测试倒序翻页...")
+    _, pages = walk(Keyset("created_at", "_id", descending=True))
+    seqs = [item["seq"] for page in pages for item in page]
+    assert sorted(seqs) == list(range(25)) and len(set(seqs)) == 25
+    created = [item["created_at"] for page in pages for item in page]
+    assert created == sorted(created, reverse=True)
+    print("✅ 倒序翻页正常")
+
+
+def test_before_returns_previous_page():
+    """before 游标返回上一页，顺序与列表一致"""
+    print("🧪 测试向前翻页...")
+    keyset = Keyset("created_at", "_id")
+    collection, pages = walk(keyset)
+    third_page = pages[2]
+    headers = keyset.headers(third_page, 10, after=keyset.cursor(pages[1][-1]))
+    previous = fetch(collection, keyset, 10, before=headers[PREV_CURSOR_HEADER])
+    assert [item["seq"] for item in previous] == [item["seq"] for item in pages[1]]
+    print("✅ 向前翻页正常")
+
+
+if __name__ == "__main__":
+    test_cursor_round_trip()
+    test_forward_pages_ascending()
+    test_forward_pages_descending()
+    test_before_returns_previous_page()
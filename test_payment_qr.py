@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+测试支付二维码：按支付URL缓存渲染结果，支持PNG/SVG
+"""
+
+import sys
+import os
+import io
+import asyncio
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from PIL import Image
+from services.payment_service import PaymentService, AsyncPaymentService, render_qr_code
+
+ADDRESS = "TQn9Y2khEsLJW1ChVWFMSMeRDow5KcbLSE"
+
+
+def test_qr_code_cached():
+    """相同地址和金额只渲染一次"""
+    print("🧪 测试二维码缓存...")
+    render_qr_code.cache_clear()
+    service = PaymentService()
+    first = service.qr_code_image(ADDRESS, 10.0)
+    second = service.qr_code_image(ADDRESS, 10.0)
+    other = service.qr_code_image(ADDRESS, 50.0)
+    assert first is second and first != other
+    info = render_qr_code.cache_info()
+    assert (info.hits, info.misses) == (1, 2)
+    with Image.open(io.BytesIO(first)) as image:
+        assert image.format == "PNG"
+    assert service.generate_qr_code(ADDRESS, 10.0).startswith("data:image/png;base64,")
+    assert render_qr_code.cache_info().hits == 2
+    print("✅ 二维码缓存正常")
+
+
+def test_qr_code_formats():
+    """SVG输出，未知格式拒绝；异步版本结果一致"""
+    print("🧪 测试二维码格式...")
+    service = AsyncPaymentService()
+    svg = asyncio.run(service.qr_code_image(ADDRESS, 10.0, "svg"))
+    assert b"<svg" in svg
+    assert asyncio.run(service.qr_code_image(ADDRESS, 10.0)) == PaymentService().qr_code_image(ADDRESS, 10.0)
+    try:
+        render_qr_code(service.payment_url(ADDRESS, 10.0), "gif")
+        assert False, "应当拒绝未知格式"
+    except ValueError:
+        pass
+    print("✅ 二维码格式正常")
+
+
+if __name__ == "__main__":
+    test_qr_code_cached()
+    test_qr_code_formats()
@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+测试支付监听：一次链上查询匹配所有待支付订单，轮询只读订单状态
+"""
+
+import sys
+import os
+import asyncio
+from datetime import datetime, timedelta
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from bson import ObjectId
+from models.consultation import PaymentStatus
+from services.payment_watcher import PaymentWatcher, match_transfers, _timestamp_ms
+from utils.leader_lease import LeaderLease
+from utils.tron_client import FakeChainClient, transfer, usdt_to_sun
+
+ADDRESS = "TQn9Y2khEsLJW1ChVWFMSMeRDow5KcbLSE"
+
+
+def make_consultation_service():
+    from mongomock_motor import AsyncMongoMockClient
+    from utils.async_mongo_dao import AsyncMongoDao
+    from services.consultation_service import AsyncConsultationService
+
+    service = AsyncConsultationService()
+    service.dao = AsyncMongoDao(db=AsyncMongoMockClient()["medical_test"])
+    return service
+
+
+async def create_order(service, amount, created_at=None, tagged=True):
+    """tagged=True 通过 create_payment_order 占用唯一金额；False 模拟收款键上线前的旧订单"""
+    consultation_id = ObjectId()
+    now = created_at or datetime.utcnow()
+    await service.dao.insert("consultations", {"_id": consultation_id, "user_id": "u1", "mode": "onetime",
+                                               "disease_description": "d", "status": "pending",
+                                               "price_usdt": amount, "created_at": now, "updated_at": now})
+    if tagged:
+        order = await service.create_payment_order(str(consultation_id), "u1", ADDRESS)
+        return order.id, str(consultation_id), order.amount_usdt
+    order_id = ObjectId()
+    await service.dao.insert("payment_orders", {
+        "_id": order_id, "consultation_id": str(consultation_id), "user_id": "u1", "amount_usdt": amount,
+        "usdt_address": ADDRESS, "qr_code_url": "", "status": PaymentStatus.PENDING,
+        "created_at": now, "updated_at": now, "expires_at": now + timedelta(hours=24),
+    })
+    return order_id, str(consultation_id), amount
+
+
+def test_match_transfers():
+    """金额精确匹配，相同金额先到先得，订单创建之前的转账不匹配"""
+    print("🧪 测试转账匹配...")
+    now = datetime.utcnow()
+    orders = [
+        {"_id": "late", "amount_usdt": 10.0, "created_at": now},
+        {"_id": "early", "amount_usdt": 10.0, "created_at": now - timedelta(minutes=5)},
+        {"_id": "other", "amount_usdt": 0.29, "created_at": now},
+    ]
+    transfers = [
+        transfer("t0", "a", ADDRESS, usdt_to_sun(10), _timestamp_ms(now - timedelta(minutes=10))),
+        transfer("t1", "a", ADDRESS, usdt_to_sun(10), _timestamp_ms(now)),
+        transfer("t2", "a", ADDRESS, usdt_to_sun(0.29), _timestamp_ms(now)),
+        transfer("t3", "a", ADDRESS, usdt_to_sun(10), _timestamp_ms(now)),
+        transfer("t4", "a", ADDRESS, usdt_to_sun(10), _timestamp_ms(now)),
+    ]
+    matches = [(order["_id"], item["tx_hash"]) for order, item in match_transfers(transfers, orders)]
+    assert matches == [("early", "t1"), ("other", "t2"), ("late", "t3")]
+    print("✅ 转账匹配正常")
+
+
+def test_unique_payment_amounts():
+    """相同价格的订单各自占用不同金额，收款键在订单过期后可以重新使用"""
+    print("🧪 测试唯一支付金额...")
+    import services.consultation_service as module
+    service = make_consultation_service()
+
+    async def run():
+        orders = [await create_order(service, 10.0) for _ in range(50)]
+        keys = await service.get_deposit_keys(ADDRESS, [usdt_to_sun(amount) for _, _, amount in orders])
+        return orders, keys
+
+    orders, keys = asyncio.run(run())
+    amounts = [usdt_to_sun(amount) for _, _, amount in orders]
+    assert len(set(amounts)) == 50
+    assert all(usdt_to_sun(10) < amount < usdt_to_sun(10.01) for amount in amounts)
+    assert {key["order_id"] for key in keys.values()} == {order_id for order_id, _, _ in orders}
+
+    # 只有一个可用尾数：被占用时拒绝新订单，过期后可以重新占用
+    original = module.PAYMENT_AMOUNT_TAGS
+    module.PAYMENT_AMOUNT_TAGS = 1
+    try:
+        async def run_single():
+            first = await create_order(service, 50.0)
+            try:
+                await create_order(service, 50.0)
+                assert False, "金额已被占用"
+            except ValueError:
+                pass
+            await service.dao.update_one("payment_deposit_keys", {"_id": f"{ADDRESS}:{usdt_to_sun(50) + 1}"},
+                                         {"$set": {"expires_at": datetime.utcnow() - timedelta(seconds=1)}})
+            return first, await create_order(service, 50.0)
+
+        first, second = asyncio.run(run_single())
+    finally:
+        module.PAYMENT_AMOUNT_TAGS = original
+    assert first[2] == second[2] == 50.000001
+    print("✅ 唯一支付金额正常")
+
+
+def test_watcher_batches_chain_lookups():
+    """一次扫描只查询一次链上，按金额直接确认到账订单；重复扫描不会重复确认；没有待支付订单时不查询"""
+    print("🧪 测试支付监听...")
+    service = make_consultation_service()
+    client = FakeChainClient()
+    watcher = PaymentWatcher(client=client, service=service, address=ADDRESS)
+
+    async def run():
+        assert await watcher.scan() == 0 and client.request_count == 0
+
+        now = datetime.utcnow()
+        orders = [await create_order(service, amount) for amount in (10.0, 10.0, 10.0)]
+        legacy = await create_order(service, 100.0, tagged=False)
+        client.add_transfer(ADDRESS, orders[2][2], _timestamp_ms(now) + 3000)
+        client.add_transfer(ADDRESS, orders[0][2], _timestamp_ms(now) + 6000)
+        client.add_transfer(ADDRESS, 10.0, _timestamp_ms(now) + 6000)
+        client.add_transfer(ADDRESS, 100.0, _timestamp_ms(now) + 9000)
+        client.add_transfer("TSomeoneElse", orders[1][2], _timestamp_ms(now) + 6000)
+
+        paid = await watcher.scan()
+        again = await watcher.scan()
+        statuses = [await service.check_payment_status(consultation_id) for _, consultation_id, _ in orders + [legacy]]
+        consultation = await service.dao.find_one("consultations", {"_id": ObjectId(orders[0][1])})
+        return paid, again, statuses, consultation
+
+    paid, again, statuses, consultation = asyncio.run(run())
+    assert paid == 3 and again == 0
+    assert statuses == [PaymentStatus.PAID, PaymentStatus.PENDING, PaymentStatus.PAID, PaymentStatus.PAID]
+    assert consultation["status"] == "paid"
+    assert client.request_count == 2
+    metrics = watcher.metrics()
+    assert metrics["paid"] == 3 and metrics["unmatched"] == 1 and metrics["idle"] == 1
+    print("✅ 支付监听正常")
+
+
+def test_expire_payment_orders():
+    """到期的待支付订单分批过期，咨询改为已取消，收款键释放；已支付订单不受影响；读取状态不修改订单"""
+    print("🧪 测试订单过期...")
+    service = make_consultation_service()
+
+    async def run():
+        orders = [await create_order(service, 10.0) for _ in range(5)]
+        past = datetime.utcnow() - timedelta(seconds=1)
+        await service.dao.update_many("payment_orders", {"_id": {"$in": [order[0] for order in orders[:4]]}},
+                                      {"$set": {"expires_at": past}})
+        await service.confirm_payment(orders[3][0], "tx-paid")
+
+        # 定时任务处理之前，状态接口报告过期但不修改订单
+        before = await service.check_payment_status(orders[0][1])
+        stored = await service.dao.find_one("payment_orders", {"_id": orders[0][0]})
+
+        expired = await service.expire_payment_orders(batch_size=2)
+        rerun = await service.expire_payment_orders(batch_size=2)
+        order_statuses = [(await service.dao.find_one("payment_orders", {"_id": order_id}))["status"]
+                          for order_id, _, _ in orders]
+        consultation_statuses = [
+            (await service.dao.find_one("consultations", {"_id": ObjectId(consultation_id)}))["status"]
+            for _, consultation_id, _ in orders
+        ]
+        keys = await service.get_deposit_keys(ADDRESS, [usdt_to_sun(amount) for _, _, amount in orders])
+        return before, stored, expired, rerun, order_statuses, consultation_statuses, keys
+
+    before, stored, expired, rerun, order_statuses, consultation_statuses, keys = asyncio.run(run())
+    assert before == PaymentStatus.EXPIRED and stored["status"] == "pending"
+    assert expired == 3 and rerun == 0
+    assert order_statuses == ["expired", "expired", "expired", "paid", "pending"]
+    assert consultation_statuses == ["cancelled", "cancelled", "cancelled", "paid", "pending"]
+    assert len(keys) == 2
+    print("✅ 订单过期正常")
+
+
+def test_expire_skips_order_paid_meanwhile():
+    """查询到期订单之后、标记过期之前被确认支付的订单：咨询不被取消，不通知过期，收款键保留"""
+    print("🧪 测试过期与到账并发...")
+    service = make_consultation_service()
+    published = []
+
+    async def publish(consultation_id, **fields):
+        published.append((consultation_id, fields.get("payment_status")))
+    service._publish_status = publish
+
+    async def run():
+        orders = [await create_order(service, 10.0) for _ in range(2)]
+        past = datetime.utcnow() - timedelta(seconds=1)
+        await service.dao.update_many("payment_orders", {}, {"$set": {"expires_at": past}})
+
+        published.clear()
+
+        # 查询到期订单之后、批量标记过期之前，支付监听确认了第一个订单
+        update_many = service.dao.update_many
+        async def confirm_then_update(collection_name, query, update):
+            if collection_name == "payment_orders":
+                service.dao.update_many = update_many
+                await service.confirm_payment(orders[0][0], "tx-race")
+            return await update_many(collection_name, query, update)
+        service.dao.update_many = confirm_then_update
+
+        expired = await service.expire_payment_orders()
+        statuses = [(await service.dao.find_one("payment_orders", {"_id": order_id}))["status"]
+                    for order_id, _, _ in orders]
+        consultations = [
+            (await service.dao.find_one("consultations", {"_id": ObjectId(consultation_id)}))["status"]
+            for _, consultation_id, _ in orders
+        ]
+        keys = await service.get_deposit_keys(ADDRESS, [usdt_to_sun(amount) for _, _, amount in orders])
+        return orders, expired, statuses, consultations, keys
+
+    orders, expired, statuses, consultations, keys = asyncio.run(run())
+    assert expired == 1
+    assert statuses == ["paid", "expired"]
+    assert consultations == ["paid", "cancelled"]
+    assert [consultation_id for consultation_id, status in published if status == "expired"] == [orders[1][1]]
+    assert [key["order_id"] for key in keys.values()] == [orders[0][0]]
+    print("✅ 并发到账的订单不会被过期处理")
+
+
+def test_only_lease_holder_runs_jobs():
+    """多个进程中只有一个持有后台任务租约，持有者释放后由其他进程接管"""
+    print("🧪 测试后台任务租约...")
+    dao = make_consultation_service().dao
+
+    async def run():
+        first, second = LeaderLease(dao=dao, ttl=0.06), LeaderLease(dao=dao, ttl=0.06)
+        held = [await first.held(), await second.held()]
+        # 续约前直接使用上次检查的结果，不访问数据库
+        renewed = await first.held()
+        await first.release()
+        await asyncio.sleep(0.03)
+        taken_over = [await second.held(), await first.held()]
+        disabled = await LeaderLease(dao=dao, enabled=False).held()
+        return held, renewed, taken_over, disabled
+
+    held, renewed, taken_over, disabled = asyncio.run(run())
+    assert held == [True, False] and renewed
+    assert taken_over == [True, False]
+    assert not disabled
+    print("✅ 同一时间只有一个进程执行单例任务")
+
+
+if __name__ == "__main__":
+    test_match_transfers()
+    test_unique_payment_amounts()
+    test_watcher_batches_chain_lookups()
+    test_expire_payment_orders()
+    test_expire_skips_order_paid_meanwhile()
+    test_only_lease_holder_runs_jobs()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+测试附件预览：缩略图生成、后台worker、结果保存在附件旁边
+"""
+
+import sys
+import os
+import io
+import asyncio
+import tempfile
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from PIL import Image
+from starlette.datastructures import UploadFile
+from utils.previews import render_preview, UnsupportedPreview, PREVIEW_SUFFIX
+from test_blob_store import make_attachment_service
+
+
+def image_bytes(size, mode="RGB", format="PNG"):
+    buffer = io.BytesIO()
+    Image.new(mode, size, (200, 30, 30, 128) if mode == "RGBA" else (200, 30, 30)).save(buffer, format)
+    return buffer.getvalue()
+
+
+def test_render_preview():
+    """长边缩放到上限以内，透明图铺白底，不支持的类型抛出异常"""
+    print("🧪 测试预览图生成...")
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, "scan.png")
+        with open(source, "wb") as target:
+            target.write(image_bytes((2000, 1000), "RGBA"))
+        target = os.path.join(directory, "scan.jpg")
+
+        info = render_preview(source, target, "image/png", max_size=200)
+        assert (info["width"], info["height"]) == (200, 100)
+        assert info["size"] == os.path.getsize(target) < os.path.getsize(source)
+        with Image.open(target) as preview:
+            assert preview.format == "JPEG" and preview.mode == "RGB"
+
+        try:
+            render_preview(source, target, "application/msword")
+            assert False, "应当不支持"
+        except UnsupportedPreview:
+            pass
+    print("✅ 预览图生成正常")
+
+
+def test_preview_worker():
+    """上传后在后台生成预览并记录状态；重启后补做pending的附件"""
+    print("🧪 测试预览生成worker...")
+    from services.preview_worker import PreviewWorker, preview_worker
+
+    with tempfile.TemporaryDirectory() as root:
+        service = make_attachment_service(root)
+        worker = PreviewWorker(service=service, workers=2)
+        preview_worker.reset(worker)
+
+        async def run():
+            await worker.start()
+            ids = await service.save_attachments([
+                UploadFile(io.BytesIO(image_bytes((800, 600), format="JPEG")), filename="xray.jpg"),
+                UploadFile(io.BytesIO(b"not an image"), filename="broken.png"),
+                UploadFile(io.BytesIO(b"%PDF"), filename="notes.txt"),
+            ])
+            await worker.join()
+            details = await service.describe(ids)
+            blobs = [await service.get(blob_id) for blob_id in ids]
+
+            # 模拟重启：pending状态的附件由sweep重新入队
+            await service.set_preview(ids[0], "pending")
+            queued = await worker.sweep()
+            await worker.join()
+            await worker.stop()
+            return ids, details, blobs, queued
+
+        try:
+            ids, details, blobs, queued = asyncio.run(run())
+        finally:
+            preview_worker.reset()
+
+        assert blobs[0]["preview"]["status"] == "ready" and blobs[0]["preview"]["width"] == 480
+        assert blobs[1]["preview"]["status"] == "failed"
+        assert "preview" not in blobs[2]
+        assert details[0]["preview_url"] == f"/api/attachments/{ids[0]}/preview"
+        assert details[1]["preview_url"] is None and details[2]["preview_url"] is None
+        assert os.path.exists(service.store.local_path(ids[0], PREVIEW_SUFFIX))
+        assert queued == 1
+        assert worker.metrics()["ready"] == 2 and worker.metrics()["failed"] == 1
+    print("✅ 预览生成worker正常")
+
+
+if __name__ == "__main__":
+    test_render_preview()
+    test_preview_worker()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+测试会话存储后端
+"""
+
+import sys
+import os
+import asyncio
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from utils.session_store import MemorySessionStore, MongoSessionStore, RedisSessionStore
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_memory_ttl_and_lru():
+    """内存存储：过期后读取不到，超过容量时淘汰最久未使用的会话"""
+    print("🧪 测试内存会话存储...")
+    clock = FakeClock()
+    store = MemorySessionStore(ttl=60, max_entries=2, clock=clock)
+
+    async def run():
+        await store.set("a", {"user": {"id": "1"}})
+        await store.set("b", {"user": {"id": "2"}})
+        assert await store.get("a") == {"user": {"id": "1"}}
+        # a刚被访问过，插入c时淘汰b
+        await store.set("c", {"user": {"id": "3"}})
+        assert await store.get("b") is None
+        assert len(store) == 2
+
+        clock.now += 61
+        assert await store.get("a") is None
+        assert await store.get("c") is None
+        assert len(store) == 0
+
+    asyncio.run(run())
+    print("✅ 过期与容量限制生效")
+
+
+def test_mongo_store():
+    """Mongo存储：读写删除，过期文档即使未被TTL清理也读取不到"""
+    print("🧪 测试Mongo会话存储...")
+    from mongomock_motor import AsyncMongoMockClient
+    from utils.async_mongo_dao import AsyncMongoDao
+
+    dao = AsyncMongoDao(db=AsyncMongoMockClient()["medical_test"])
+    store = MongoSessionStore(dao=dao, ttl=60)
+
+    async def run():
+        await store.set("s1", {"doctor": {"id": "d1"}, "db_doctor_id": "d1"})
+        assert (await store.get("s1"))["db_doctor_id"] == "d1"
+
+        await store.set("s2", {"user": {"id": "u1"}}, ttl=-1)
+        assert await store.get("s2") is None
+
+        await store.delete("s1")
+        assert await store.get("s1") is None
+
+    asyncio.run(run())
+    print("✅ Mongo会话存储正常")
+
+
+def test_redis_store():
+    """Redis存储：使用fakeredis作为本地替身"""
+    print("🧪 测试Redis会话存储...")
+    try:
+        import fakeredis.aioredis
+    except ImportError:
+        print("⚠️ 未安装fakeredis，跳过")
+        return
+
+    store = RedisSessionStore(client=fakeredis.aioredis.FakeRedis(), ttl=60)
+
+    async def run():
+        await store.set("s1", {"user": {"id": "u1"}})
+        assert await store.get("s1") == {"user": {"id": "u1"}}
+        assert 0 < await store.client.ttl("session:s1") <= 60
+        await store.delete("s1")
+        assert await store.get("s1") is None
+
+    asyncio.run(run())
+    print("✅ Redis会话存储正常")
+
+
+if __name__ == "__main__":
+    test_memory_ttl_and_lru()
+    test_mongo_store()
+    test_redis_store()
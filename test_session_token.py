@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+测试签名会话令牌
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from utils.session_token import sign_session_token, verify_session_token
+
+SECRET = "test-secret"
+SESSION = {"user": {"id": "u1", "name": "张三", "email": "a@example.com", "picture": ""}, "db_user_id": "u1"}
+
+
+def test_round_trip():
+    """签名后可以还原会话数据"""
+    print("🧪 测试令牌签名与验证...")
+    token = sign_session_token(SESSION, SECRET, ttl=60)
+    assert verify_session_token(token, SECRET) == SESSION
+    print("✅ 会话数据还原正确")
+
+
+def test_rejects_tampered_and_wrong_key():
+    """篡改负载或使用其他密钥时验证失败"""
+    print("🧪 测试篡改检测...")
+    token = sign_session_token(SESSION, SECRET, ttl=60)
+    payload, signature = token.split(".")
+    forged = sign_session_token(dict(SESSION, db_user_id="admin"), "other", ttl=60).split(".")[0]
+
+    assert verify_session_token(f"{forged}.{signature}", SECRET) is None
+    assert verify_session_token(token, "other") is None
+    assert verify_session_token("not-a-token", SECRET) is None
+    assert verify_session_token(f"{payload}.!!!", SECRET) is None
+    print("✅ 篡改的令牌被拒绝")
+
+
+def test_expiry():
+    """过期令牌验证失败"""
+    print("🧪 测试令牌过期...")
+    token = sign_session_token(SESSION, SECRET, ttl=60, now=1000)
+    assert verify_session_token(token, SECRET, now=1059) == SESSION
+    assert verify_session_token(token, SECRET, now=1060) is None
+    print("✅ 过期令牌被拒绝")
+
+
+if __name__ == "__main__":
+    test_round_trip()
+    test_rejects_tampered_and_wrong_key()
+    test_expiry()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+测试附件上传：分块写入、大小限制、存入附件存储
+"""
+
+import sys
+import os
+import io
+import asyncio
+import tempfile
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import httpx
+from starlette.applications import Starlette
+from starlette.datastructures import UploadFile
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+from utils.uploads import save_uploads, UploadTooLarge, RequestSizeLimitMiddleware
+from utils.blob_store import LocalBlobStore
+
+
+def upload(name, size):
+    return UploadFile(io.BytesIO(b"x" * size), filename=name)
+
+
+def stored_files(root):
+    return sorted(name for _, _, names in os.walk(root) for name in names)
+
+
+def test_save_uploads_in_parallel():
+    """多个文件都保存完整，以SHA-256为ID，没有遗留暂存文件"""
+    print("🧪 测试并行保存附件...")
+    with tempfile.TemporaryDirectory() as directory:
+        store = LocalBlobStore(directory)
+        files = [upload("a.png", 3000), upload("b.pdf", 10), upload("", 5)]
+        blobs = asyncio.run(save_uploads(files, store, max_file_bytes=4096))
+        assert [blob["filename"] for blob in blobs] == ["a.png", "b.pdf"]
+        assert [blob["size"] for blob in blobs] == [3000, 10]
+        assert blobs[0]["content_type"] == "image/png"
+        assert all(blob["created"] for blob in blobs)
+        assert [os.path.getsize(store.local_path(blob["id"])) for blob in blobs] == [3000, 10]
+        assert stored_files(directory) == sorted(blob["id"] for blob in blobs)
+    print("✅ 附件保存正常")
+
+
+def test_limits_leave_nothing_behind():
+    """超过单文件/单次请求/文件数量上限时拒绝，且不留下任何文件"""
+    print("🧪 测试上传限制...")
+    cases = [
+        dict(files=[upload("a.png", 100), upload("big.png", 5000)], max_file_bytes=4096),
+        dict(files=[upload("a.png", 3000), upload("b.png", 3000)], max_request_bytes=5000),
+        dict(files=[upload(f"{i}.png", 1) for i in range(3)], max_files=2),
+    ]
+    for case in cases:
+        with tempfile.TemporaryDirectory() as directory:
+            files = case.pop("files")
+            try:
+                asyncio.run(save_uploads(files, LocalBlobStore(directory), **case))
+                assert False, "应当超出限制"
+            except UploadTooLarge:
+                pass
+            assert stored_files(directory) == []
+    print("✅ 上传限制正常")
+
+
+def test_request_size_middleware():
+    """请求体超过上限时返回413，无论是否带Content-Length"""
+    print("🧪 测试请求体大小限制...")
+
+    async def echo(request):
+        return JSONResponse({"size": len(await request.body())})
+
+    app = RequestSizeLimitMiddleware(Starlette(routes=[Route("/", echo, methods=["POST"])]), max_bytes=1000)
+
+    async def chunks(size):
+        for _ in range(size // 100):
+            yield b"x" * 100
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://t") as client:
+            small = await client.post("/", content=b"x" * 500)
+            declared = await client.post("/", content=b"x" * 2000)
+            streamed = await client.post("/", content=chunks(2000))
+            return small, declared, streamed
+
+    small, declared, streamed = asyncio.run(run())
+    assert small.status_code == 200 and small.json() == {"size": 500}
+    assert declared.status_code == 413
+    assert streamed.status_code == 413
+    print("✅ 请求体大小限制正常")
+
+
+if __name__ == "__main__":
+    test_save_uploads_in_parallel()
+    test_limits_leave_nothing_behind()
+    test_request_size_middleware()
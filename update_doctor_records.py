@@ -15,7 +15,7 @@ def update_doctor_records():
     
     try:
         # 获取所有医生记录
-        doctors = mongo_dao._MongoDao__db["doctors"].find({})
+        doctors = mongo_dao.find_cursor("doctors", {})
         updated_count = 0
         
         for doctor in doctors:
@@ -24,13 +24,14 @@ def update_doctor_records():
             # 检查是否已经有current_consultation_count字段
             if "current_consultation_count" not in doctor:
                 # 计算当前咨询数量
-                current_count = mongo_dao._MongoDao__db["consultations"].count_documents({
+                current_count = mongo_dao.count("consultations", {
                     "assigned_doctor_id": doctor_id,
                     "status": {"$in": ["in_progress", "paid"]}
                 })
                 
                 # 更新医生记录
-                mongo_dao._MongoDao__db["doctors"].update_one(
+                mongo_dao.update_one(
+                    "doctors",
                     {"_id": ObjectId(doctor_id)},
                     {"$set": {"current_consultation_count": current_count}}
                 )
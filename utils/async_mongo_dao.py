@@ -0,0 +1,274 @@
+import re
+import time
+from contextlib import asynccontextmanager
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING
+from pymongo import ReturnDocument
+from .mongo_config import mongo_config
+from .lazy_instance import LazyInstance
+from .mongo_dao import query_stats, apply_cursor_options, build_client_args, get_read_preference
+
+class AsyncMongoDao:
+    """
+    MongoDao的异步版本（基于Motor），供FastAPI的async路由使用，避免阻塞事件循环
+    """
+    def __init__(self, config=mongo_config, db=None, secondary_db=None):
+        """
+        :param db: use this database (e.g. a mongomock one in tests) instead of connecting with config;
+                   transactions are off and secondary reads go to db unless secondary_db is given
+        """
+        if db is not None:
+            self.__client = None
+            self.__db = db
+            self.__secondary_db = secondary_db if secondary_db is not None else db
+            self.max_time_ms = None
+            self.transactions = False
+            return
+        args, options = build_client_args(config)
+        self.__client = AsyncIOMotorClient(*args, **options)
+        self.__db = self.__client[config["database"]]
+        # 列表/统计类读取可路由到从节点
+        self.__secondary_db = self.__client.get_database(
+            config["database"], read_preference=get_read_preference(config["secondary_read_preference"])
+        )
+        self.max_time_ms = config.get("max_time_ms") or None
+        self.transactions = config.get("transactions", False)
+
+    async def insert(self, collection_name, parm):
+        """
+        insert data into mongo
+        :param collection_name:
+        :param parm:
+        :return: InsertOneResult object
+        """
+        try:
+            result = await self.__db[collection_name].insert_one(parm)
+            print(f"数据插入成功，集合: {collection_name}, 插入ID: {result.inserted_id}")
+            return result
+        except Exception as e:
+            print(f"数据插入失败，集合: {collection_name}, 错误: {e}")
+            return None
+
+    async def batch_search(self, collection_name, key, values):
+        query_in = {key: {"$in": values}}
+        rst = await self.__db[collection_name].find(query_in).to_list(length=None)
+        return rst
+
+    async def find_all(self, collection_name):
+        """
+        export all data in collection_name
+        :param collection_name:
+        :return:
+        """
+        rst = await self.__db[collection_name].find({}).to_list(length=None)
+        return rst
+
+    async def search(self, collection_name, key, value):
+        """
+        search record by keyword
+        :param collection_name:
+        :param key:
+        :param value:
+        :return:
+        """
+        rst = await self.__db[collection_name].find({key: value}).to_list(length=None)
+        return rst
+
+    async def search_multi_filter(self, collection_name, multi_filter_data):
+        """
+        search record by multi filter
+        :param collection_name:
+        :param multi_filter_data:
+        :return:
+        """
+        rst = await self.__db[collection_name].find(multi_filter_data).to_list(length=None)
+        return rst
+
+    async def update(self, collection_name, key, value, update_data):
+        """
+        update document by keyword
+        :param collection_name:
+        :param key:
+        :param value:
+        :param update_data:
+        :return: True if successful, False otherwise
+        """
+        result = await self.__db[collection_name].update_one({key: value}, {'$set': update_data})
+        return result.modified_count > 0
+
+    async def delete(self, collection_name, keyword, value):
+        '''
+        delete all records that match keyword
+        :param collection_name:
+        :param keyword:
+        :return:
+        '''
+        await self.__db[collection_name].delete_many({keyword: value})
+
+    async def create_index(self, collection_name, keyword):
+        """
+        create index
+        :param collection_name:
+        :param keyword:
+        :return: index name
+        """
+        try:
+            # 检查索引是否已存在
+            async for index in self.__db[collection_name].list_indexes():
+                if keyword in index.get('key', {}):
+                    return f"{keyword}_1"  # 索引已存在
+
+            # 创建新索引
+            index_name = await self.__db[collection_name].create_index([(keyword, ASCENDING)])
+            return index_name
+        except Exception as e:
+            print(f"创建索引失败: {e}")
+            return None
+
+    async def check_index(self, collection_name):
+        """
+        check if index exist
+        :return:
+        """
+        try:
+            await self.__db.get_collection(collection_name).index_information()
+            return True
+        except Exception:
+            return False
+
+    async def check_mongo(self, collection, key, value):
+        result = await self.find_one(collection, {key: value}, {"_id": 1})
+        return result is not None
+
+    def fuzzy_search(self, data, collection):
+        """ relative slow, returns an async cursor """
+        regex_dic = {}
+        for text in data:
+            regex_dic["search_key"] = re.compile(text)
+        return self.__db[collection].find(regex_dic)
+
+    # 查询API：与MongoDao保持一致，统一支持投影、排序、分页、超时和统计
+    def _database(self, secondary=False):
+        return self.__secondary_db if secondary else self.__db
+
+    def find_cursor(self, collection_name, query=None, projection=None, sort=None, skip=0, limit=0,
+                    batch_size=None, max_time_ms=None, hint=None, secondary=False):
+        """
+        build an async cursor without fetching any documents
+        :return: AsyncIOMotorCursor
+        """
+        cursor = self._database(secondary)[collection_name].find(query or {}, projection)
+        return apply_cursor_options(cursor, sort, skip, limit, batch_size,
+                                    max_time_ms or self.max_time_ms, hint)
+
+    async def iterate(self, collection_name, query=None, projection=None, sort=None, skip=0, limit=0,
+                      batch_size=None, max_time_ms=None, hint=None, secondary=False):
+        """
+        stream documents one by one instead of loading the whole result set
+        :return: async generator of documents
+        """
+        started = time.perf_counter()
+        async for document in self.find_cursor(collection_name, query, projection, sort, skip, limit,
+                                               batch_size, max_time_ms, hint, secondary):
+            yield document
+        query_stats.record("iterate", collection_name, started, query, sort)
+
+    async def find(self, collection_name, query=None, projection=None, sort=None, skip=0, limit=0,
+                   batch_size=None, max_time_ms=None, hint=None, secondary=False):
+        """
+        find documents, see find_cursor for parameters
+        :return: list of documents
+        """
+        started = time.perf_counter()
+        rst = await self.find_cursor(collection_name, query, projection, sort, skip, limit,
+                                     batch_size, max_time_ms, hint, secondary).to_list(length=None)
+        query_stats.record("find", collection_name, started, query, sort)
+        return rst
+
+    async def find_one(self, collection_name, query, projection=None, sort=None, max_time_ms=None):
+        started = time.perf_counter()
+        rst = await self.__db[collection_name].find_one(query, projection, sort=sort,
+                                                        max_time_ms=max_time_ms or self.max_time_ms)
+        query_stats.record("find_one", collection_name, started, query, sort)
+        return rst
+
+    async def count(self, collection_name, query=None, max_time_ms=None, secondary=False):
+        started = time.perf_counter()
+        options = {"maxTimeMS": max_time_ms or self.max_time_ms} if (max_time_ms or self.max_time_ms) else {}
+        rst = await self._database(secondary)[collection_name].count_documents(query or {}, **options)
+        query_stats.record("count", collection_name, started, query)
+        return rst
+
+    async def aggregate(self, collection_name, pipeline, max_time_ms=None, allow_disk_use=False, batch_size=None,
+                        secondary=False):
+        started = time.perf_counter()
+        options = {"allowDiskUse": allow_disk_use}
+        if max_time_ms or self.max_time_ms:
+            options["maxTimeMS"] = max_time_ms or self.max_time_ms
+        if batch_size:
+            options["batchSize"] = batch_size
+        rst = await self._database(secondary)[collection_name].aggregate(pipeline, **options).to_list(length=None)
+        query_stats.record("aggregate", collection_name, started, pipeline)
+        return rst
+
+    async def update_one(self, collection_name, query, update, upsert=False, session=None):
+        """
+        update_one with a full update document ($set/$inc/...)
+        :return: UpdateResult
+        """
+        started = time.perf_counter()
+        rst = await self.__db[collection_name].update_one(query, update, upsert=upsert, session=session)
+        query_stats.record("update_one", collection_name, started, query)
+        return rst
+
+    async def find_one_and_update(self, collection_name, query, update, projection=None, sort=None, upsert=False,
+                                  return_document="after", session=None):
+        """
+        atomic conditional update, see MongoDao.find_one_and_update
+        """
+        started = time.perf_counter()
+        rst = await self.__db[collection_name].find_one_and_update(
+            query, update, projection=projection, sort=sort, upsert=upsert, session=session,
+            return_document=ReturnDocument.AFTER if return_document == "after" else ReturnDocument.BEFORE
+        )
+        query_stats.record("find_one_and_update", collection_name, started, query)
+        return rst
+
+    @asynccontextmanager
+    async def transaction(self):
+        """
+        yield a session inside a transaction when transactions are enabled (replica set), otherwise None.
+        Operations sharing the session must not run concurrently.
+        """
+        if not self.transactions:
+            yield None
+            return
+        async with await self.__client.start_session() as session:
+            async with session.start_transaction():
+                yield session
+
+    async def update_many(self, collection_name, query, update):
+        started = time.perf_counter()
+        rst = await self.__db[collection_name].update_many(query, update)
+        query_stats.record("update_many", collection_name, started, query)
+        return rst
+
+    async def insert_many(self, collection_name, documents, ordered=True):
+        if not documents:
+            return None
+        started = time.perf_counter()
+        rst = await self.__db[collection_name].insert_many(documents, ordered=ordered)
+        query_stats.record("insert_many", collection_name, started)
+        return rst
+
+    async def bulk_write(self, collection_name, requests, ordered=False):
+        if not requests:
+            return None
+        started = time.perf_counter()
+        rst = await self.__db[collection_name].bulk_write(requests, ordered=ordered)
+        query_stats.record("bulk_write", collection_name, started)
+        return rst
+
+
+# 首次使用时才创建Motor客户端，且每个进程（fork之后）各自创建
+async_mongo_dao = LazyInstance(AsyncMongoDao)
@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+内容寻址的附件存储
+
+附件以内容的SHA-256作为ID（64位十六进制），相同内容只存一份。后端由 BLOB_BACKEND 选择：
+
+    BLOB_BACKEND=local   # 默认，本地目录 BLOB_DIR（默认 uploads/blobs），按ID前两级分目录
+    BLOB_BACKEND=s3      # S3兼容存储（AWS S3 / MinIO），需要安装boto3
+        BLOB_S3_BUCKET=medical-attachments
+        BLOB_S3_ENDPOINT_URL=http://localhost:9000   # MinIO等，AWS S3留空
+        BLOB_S3_PREFIX=blobs/
+        BLOB_S3_URL_EXPIRES=300   # 下载时重定向到预签名URL的有效期（秒）
+        # 凭证使用boto3的标准配置（AWS_ACCESS_KEY_ID / AWS_SECRET_ACCESS_KEY 等）
+
+上传先写入暂存文件并计算哈希，再交给存储后端：已存在的内容直接丢弃暂存文件。
+由附件生成的文件（如预览图）以 "<ID>.<后缀>" 保存在原附件旁边。
+"""
+
+import os
+import re
+import shutil
+import hashlib
+import tempfile
+from contextlib import asynccontextmanager
+from urllib.parse import quote
+from fastapi.concurrency import run_in_threadpool
+from utils.lazy_instance import LazyInstance
+
+BLOB_BACKEND = os.getenv('BLOB_BACKEND', 'local')
+BLOB_DIR = os.getenv('BLOB_DIR', os.path.join('uploads', 'blobs'))
+BLOB_S3_BUCKET = os.getenv('BLOB_S3_BUCKET', '')
+BLOB_S3_ENDPOINT_URL = os.getenv('BLOB_S3_ENDPOINT_URL', '')
+BLOB_S3_PREFIX = os.getenv('BLOB_S3_PREFIX', 'blobs/')
+# 下载用预签名URL的有效期（秒）
+BLOB_S3_URL_EXPIRES = int(os.getenv('BLOB_S3_URL_EXPIRES', 300))
+
+BLOB_ID_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+SUFFIX_PATTERN = re.compile(r"^(\.[a-z0-9]+)*$")
+
+
+def is_blob_id(value):
+    return isinstance(value, str) and bool(BLOB_ID_PATTERN.match(value))
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    """
+    :return: sha256 hex digest of a file, read in chunks
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as source:
+        for chunk in iter(lambda: source.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def content_disposition(filename, disposition="inline"):
+    """
+    Content-Disposition header value with an RFC 5987 encoded filename (Chinese names included)
+    """
+    ascii_name = re.sub(r'[^\x20-\x7e]|["\\]', "_", filename)
+    return f"{disposition}; filename=\"{ascii_name}\"; filename*=UTF-8''{quote(filename)}"
+
+
+def blob_name(blob_id, suffix=""):
+    """
+    :param suffix: derived file next to the blob, e.g. ".preview.jpg"; "" for the blob itself
+    :return: "<sha256><suffix>"
+    :raise ValueError: invalid blob ID or suffix
+    """
+    if not is_blob_id(blob_id) or not SUFFIX_PATTERN.match(suffix):
+        raise ValueError(f"无效的附件ID: {blob_id}{suffix}")
+    return f"{blob_id}{suffix}"
+
+
+class BlobStore:
+    """
+    blob_id (sha256 hex) -> bytes, plus derived files (previews ...) stored next to a blob under a suffix
+    :param staging_dir: where uploads are written before put(); on the same filesystem for local stores
+    """
+    def __init__(self, staging_dir):
+        self.staging_dir = staging_dir
+
+    def staging_path(self):
+        os.makedirs(self.staging_dir, exist_ok=True)
+        fd, path = tempfile.mkstemp(dir=self.staging_dir, suffix=".part")
+        os.close(fd)
+        return path
+
+    async def exists(self, blob_id, suffix=""):
+        raise NotImplementedError
+
+    async def put(self, staging_path, blob_id, suffix=""):
+        """
+        move a staged file into the store under blob_id; the staged file is consumed either way
+        :return: True if stored, False if the content was already present
+        """
+        raise NotImplementedError
+
+    async def fetch(self, blob_id, path, suffix=""):
+        """
+        copy a stored file to a local path
+        """
+        raise NotImplementedError
+
+    async def delete(self, blob_id, suffix=""):
+        raise NotImplementedError
+
+    def local_path(self, blob_id, suffix=""):
+        """
+        :return: filesystem path of the blob for zero-copy serving, or None for remote stores
+        """
+        return None
+
+    async def download_url(self, blob_id, filename=None, content_type=None, suffix=""):
+        """
+        :return: short-lived URL the client can fetch the blob from directly, or None for local stores
+        """
+        return None
+
+    @asynccontextmanager
+    async def open_local(self, blob_id, suffix=""):
+        """
+        async with store.open_local(blob_id) as path: ... - a local copy for processing, removed afterwards
+        """
+        path = self.staging_path()
+        try:
+            await self.fetch(blob_id, path, suffix)
+            yield path
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class LocalBlobStore(BlobStore):
+    """
+    BLOB_DIR/ab/cd/abcd...
+    """
+    def __init__(self, root=BLOB_DIR):
+        super().__init__(os.path.join(root, ".staging"))
+        self.root = root
+
+    def local_path(self, blob_id, suffix=""):
+        return os.path.join(self.root, blob_id[:2], blob_id[2:4], blob_name(blob_id, suffix))
+
+    async def exists(self, blob_id, suffix=""):
+        return os.path.exists(self.local_path(blob_id, suffix))
+
+    async def put(self, staging_path, blob_id, suffix=""):
+        return await run_in_threadpool(self._put, staging_path, blob_id, suffix)
+
+    def _put(self, staging_path, blob_id, suffix=""):
+        path = self.local_path(blob_id, suffix)
+        if os.path.exists(path):
+            os.remove(staging_path)
+            return False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 同一文件系统内原子改名；并发写入相同内容时后者覆盖前者，结果一致
+        os.replace(staging_path, path)
+        return True
+
+    async def fetch(self, blob_id, path, suffix=""):
+        await run_in_threadpool(shutil.copyfile, self.local_path(blob_id, suffix), path)
+
+    @asynccontextmanager
+    async def open_local(self, blob_id, suffix=""):
+        # 本地存储直接使用原文件，不复制
+        path = self.local_path(blob_id, suffix)
+        if not os.path.exists(path):
+            raise FileNotFoundError(path)
+        yield path
+
+    async def delete(self, blob_id, suffix=""):
+        path = self.local_path(blob_id, suffix)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+class S3BlobStore(BlobStore):
+    """
+    S3 compatible object storage, one object per blob under prefix
+    :param client: a boto3 S3 client (or compatible stand-in); built from the BLOB_S3_* settings when omitted
+    """
+    def __init__(self, client=None, bucket=BLOB_S3_BUCKET, prefix=BLOB_S3_PREFIX,
+                 endpoint_url=BLOB_S3_ENDPOINT_URL, staging_dir=None, url_expires=BLOB_S3_URL_EXPIRES):
+        super().__init__(staging_dir or os.path.join(tempfile.gettempdir(), "blob-staging"))
+        if client is None:
+            import boto3
+            client = boto3.client("s3", endpoint_url=endpoint_url or None)
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.url_expires = url_expires
+
+    def key(self, blob_id, suffix=""):
+        return f"{self.prefix}{blob_name(blob_id, suffix)}"
+
+    def _exists(self, blob_id, suffix=""):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.key(blob_id, suffix))
+            return True
+        except Exception as e:
+            # botocore.exceptions.ClientError，404表示不存在
+            if getattr(e, "response", {}).get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+
+    async def exists(self, blob_id, suffix=""):
+        return await run_in_threadpool(self._exists, blob_id, suffix)
+
+    async def put(self, staging_path, blob_id, suffix=""):
+        return await run_in_threadpool(self._put, staging_path, blob_id, suffix)
+
+    def _put(self, staging_path, blob_id, suffix=""):
+        try:
+            if self._exists(blob_id, suffix):
+                return False
+            self.client.upload_file(staging_path, self.bucket, self.key(blob_id, suffix))
+            return True
+        finally:
+            os.remove(staging_path)
+
+    async def fetch(self, blob_id, path, suffix=""):
+        await run_in_threadpool(self.client.download_file, self.bucket, self.key(blob_id, suffix), path)
+
+    async def delete(self, blob_id, suffix=""):
+        await run_in_threadpool(self.client.delete_object, Bucket=self.bucket, Key=self.key(blob_id, suffix))
+
+    async def download_url(self, blob_id, filename=None, content_type=None, suffix=""):
+        # 预签名URL由对象存储直接处理Range/ETag，应用不转发文件内容
+        params = {"Bucket": self.bucket, "Key": self.key(blob_id, suffix)}
+        if filename:
+            params["ResponseContentDisposition"] = content_disposition(filename)
+        if content_type:
+            params["ResponseContentType"] = content_type
+        return await run_in_threadpool(self.client.generate_presigned_url, "get_object",
+                                       Params=params, ExpiresIn=self.url_expires)
+
+
+def create_blob_store(backend=None):
+    backend = (backend or BLOB_BACKEND).lower()
+    if backend == "local":
+        return LocalBlobStore()
+    if backend == "s3":
+        return S3BlobStore()
+    raise ValueError(f"未知的附件存储后端: {backend}")
+
+
+blob_store = LazyInstance(create_blob_store)
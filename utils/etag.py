@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+基于版本号的条件请求（ETag / If-None-Match）
+
+ETag = 版本号 + 可选的过期时间 + 签名。签名覆盖请求范围（资源、登录身份、查询参数），
+因此服务端只需取得当前版本号即可返回304，而无需加载资源或再次校验权限：
+匹配的ETag只可能是此前对同一身份、同一请求签发的。
+"""
+
+import hmac
+import time
+import calendar
+import hashlib
+
+
+class ETagSigner:
+    """
+    :param secret: signing key, e.g. SECRET_KEY
+    """
+    def __init__(self, secret):
+        self.secret = secret.encode("utf-8")
+
+    def _sign(self, version, expires, scope):
+        payload = f"{version}|{expires}|{scope}".encode("utf-8")
+        return hmac.new(self.secret, payload, hashlib.sha256).hexdigest()[:16]
+
+    def make(self, version, scope, valid_until=None):
+        """
+        :param version: current version of the resource, e.g. "1760000000000.12.<message id>"
+        :param scope: string identifying the request (resource, principal, query)
+        :param valid_until: naive UTC datetime after which the tag must not produce a 304,
+                            for resources that also change with time (e.g. a payment expiring)
+        :return: weak ETag header value
+        """
+        expires = calendar.timegm(valid_until.utctimetuple()) if valid_until else 0
+        return f'W/"{version}:{expires}:{self._sign(version, expires, scope)}"'
+
+    def matches(self, if_none_match, version, scope, now=None):
+        """
+        :param if_none_match: If-None-Match request header (may list several tags)
+        :return: the matching tag, or None
+        """
+        if not if_none_match:
+            return None
+        now = time.time() if now is None else now
+        for candidate in if_none_match.split(","):
+            tag = candidate.strip()
+            try:
+                tag_version, expires, signature = tag.removeprefix("W/").strip('"').rsplit(":", 2)
+                expires = int(expires)
+            except ValueError:
+                continue
+            if tag_version != version or (expires and now >= expires):
+                continue
+            if hmac.compare_digest(signature, self._sign(version, expires, scope)):
+                return tag
+        return None
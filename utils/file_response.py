@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+支持Range请求的文件响应
+
+单个字节范围返回206，无法满足的范围返回416，多个范围按RFC 9110忽略Range返回整个文件。
+服务器提供ASGI零拷贝扩展（http.response.zerocopysend / http.response.pathsend）时
+直接交给服务器sendfile，否则在线程池中分块读取，不会整个读入内存。
+"""
+
+import os
+import re
+import stat
+import anyio
+from email.utils import formatdate
+from starlette.responses import Response
+
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(header, size):
+    """
+    :param header: Range request header, e.g. "bytes=0-1023", "bytes=1024-", "bytes=-500"
+    :param size: file size
+    :return: (start, end) inclusive, or None to serve the whole file
+    :raise RangeNotSatisfiable: the range lies outside the file
+    """
+    if not header:
+        return None
+    match = RANGE_PATTERN.match(header.strip().replace(" ", ""))
+    if not match:
+        # 多个范围或无法识别的单位：忽略Range
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # 后缀范围：最后N个字节
+        suffix = int(last)
+        if suffix == 0 or size == 0:
+            raise RangeNotSatisfiable()
+        return max(size - suffix, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or (last and int(last) < start):
+        raise RangeNotSatisfiable()
+    return start, end
+
+
+class RangeFileResponse(Response):
+    """
+    :param path: file on local disk
+    :param range_header: Range request header, ignored unless the caller validated If-Range
+    :param headers: extra headers (ETag, Cache-Control, Content-Disposition ...)
+    :param send_body: False for HEAD requests
+    """
+    chunk_size = 64 * 1024
+
+    def __init__(self, path, media_type="application/octet-stream", range_header=None, headers=None,
+                 send_body=True):
+        self.path = path
+        self.send_body = send_body
+        self.background = None
+        file_stat = os.stat(path)
+        if not stat.S_ISREG(file_stat.st_mode):
+            raise FileNotFoundError(path)
+        size = file_stat.st_size
+
+        try:
+            byte_range = parse_range(range_header, size)
+        except RangeNotSatisfiable:
+            self.status_code = 416
+            self.offset, self.count = 0, 0
+        else:
+            self.status_code = 206 if byte_range else 200
+            self.offset, end = byte_range or (0, size - 1)
+            self.count = end - self.offset + 1
+
+        self.media_type = media_type
+        self.body = b""
+        self.init_headers(headers)
+        self.headers["accept-ranges"] = "bytes"
+        self.headers["last-modified"] = formatdate(file_stat.st_mtime, usegmt=True)
+        self.headers["content-length"] = str(self.count)
+        if self.status_code == 206:
+            self.headers["content-range"] = f"bytes {self.offset}-{self.offset + self.count - 1}/{size}"
+        elif self.status_code == 416:
+            self.headers["content-range"] = f"bytes */{size}"
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if not self.send_body or self.status_code == 416 or self.count == 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        extensions = scope.get("extensions") or {}
+        if self.status_code == 200 and "http.response.pathsend" in extensions:
+            await send({"type": "http.response.pathsend", "path": os.path.abspath(self.path)})
+            return
+        if "http.response.zerocopysend" in extensions:
+            with open(self.path, "rb") as file:
+                await send({"type": "http.response.zerocopysend", "file": file,
+                            "offset": self.offset, "count": self.count, "more_body": False})
+            return
+
+        async with await anyio.open_file(self.path, mode="rb") as file:
+            await file.seek(self.offset)
+            remaining = self.count
+            while remaining > 0:
+                chunk = await file.read(min(self.chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining > 0:
+                # 文件在发送期间被截断
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
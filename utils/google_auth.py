@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Google ID token验证
+
+id_token.verify_oauth2_token 每次调用都可能重新下载Google的证书，并且是同步调用。
+这里把证书按 Cache-Control 的 max-age 缓存，在过期前由后台线程刷新，
+验证本身放到线程池中执行，不阻塞事件循环。
+
+离线测试时可以用 GOOGLE_CERTS_FILE 指定本地证书文件（格式与证书接口相同：{"kid": "PEM证书"}）。
+"""
+
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from fastapi.concurrency import run_in_threadpool
+from google.auth import jwt
+from .lazy_instance import LazyInstance
+
+GOOGLE_CERTS_URL = "https://www.googleapis.com/oauth2/v1/certs"
+GOOGLE_ISSUERS = ("accounts.google.com", "https://accounts.google.com")
+GOOGLE_CERTS_FILE = os.getenv('GOOGLE_CERTS_FILE')
+
+_MAX_AGE_RE = re.compile(r"max-age=(\d+)")
+
+
+def parse_max_age(cache_control, default):
+    """
+    :return: max-age from a Cache-Control header value, or default
+    """
+    match = _MAX_AGE_RE.search(cache_control or "")
+    return int(match.group(1)) if match else default
+
+
+def fetch_google_certs(url=GOOGLE_CERTS_URL, default_ttl=3600):
+    """
+    download the certs
+    :return: (certs dict kid -> PEM, ttl seconds from Cache-Control)
+    """
+    from google.auth.transport import requests as google_requests
+    response = google_requests.Request()(url, method="GET")
+    if response.status != 200:
+        raise ValueError(f"获取Google证书失败, 状态码: {response.status}")
+    headers = {key.lower(): value for key, value in response.headers.items()}
+    return json.loads(response.data), parse_max_age(headers.get("cache-control"), default_ttl)
+
+
+def cert_file_fetcher(path, ttl=3600):
+    """
+    fetcher reading certs from a local JSON file, for offline tests and development
+    """
+    def fetch():
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f), ttl
+    return fetch
+
+
+class GoogleCertCache:
+    """
+    caches Google's signing certs and the claims of recently verified tokens
+    :param fetcher: callable returning (certs, ttl_seconds)
+    :param refresh_margin: refresh in the background when the certs expire within this many seconds
+    :param min_refetch_interval: on an unknown key id refetch at most this often
+    :param max_tokens: size of the verified token cache
+    """
+    def __init__(self, fetcher=None, refresh_margin=300, min_refetch_interval=60, max_tokens=1000,
+                 clock=time.time):
+        if fetcher is None:
+            fetcher = cert_file_fetcher(GOOGLE_CERTS_FILE) if GOOGLE_CERTS_FILE else fetch_google_certs
+        self.fetcher = fetcher
+        self.refresh_margin = refresh_margin
+        self.min_refetch_interval = min_refetch_interval
+        self.max_tokens = max_tokens
+        self.clock = clock
+        self.fetch_count = 0
+        self._certs = None
+        self._expires_at = 0
+        self._fetched_at = 0
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self._tokens = OrderedDict()
+        self._tokens_lock = threading.Lock()
+
+    def refresh(self):
+        """
+        fetch the certs now; concurrent callers wait for the same fetch instead of fetching again
+        """
+        started = self.clock()
+        with self._lock:
+            if self._fetched_at >= started:
+                return self._certs
+            certs, ttl = self.fetcher()
+            self.fetch_count += 1
+            now = self.clock()
+            self._certs, self._expires_at, self._fetched_at = certs, now + ttl, now
+            return certs
+
+    def get_certs(self):
+        """
+        cached certs; blocks only when there are none or they have expired
+        """
+        now = self.clock()
+        if self._certs is None or now >= self._expires_at:
+            return self.refresh()
+        if now >= self._expires_at - self.refresh_margin:
+            self.refresh_in_background()
+        return self._certs
+
+    def refresh_in_background(self):
+        if self._refreshing:
+            return
+        self._refreshing = True
+
+        def run():
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"后台刷新Google证书失败: {e}")
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def _cached_token(self, key):
+        with self._tokens_lock:
+            entry = self._tokens.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= self.clock():
+                del self._tokens[key]
+                return None
+            self._tokens.move_to_end(key)
+            return entry[1]
+
+    def _cache_token(self, key, claims):
+        with self._tokens_lock:
+            self._tokens[key] = (claims["exp"], claims)
+            while len(self._tokens) > self.max_tokens:
+                self._tokens.popitem(last=False)
+
+    def verify(self, token, audience):
+        """
+        same checks as id_token.verify_oauth2_token: signature, exp/iat, audience and issuer
+        :return: the token claims
+        :raises ValueError: when the token is invalid
+        """
+        if isinstance(token, bytes):
+            token = token.decode("utf-8")
+        key = hashlib.sha256(f"{audience}:{token}".encode("utf-8")).hexdigest()
+        claims = self._cached_token(key)
+        if claims is not None:
+            return claims
+
+        try:
+            claims = jwt.decode(token, certs=self.get_certs(), audience=audience)
+        except ValueError as e:
+            # Google轮换了签名密钥而缓存还没过期时，重新获取一次证书
+            if "Certificate for key id" not in str(e) or \
+                    self.clock() - self._fetched_at < self.min_refetch_interval:
+                raise
+            self.refresh()
+            claims = jwt.decode(token, certs=self._certs, audience=audience)
+
+        if claims.get("iss") not in GOOGLE_ISSUERS:
+            raise ValueError(f"Wrong issuer. 'iss' should be one of the following: {GOOGLE_ISSUERS}")
+        self._cache_token(key, claims)
+        return claims
+
+    async def verify_async(self, token, audience):
+        """
+        verify() in the thread pool so the event loop is never blocked by a cert fetch
+        """
+        return await run_in_threadpool(self.verify, token, audience)
+
+
+google_cert_cache = LazyInstance(GoogleCertCache)
+
+
+async def verify_google_id_token(token, audience):
+    return await google_cert_cache.verify_async(token, audience)
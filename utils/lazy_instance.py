@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+延迟构建的全局单例
+"""
+
+import os
+import threading
+
+
+class LazyInstance:
+    """
+    module level singleton that is built on first attribute access instead of at import time.
+    The instance is rebuilt once per process, so a pymongo/motor client created in the
+    parent is never reused after fork (uvicorn --workers N).
+    """
+    def __init__(self, factory):
+        object.__setattr__(self, "_factory", factory)
+        object.__setattr__(self, "_instance", None)
+        object.__setattr__(self, "_pid", None)
+        object.__setattr__(self, "_lock", threading.Lock())
+
+    def get_instance(self):
+        """
+        return the instance for the current process, building it if needed
+        """
+        pid = os.getpid()
+        if self._instance is None or self._pid != pid:
+            with self._lock:
+                if self._instance is None or self._pid != pid:
+                    object.__setattr__(self, "_instance", self._factory())
+                    object.__setattr__(self, "_pid", pid)
+        return self._instance
+
+    def is_built(self):
+        return self._instance is not None and self._pid == os.getpid()
+
+    def reset(self, instance=None):
+        """
+        drop (or replace, e.g. in tests) the current instance
+        """
+        with self._lock:
+            object.__setattr__(self, "_instance", instance)
+            object.__setattr__(self, "_pid", os.getpid() if instance is not None else None)
+
+    def __getattr__(self, name):
+        return getattr(self.get_instance(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self.get_instance(), name, value)
+
+    def __repr__(self):
+        return f"<LazyInstance {getattr(self._factory, '__name__', self._factory)} built={self.is_built()}>"
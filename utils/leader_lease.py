@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+后台单例任务的租约
+
+uvicorn --workers N 或多台机器部署时，每个进程都会执行启动事件。支付监听、过期待支付订单、
+未分配咨询的兜底扫描只需要一个进程执行，否则每个进程都会重复请求链上接口、重复处理同一批订单。
+这些任务每次执行前检查租约：background_leases 集合中的一个文档记录持有者和到期时间，
+持有者每隔三分之一个租期续约，其他进程跳过；持有者退出后租约到期，由下一个检查的进程接管。
+负载索引对齐、分配队列、附件预览队列是进程内状态，仍在每个进程中运行。
+
+    BACKGROUND_LEASE_SECONDS=30   # 租期（秒），持有者异常退出后最多这么久由其他进程接管
+    RUN_BACKGROUND_JOBS=1         # 设为0时本进程从不执行单例任务（例如只处理请求的实例）
+"""
+
+import os
+import time
+import uuid
+import socket
+from datetime import datetime, timedelta
+from pymongo.errors import DuplicateKeyError
+from .lazy_instance import LazyInstance
+
+BACKGROUND_LEASE_SECONDS = float(os.getenv('BACKGROUND_LEASE_SECONDS', 30))
+RUN_BACKGROUND_JOBS = os.getenv('RUN_BACKGROUND_JOBS', '1') == '1'
+
+
+class LeaderLease:
+    """
+    one document {"_id": name, "owner", "expires_at"}: a process holds the lease while it is the owner
+    and the lease has not expired
+    :param name: lease name, one per group of singleton jobs
+    :param dao: AsyncMongoDao, defaults to the global async_mongo_dao
+    :param ttl: lease duration in seconds
+    :param enabled: False to never take the lease, defaults to RUN_BACKGROUND_JOBS
+    """
+    COLLECTION = "background_leases"
+
+    def __init__(self, name="background-jobs", dao=None, ttl=BACKGROUND_LEASE_SECONDS, enabled=RUN_BACKGROUND_JOBS):
+        if dao is None:
+            from .async_mongo_dao import async_mongo_dao
+            dao = async_mongo_dao
+        self.name = name
+        self.dao = dao
+        self.ttl = ttl
+        self.enabled = enabled
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._held = False
+        self._check_at = 0.0
+
+    async def held(self):
+        """
+        take or renew the lease when due, otherwise answer from the last check
+        :return: True if this process holds the lease
+        """
+        if not self.enabled:
+            return False
+        if time.monotonic() < self._check_at:
+            return self._held
+        now = datetime.utcnow()
+        try:
+            # 租约不存在、已到期或本来就属于本进程时写入；被其他进程持有时upsert插入同一个_id失败
+            await self.dao.find_one_and_update(
+                self.COLLECTION,
+                {"_id": self.name, "$or": [{"owner": self.owner}, {"expires_at": {"$lte": now}}]},
+                {"$set": {"owner": self.owner, "expires_at": now + timedelta(seconds=self.ttl)}},
+                projection={"_id": 1}, upsert=True
+            )
+            held = True
+        except DuplicateKeyError:
+            held = False
+        except Exception as e:
+            print(f"检查后台任务租约失败: {e}")
+            held = False
+        if held != self._held:
+            print(f"{'已获得' if held else '已失去'}后台任务租约: {self.name}，进程: {self.owner}")
+        self._held = held
+        self._check_at = time.monotonic() + self.ttl / 3
+        return held
+
+    async def release(self):
+        """give the lease up on shutdown so another process takes over without waiting for it to expire"""
+        if self._held:
+            await self.dao.update_one(self.COLLECTION, {"_id": self.name, "owner": self.owner},
+                                      {"$set": {"expires_at": datetime.utcnow()}})
+            self._held = False
+            self._check_at = 0.0
+
+
+background_lease = LazyInstance(LeaderLease)
@@ -15,5 +15,26 @@ mongo_config = {
     "database": os.getenv("MONGODB_DATABASE", "medical"),
     "collection": os.getenv("MONGODB_COLLECTION", "users"),
     "username": os.getenv("MONGODB_USERNAME", ""),
-    "password": os.getenv("MONGODB_PASSWORD", "")
+    "password": os.getenv("MONGODB_PASSWORD", ""),
+    # 完整连接串（如副本集 mongodb://h1,h2,h3/?replicaSet=rs0），设置后优先于ip/port
+    "uri": os.getenv("MONGODB_URI", ""),
+    "replica_set": os.getenv("MONGODB_REPLICA_SET", ""),
+    # 多文档事务需要副本集，默认在配置了副本集时启用
+    "transactions": os.getenv("MONGODB_TRANSACTIONS", "1" if os.getenv("MONGODB_REPLICA_SET") else "0") == "1",
+    # 连接池与超时（毫秒）
+    "max_pool_size": int(os.getenv("MONGODB_MAX_POOL_SIZE", "100")),
+    "min_pool_size": int(os.getenv("MONGODB_MIN_POOL_SIZE", "0")),
+    "max_idle_time_ms": int(os.getenv("MONGODB_MAX_IDLE_TIME_MS", "0")),
+    "wait_queue_timeout_ms": int(os.getenv("MONGODB_WAIT_QUEUE_TIMEOUT_MS", "5000")),
+    "server_selection_timeout_ms": int(os.getenv("MONGODB_SERVER_SELECTION_TIMEOUT_MS", "5000")),
+    "connect_timeout_ms": int(os.getenv("MONGODB_CONNECT_TIMEOUT_MS", "5000")),
+    "socket_timeout_ms": int(os.getenv("MONGODB_SOCKET_TIMEOUT_MS", "30000")),
+    # 网络压缩，逗号分隔，按优先级排列：zstd,snappy,zlib
+    "compressors": os.getenv("MONGODB_COMPRESSORS", ""),
+    # 默认读偏好，以及列表/统计类读取使用的读偏好（可路由到从节点）
+    "read_preference": os.getenv("MONGODB_READ_PREFERENCE", "primary"),
+    "secondary_read_preference": os.getenv("MONGODB_SECONDARY_READ_PREFERENCE", "secondaryPreferred"),
+    # 查询默认超时（毫秒，0表示不限制）与慢查询日志阈值
+    "max_time_ms": int(os.getenv("MONGODB_MAX_TIME_MS", "0")),
+    "slow_query_ms": int(os.getenv("MONGODB_SLOW_QUERY_MS", "200"))
 }
@@ -1,15 +1,204 @@
 import time
 import re
 import json
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from bson import ObjectId
 import pymongo
 from pymongo import MongoClient
 from pymongo import ASCENDING
+from pymongo import ReadPreference
+from pymongo import ReturnDocument
 from .mongo_config import mongo_config
+from .lazy_instance import LazyInstance
+
+
+READ_PREFERENCES = {
+    "primary": ReadPreference.PRIMARY,
+    "primaryPreferred": ReadPreference.PRIMARY_PREFERRED,
+    "secondary": ReadPreference.SECONDARY,
+    "secondaryPreferred": ReadPreference.SECONDARY_PREFERRED,
+    "nearest": ReadPreference.NEAREST,
+}
+
+
+def get_read_preference(name):
+    """
+    map a readPreference name from config to a pymongo read preference
+    """
+    if name not in READ_PREFERENCES:
+        raise ValueError(f"无效的readPreference: {name}")
+    return READ_PREFERENCES[name]
+
+
+def build_client_args(config=mongo_config):
+    """
+    build (args, kwargs) for MongoClient / AsyncIOMotorClient from config,
+    shared by MongoDao and AsyncMongoDao so both use the same pool and timeouts
+    :return: tuple(args, kwargs)
+    """
+    options = {
+        "maxPoolSize": config["max_pool_size"],
+        "minPoolSize": config["min_pool_size"],
+        "serverSelectionTimeoutMS": config["server_selection_timeout_ms"],
+        "connectTimeoutMS": config["connect_timeout_ms"],
+        "readPreference": config["read_preference"],
+    }
+    # 0 表示使用驱动默认值（不限制）
+    if config["wait_queue_timeout_ms"]:
+        options["waitQueueTimeoutMS"] = config["wait_queue_timeout_ms"]
+    if config["socket_timeout_ms"]:
+        options["socketTimeoutMS"] = config["socket_timeout_ms"]
+    if config["max_idle_time_ms"]:
+        options["maxIdleTimeMS"] = config["max_idle_time_ms"]
+    if config["compressors"]:
+        options["compressors"] = config["compressors"]
+    if config["replica_set"]:
+        options["replicaSet"] = config["replica_set"]
+
+    if config["uri"]:
+        return (config["uri"],), options
+
+    if config["username"]:
+        options["username"] = config["username"]
+        options["password"] = config["password"]
+    return (config["ip"], config["port"]), options
+
+
+def query_shape(query):
+    """
+    replace the values of a filter with 1 so that queries differing only by value share a shape
+    """
+    if isinstance(query, dict):
+        return {key: query_shape(value) for key, value in query.items()}
+    if isinstance(query, (list, tuple)):
+        return [query_shape(value) for value in query[:1]]
+    return 1
+
+
+def redact_query(query):
+    """
+    replace the literal values of a filter with typed placeholders, keeping field names and operators,
+    so a sample can be shown to admins and still be explained without exposing user data
+    """
+    if isinstance(query, dict):
+        return {key: redact_query(value) for key, value in query.items()}
+    if isinstance(query, (list, tuple)):
+        return [redact_query(value) for value in query[:1]]
+    if query is None or isinstance(query, bool):
+        return query
+    if isinstance(query, (int, float)):
+        return 0
+    if isinstance(query, datetime):
+        return datetime(1970, 1, 1)
+    if isinstance(query, ObjectId):
+        return ObjectId("0" * 24)
+    return "?"
+
+
+class QueryStats:
+    """
+    query metrics shared by MongoDao and AsyncMongoDao: count / total / max time per (operation, collection),
+    plus one redacted sample per distinct filter/sort shape so the index manager can explain them
+    """
+    MAX_SHAPES = 500
+    SHAPE_OPERATIONS = ("find", "find_one", "count", "iterate")
+
+    def __init__(self, slow_query_ms=0):
+        self.slow_query_ms = slow_query_ms
+        self.__lock = threading.Lock()
+        self.__stats = {}
+        self.__shapes = {}
+
+    def record(self, operation, collection_name, started, query=None, sort=None):
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        key = f"{collection_name}.{operation}"
+        with self.__lock:
+            item = self.__stats.setdefault(key, {"count": 0, "total_ms": 0.0, "max_ms": 0.0})
+            item["count"] += 1
+            item["total_ms"] += elapsed_ms
+            item["max_ms"] = max(item["max_ms"], elapsed_ms)
+            if operation in self.SHAPE_OPERATIONS:
+                self.__record_shape(collection_name, query, sort)
+        if self.slow_query_ms and elapsed_ms >= self.slow_query_ms:
+            print(f"慢查询: {key}, 耗时: {elapsed_ms:.1f}ms, 条件: {redact_query(query)}")
+        return elapsed_ms
+
+    def __record_shape(self, collection_name, query, sort):
+        shape_key = json.dumps([collection_name, query_shape(query or {}), sort or []], sort_keys=True, default=str)
+        shape = self.__shapes.get(shape_key)
+        if shape:
+            shape["count"] += 1
+        elif len(self.__shapes) < self.MAX_SHAPES:
+            self.__shapes[shape_key] = {"collection": collection_name, "query": redact_query(query or {}),
+                                        "sort": sort, "count": 1}
+
+    def query_shapes(self):
+        """
+        distinct query shapes seen so far, each with one sample filter whose values are placeholders
+        :return: list of {"collection", "query", "sort", "count"}
+        """
+        with self.__lock:
+            return [dict(shape) for shape in self.__shapes.values()]
+
+    def snapshot(self):
+        with self.__lock:
+            return {
+                key: dict(item, avg_ms=item["total_ms"] / item["count"])
+                for key, item in self.__stats.items()
+            }
+
+    def reset(self):
+        with self.__lock:
+            self.__stats.clear()
+            self.__shapes.clear()
+
+
+query_stats = QueryStats(mongo_config["slow_query_ms"])
+
+
+def apply_cursor_options(cursor, sort=None, skip=0, limit=0, batch_size=None, max_time_ms=None, hint=None):
+    """
+    apply the common find() options to a pymongo / motor cursor
+    """
+    if sort:
+        cursor = cursor.sort(sort)
+    if skip:
+        cursor = cursor.skip(skip)
+    if limit:
+        cursor = cursor.limit(limit)
+    if batch_size:
+        cursor = cursor.batch_size(batch_size)
+    if max_time_ms:
+        cursor = cursor.max_time_ms(max_time_ms)
+    if hint:
+        cursor = cursor.hint(hint)
+    return cursor
+
 
 class MongoDao:
-    def __init__(self, config=mongo_config):
-        self.__client = pymongo.MongoClient(config["ip"], config["port"], username=config['username'], password=config['password'])
+    def __init__(self, config=mongo_config, db=None, secondary_db=None):
+        """
+        :param db: use this database (e.g. a mongomock one in tests) instead of connecting with config;
+                   transactions are off and secondary reads go to db unless secondary_db is given
+        """
+        if db is not None:
+            self.__client = None
+            self.__db = db
+            self.__secondary_db = secondary_db if secondary_db is not None else db
+            self.max_time_ms = None
+            self.transactions = False
+            return
+        args, options = build_client_args(config)
+        self.__client = pymongo.MongoClient(*args, **options)
         self.__db = self.__client[config["database"]]
+        # 列表/统计类读取可路由到从节点
+        self.__secondary_db = self.__client.get_database(
+            config["database"], read_preference=get_read_preference(config["secondary_read_preference"])
+        )
+        self.max_time_ms = config.get("max_time_ms") or None
+        self.transactions = config.get("transactions", False)
 
     def insert(self, collection_name, parm):
         """
@@ -102,6 +291,34 @@ class MongoDao:
             print(f"创建索引失败: {e}")
             return None
 
+    def index_information(self, collection_name):
+        """
+        live indexes of a collection
+        :return: dict name -> {"key": [(field, direction)], "unique": ..., ...}
+        """
+        return self.__db[collection_name].index_information()
+
+    def create_indexes(self, collection_name, index_models):
+        """
+        create several indexes in one command
+        :param index_models: list of pymongo IndexModel
+        :return: list of index names
+        """
+        return self.__db[collection_name].create_indexes(index_models)
+
+    def drop_index(self, collection_name, index_name):
+        self.__db[collection_name].drop_index(index_name)
+
+    def explain(self, collection_name, query, sort=None):
+        """
+        explain a find() and return the server's query planner output
+        :return: explain document
+        """
+        cursor = self.__db[collection_name].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        return cursor.explain()
+
     def check_index(self, collection_name):
         """
         check if index exist
@@ -132,8 +349,155 @@ class MongoDao:
         rst = self.__db[collection].find(regex_dic)
         return rst
 
+    # 查询API：服务层的查询都经过这里，统一支持投影、排序、分页、超时和统计
+    def _database(self, secondary=False):
+        return self.__secondary_db if secondary else self.__db
+
+    def find_cursor(self, collection_name, query=None, projection=None, sort=None, skip=0, limit=0,
+                    batch_size=None, max_time_ms=None, hint=None, secondary=False):
+        """
+        build a cursor without fetching documents, for streaming large results
+        :param collection_name:
+        :param query: filter dict
+        :param projection: fields to return, e.g. {"price_usdt": 1}
+        :param sort: list of (key, direction)
+        :param skip:
+        :param limit: 0 means no limit
+        :param batch_size: documents per round trip
+        :param max_time_ms: server side timeout, defaults to mongo_config["max_time_ms"]
+        :param hint: index name or key list
+        :param secondary: route this read with the secondary read preference
+        :return: pymongo Cursor
+        """
+        cursor = self._database(secondary)[collection_name].find(query or {}, projection)
+        return apply_cursor_options(cursor, sort, skip, limit, batch_size,
+                                    max_time_ms or self.max_time_ms, hint)
+
+    def find(self, collection_name, query=None, projection=None, sort=None, skip=0, limit=0,
+             batch_size=None, max_time_ms=None, hint=None, secondary=False):
+        """
+        find documents, see find_cursor for parameters
+        :return: list of documents
+        """
+        started = time.perf_counter()
+        rst = list(self.find_cursor(collection_name, query, projection, sort, skip, limit,
+                                    batch_size, max_time_ms, hint, secondary))
+        query_stats.record("find", collection_name, started, query, sort)
+        return rst
+
+    def find_one(self, collection_name, query, projection=None, sort=None, max_time_ms=None):
+        """
+        find a single document
+        :return: document or None
+        """
+        started = time.perf_counter()
+        rst = self.__db[collection_name].find_one(query, projection, sort=sort,
+                                                  max_time_ms=max_time_ms or self.max_time_ms)
+        query_stats.record("find_one", collection_name, started, query, sort)
+        return rst
+
+    def count(self, collection_name, query=None, max_time_ms=None, secondary=False):
+        """
+        count documents matching query
+        :return: int
+        """
+        started = time.perf_counter()
+        options = {"maxTimeMS": max_time_ms or self.max_time_ms} if (max_time_ms or self.max_time_ms) else {}
+        rst = self._database(secondary)[collection_name].count_documents(query or {}, **options)
+        query_stats.record("count", collection_name, started, query)
+        return rst
+
+    def aggregate(self, collection_name, pipeline, max_time_ms=None, allow_disk_use=False, batch_size=None,
+                  secondary=False):
+        """
+        run an aggregation pipeline
+        :return: list of documents
+        """
+        started = time.perf_counter()
+        options = {"allowDiskUse": allow_disk_use}
+        if max_time_ms or self.max_time_ms:
+            options["maxTimeMS"] = max_time_ms or self.max_time_ms
+        if batch_size:
+            options["batchSize"] = batch_size
+        rst = list(self._database(secondary)[collection_name].aggregate(pipeline, **options))
+        query_stats.record("aggregate", collection_name, started, pipeline)
+        return rst
+
+    def update_one(self, collection_name, query, update, upsert=False, session=None):
+        """
+        update_one with a full update document ($set/$inc/...)
+        :return: UpdateResult
+        """
+        started = time.perf_counter()
+        rst = self.__db[collection_name].update_one(query, update, upsert=upsert, session=session)
+        query_stats.record("update_one", collection_name, started, query)
+        return rst
+
+    def find_one_and_update(self, collection_name, query, update, projection=None, sort=None, upsert=False,
+                            return_document="after", session=None):
+        """
+        atomic conditional update, e.g. claim a document only if a field is still unset
+        :param return_document: "after" or "before"
+        :return: the matched document (None if nothing matched)
+        """
+        started = time.perf_counter()
+        rst = self.__db[collection_name].find_one_and_update(
+            query, update, projection=projection, sort=sort, upsert=upsert, session=session,
+            return_document=ReturnDocument.AFTER if return_document == "after" else ReturnDocument.BEFORE
+        )
+        query_stats.record("find_one_and_update", collection_name, started, query)
+        return rst
+
+    @contextmanager
+    def transaction(self):
+        """
+        yield a session inside a transaction when transactions are enabled (replica set), otherwise None.
+        Pass the yielded value as session= to the write methods.
+        """
+        if not self.transactions:
+            yield None
+            return
+        with self.__client.start_session() as session:
+            with session.start_transaction():
+                yield session
+
+    def update_many(self, collection_name, query, update):
+        """
+        update_many with a full update document
+        :return: UpdateResult
+        """
+        started = time.perf_counter()
+        rst = self.__db[collection_name].update_many(query, update)
+        query_stats.record("update_many", collection_name, started, query)
+        return rst
+
+    def insert_many(self, collection_name, documents, ordered=True):
+        """
+        insert a list of documents in one round trip; pymongo sets "_id" on each document in place
+        :return: InsertManyResult or None when documents is empty
+        """
+        if not documents:
+            return None
+        started = time.perf_counter()
+        rst = self.__db[collection_name].insert_many(documents, ordered=ordered)
+        query_stats.record("insert_many", collection_name, started)
+        return rst
+
+    def bulk_write(self, collection_name, requests, ordered=False):
+        """
+        execute a list of pymongo write models (InsertOne/UpdateOne/...) in one round trip
+        :return: BulkWriteResult or None when requests is empty
+        """
+        if not requests:
+            return None
+        started = time.perf_counter()
+        rst = self.__db[collection_name].bulk_write(requests, ordered=ordered)
+        query_stats.record("bulk_write", collection_name, started)
+        return rst
+
 
-mongo_dao = MongoDao()
+# 首次使用时才建立连接，且每个进程（fork之后）各自创建客户端
+mongo_dao = LazyInstance(MongoDao)
 
 if __name__ == '__main__':
     # rst = mongoDao.search("IdMap", "token", "7hg2e82295a0df70f2442f820655f28ca")
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+声明式索引管理：每个集合声明期望的索引，与线上索引做差异比较后幂等地应用
+"""
+
+from pymongo import IndexModel, ASCENDING
+
+
+class IndexSpec:
+    """
+    one desired index
+    :param keys: list of (field, direction), or a single field name for an ascending index
+    :param name: index name, defaults to the mongo style name e.g. "user_id_1_created_at_-1"
+    :param unique:
+    :param partial_filter: partialFilterExpression dict
+    :param sparse:
+    :param expire_after_seconds: TTL in seconds
+    """
+    def __init__(self, keys, name=None, unique=False, partial_filter=None, sparse=False,
+                 expire_after_seconds=None):
+        if isinstance(keys, str):
+            keys = [(keys, ASCENDING)]
+        self.keys = [(field, int(direction)) for field, direction in keys]
+        self.name = name or "_".join(f"{field}_{direction}" for field, direction in self.keys)
+        self.unique = unique
+        self.partial_filter = partial_filter
+        self.sparse = sparse
+        self.expire_after_seconds = expire_after_seconds
+
+    def options(self):
+        options = {"name": self.name}
+        if self.unique:
+            options["unique"] = True
+        if self.partial_filter:
+            options["partialFilterExpression"] = self.partial_filter
+        if self.sparse:
+            options["sparse"] = True
+        if self.expire_after_seconds is not None:
+            options["expireAfterSeconds"] = self.expire_after_seconds
+        return options
+
+    def to_index_model(self):
+        return IndexModel(self.keys, **self.options())
+
+    def same_options(self, live):
+        """
+        compare against one entry of collection.index_information()
+        """
+        return (bool(live.get("unique", False)) == self.unique
+                and live.get("partialFilterExpression") == self.partial_filter
+                and bool(live.get("sparse", False)) == self.sparse
+                and live.get("expireAfterSeconds") == self.expire_after_seconds)
+
+    def __repr__(self):
+        return f"IndexSpec({self.name}, {self.options()})"
+
+
+def _live_keys(live):
+    return [(field, int(direction)) for field, direction in live["key"]]
+
+
+class IndexManager:
+    """
+    diff declared IndexSpec lists against the live indexes and apply the difference
+    """
+    def __init__(self, dao):
+        self.dao = dao
+
+    def plan(self, specs):
+        """
+        compute the actions needed to reach the declared state
+        :param specs: dict collection_name -> list of IndexSpec
+        :return: list of dicts {"action": create|replace|ok|extra, "collection", "name", ...}
+        """
+        actions = []
+        for collection_name, collection_specs in specs.items():
+            live_indexes = self.dao.index_information(collection_name)
+            matched = {"_id_"}
+            for spec in collection_specs:
+                live_name = next(
+                    (name for name, live in live_indexes.items() if _live_keys(live) == spec.keys),
+                    None
+                )
+                if live_name is None:
+                    action = "create"
+                elif spec.same_options(live_indexes[live_name]):
+                    action = "ok"
+                else:
+                    action = "replace"
+                if live_name:
+                    matched.add(live_name)
+                actions.append({"action": action, "collection": collection_name,
+                                "name": spec.name, "live_name": live_name, "spec": spec})
+
+            for live_name in live_indexes:
+                if live_name not in matched:
+                    actions.append({"action": "extra", "collection": collection_name,
+                                    "name": live_name, "live_name": live_name, "spec": None})
+        return actions
+
+    def apply(self, specs, drop_extra=False):
+        """
+        create missing indexes, rebuild indexes whose options changed and optionally drop
+        indexes that are no longer declared. Safe to run repeatedly.
+        :return: the executed plan
+        """
+        actions = self.plan(specs)
+        to_create = {}
+        for item in actions:
+            collection_name = item["collection"]
+            try:
+                if item["action"] == "replace":
+                    self.dao.drop_index(collection_name, item["live_name"])
+                    to_create.setdefault(collection_name, []).append(item["spec"])
+                elif item["action"] == "create":
+                    to_create.setdefault(collection_name, []).append(item["spec"])
+                elif item["action"] == "extra" and drop_extra:
+                    self.dao.drop_index(collection_name, item["live_name"])
+                    item["action"] = "dropped"
+            except Exception as e:
+                item["error"] = str(e)
+                print(f"索引操作失败: {collection_name}.{item['name']}, 错误: {e}")
+
+        for collection_name, collection_specs in to_create.items():
+            # 逐个创建，单个索引失败（如唯一索引遇到重复数据）不影响其他索引
+            for spec in collection_specs:
+                try:
+                    self.dao.create_indexes(collection_name, [spec.to_index_model()])
+                    print(f"索引已创建: {collection_name}.{spec.name}")
+                except Exception as e:
+                    item = next(a for a in actions if a["spec"] is spec)
+                    item["error"] = str(e)
+                    print(f"创建索引失败: {collection_name}.{spec.name}, 错误: {e}")
+        return actions
+
+    def collscan_report(self, query_shapes):
+        """
+        explain each query shape and return those whose winning plan is a collection scan
+        :param query_shapes: list of {"collection", "query", "sort"} e.g. from query_stats.query_shapes()
+        :return: list of {"collection", "query", "sort", "count", "plan"}
+        """
+        report = []
+        for shape in query_shapes:
+            try:
+                explain = self.dao.explain(shape["collection"], shape["query"], shape.get("sort"))
+            except Exception as e:
+                print(f"explain失败: {shape['collection']}, 错误: {e}")
+                continue
+            winning_plan = explain.get("queryPlanner", {}).get("winningPlan", {})
+            if "COLLSCAN" in _plan_stages(winning_plan):
+                report.append(dict(shape, plan=winning_plan))
+        return report
+
+
+def _plan_stages(plan):
+    """
+    collect every stage name of an explain plan tree
+    """
+    stages = []
+    if not isinstance(plan, dict):
+        return stages
+    if "stage" in plan:
+        stages.append(plan["stage"])
+    for key in ("inputStage", "queryPlan"):
+        stages.extend(_plan_stages(plan.get(key)))
+    for child in plan.get("inputStages", []):
+        stages.extend(_plan_stages(child))
+    return stages
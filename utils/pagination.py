@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+游标（keyset）分页
+
+游标是对 (排序字段, 唯一字段) 的不透明编码。翻页时用范围条件代替skip，
+配合以这两个字段结尾的复合索引，第N页与第1页的代价相同。
+"""
+
+import json
+import base64
+from datetime import datetime
+from bson import ObjectId
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+PREV_CURSOR_HEADER = "X-Prev-Cursor"
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {"t": value.isoformat()}
+    if isinstance(value, ObjectId):
+        return {"o": str(value)}
+    return {"v": value}
+
+
+def _decode_value(value):
+    if "t" in value:
+        return datetime.fromisoformat(value["t"])
+    if "o" in value:
+        return ObjectId(value["o"])
+    return value["v"]
+
+
+def encode_cursor(sort_value, tie_value):
+    """
+    :param sort_value: value of the sort field (usually created_at) of the boundary document
+    :param tie_value: value of the unique tie-breaker field (usually _id) of the boundary document
+    :return: opaque url-safe string
+    """
+    raw = json.dumps([_encode_value(sort_value), _encode_value(tie_value)], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor):
+    """
+    :return: (sort_value, tie_value)
+    :raise InvalidCursor: if the cursor was not produced by encode_cursor
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        sort_value, tie_value = json.loads(raw)
+        return _decode_value(sort_value), _decode_value(tie_value)
+    except Exception:
+        raise InvalidCursor(f"无效的分页游标: {cursor}")
+
+
+class Keyset:
+    """
+    one keyset ordering, e.g. Keyset("created_at", "_id", descending=True) for newest first
+    :param field: sort field
+    :param tie_field: unique field breaking ties of the sort field
+    :param descending: listing order
+    """
+    def __init__(self, field="created_at", tie_field="_id", descending=False):
+        self.field = field
+        self.tie_field = tie_field
+        self.descending = descending
+
+    def page(self, query, after=None, before=None):
+        """
+        build the query and sort of one page
+        :param after: cursor of the last item of the previous page, returns the items following it
+        :param before: cursor of the first item of the next page, returns the items preceding it
+        :return: (query, sort, reverse) - reverse means the fetched items must be reversed to listing order
+        """
+        backwards = before is not None
+        cursor = before if backwards else after
+        # 向前翻页时反向排序取最近的N条，再翻转回列表顺序
+        descending = self.descending != backwards
+        direction = -1 if descending else 1
+        sort = [(self.field, direction), (self.tie_field, direction)]
+        if cursor is None:
+            return query, sort, backwards
+
+        sort_value, tie_value = decode_cursor(cursor)
+        op = "$lt" if descending else "$gt"
+        boundary = {"$or": [
+            {self.field: {op: sort_value}},
+            {self.field: sort_value, self.tie_field: {op: tie_value}},
+        ]}
+        return ({"$and": [query, boundary]} if query else boundary), sort, backwards
+
+    def cursor(self, item):
+        """
+        :param item: document or model with the sort and tie fields (a model's "id" stands for "_id")
+        """
+        def value(name):
+            if isinstance(item, dict):
+                found = item.get(name, item.get("id")) if name == "_id" else item.get(name)
+            else:
+                found = getattr(item, "id" if name == "_id" else name)
+            if name == "_id" and isinstance(found, str) and ObjectId.is_valid(found):
+                found = ObjectId(found)
+            return found
+        return encode_cursor(value(self.field), value(self.tie_field))
+
+    def headers(self, items, limit, after=None, before=None, skip=0):
+        """
+        response headers pointing at the neighbouring pages
+        :return: dict with X-Next-Cursor (pass as after=) and/or X-Prev-Cursor (pass as before=)
+        """
+        headers = {}
+        if not items:
+            return headers
+        if before is not None or (limit and len(items) >= limit):
+            headers[NEXT_CURSOR_HEADER] = self.cursor(items[-1])
+        if after is not None or before is not None or skip:
+            headers[PREV_CURSOR_HEADER] = self.cursor(items[0])
+        return headers
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+附件预览图生成
+
+图片生成压缩缩略图，PDF渲染第一页（需要安装PyMuPDF，未安装时PDF不生成预览）。
+预览统一为渐进式JPEG，长边不超过 PREVIEW_MAX_SIZE，适合移动网络下的列表页。
+
+    PREVIEW_MAX_SIZE=480   # 预览图长边像素
+    PREVIEW_QUALITY=70     # JPEG质量
+"""
+
+import os
+from PIL import Image, ImageOps
+
+PREVIEW_MAX_SIZE = int(os.getenv('PREVIEW_MAX_SIZE', 480))
+PREVIEW_QUALITY = int(os.getenv('PREVIEW_QUALITY', 70))
+PREVIEW_SUFFIX = ".preview.jpg"
+PREVIEW_CONTENT_TYPE = "image/jpeg"
+
+# SVG等矢量格式不在此列：PIL无法解码，也不应在服务端渲染
+IMAGE_TYPES = ("image/jpeg", "image/png", "image/gif", "image/webp", "image/bmp", "image/tiff")
+PDF_TYPE = "application/pdf"
+
+try:
+    import fitz  # PyMuPDF
+except ImportError:
+    fitz = None
+
+
+class UnsupportedPreview(Exception):
+    pass
+
+
+def can_preview(content_type):
+    return content_type in IMAGE_TYPES or (content_type == PDF_TYPE and fitz is not None)
+
+
+def _flatten(image):
+    """
+    RGB on a white background, keeping transparent PNGs readable
+    """
+    if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, "white")
+        background.paste(image, mask=image.getchannel("A"))
+        return background
+    return image.convert("RGB")
+
+
+def _open_image(path, max_size):
+    with Image.open(path) as source:
+        # JPEG按目标尺寸解码，大图不必完整解压
+        source.draft("RGB", (max_size, max_size))
+        image = ImageOps.exif_transpose(source)
+    image.thumbnail((max_size, max_size))
+    return _flatten(image)
+
+
+def _open_pdf(path, max_size):
+    if fitz is None:
+        raise UnsupportedPreview("未安装PyMuPDF，无法生成PDF预览")
+    with fitz.open(path) as document:
+        if document.page_count == 0:
+            raise UnsupportedPreview("PDF没有页面")
+        page = document[0]
+        zoom = max_size / max(page.rect.width, page.rect.height)
+        pixmap = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+        return Image.frombytes("RGB", (pixmap.width, pixmap.height), pixmap.samples)
+
+
+def render_preview(source_path, target_path, content_type, max_size=PREVIEW_MAX_SIZE, quality=PREVIEW_QUALITY):
+    """
+    blocking; run it in a worker thread
+    :return: dict with "width", "height", "size" of the written JPEG
+    :raise UnsupportedPreview: the content type has no preview
+    """
+    if content_type in IMAGE_TYPES:
+        image = _open_image(source_path, max_size)
+    elif content_type == PDF_TYPE:
+        image = _open_pdf(source_path, max_size)
+    else:
+        raise UnsupportedPreview(f"不支持预览的类型: {content_type}")
+    image.save(target_path, "JPEG", quality=quality, optimize=True, progressive=True)
+    return {"width": image.width, "height": image.height, "size": os.path.getsize(target_path)}
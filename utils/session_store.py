@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+会话存储：登录会话不再保存在进程内的字典里，多个uvicorn worker/多台机器可以共享
+
+    SESSION_BACKEND=memory   # 默认，进程内LRU+TTL，只适合单worker
+    SESSION_BACKEND=mongo    # sessions集合 + TTL索引
+    SESSION_BACKEND=redis    # 任何兼容Redis协议的服务，地址见 REDIS_URL
+"""
+
+import os
+import json
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from .lazy_instance import LazyInstance
+from .mongo_indexes import IndexSpec
+
+# 与登录Cookie的max_age保持一致
+SESSION_TTL_SECONDS = int(os.getenv('SESSION_TTL_SECONDS', 3600 * 24))
+SESSION_MAX_ENTRIES = int(os.getenv('SESSION_MAX_ENTRIES', 10000))
+SESSION_BACKEND = os.getenv('SESSION_BACKEND', 'memory')
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+
+
+class SessionStore:
+    """
+    session_id -> session data (a JSON serialisable dict), entries expire after ttl seconds
+    """
+    def __init__(self, ttl=SESSION_TTL_SECONDS):
+        self.ttl = ttl
+
+    async def get(self, session_id):
+        """
+        :return: the session data, or None if missing/expired
+        """
+        raise NotImplementedError
+
+    async def set(self, session_id, data, ttl=None):
+        raise NotImplementedError
+
+    async def delete(self, session_id):
+        raise NotImplementedError
+
+
+class MemorySessionStore(SessionStore):
+    """
+    bounded in-process store: least recently used entries are evicted once max_entries is reached
+    """
+    def __init__(self, ttl=SESSION_TTL_SECONDS, max_entries=SESSION_MAX_ENTRIES, clock=time.monotonic):
+        super().__init__(ttl)
+        self.max_entries = max_entries
+        self.clock = clock
+        self._entries = OrderedDict()
+
+    async def get(self, session_id):
+        entry = self._entries.get(session_id)
+        if entry is None:
+            return None
+        expires_at, data = entry
+        if expires_at <= self.clock():
+            del self._entries[session_id]
+            return None
+        self._entries.move_to_end(session_id)
+        return data
+
+    async def set(self, session_id, data, ttl=None):
+        self._entries[session_id] = (self.clock() + (ttl or self.ttl), data)
+        self._entries.move_to_end(session_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def delete(self, session_id):
+        self._entries.pop(session_id, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class MongoSessionStore(SessionStore):
+    """
+    one document per session: {"_id": session_id, "data": {...}, "expires_at": datetime}.
+    The TTL index removes expired documents; get() also checks expires_at because the
+    TTL monitor only runs about once a minute.
+    """
+    COLLECTION = "sessions"
+
+    INDEXES = {
+        COLLECTION: [
+            IndexSpec("expires_at", expire_after_seconds=0),
+        ],
+    }
+
+    def __init__(self, dao=None, ttl=SESSION_TTL_SECONDS):
+        super().__init__(ttl)
+        if dao is None:
+            from .async_mongo_dao import async_mongo_dao
+            dao = async_mongo_dao
+        self.dao = dao
+
+    async def get(self, session_id):
+        document = await self.dao.find_one(
+            self.COLLECTION,
+            {"_id": session_id, "expires_at": {"$gt": datetime.utcnow()}},
+            projection={"data": 1}
+        )
+        return document["data"] if document else None
+
+    async def set(self, session_id, data, ttl=None):
+        expires_at = datetime.utcnow() + timedelta(seconds=ttl or self.ttl)
+        await self.dao.update_one(
+            self.COLLECTION,
+            {"_id": session_id},
+            {"$set": {"data": data, "expires_at": expires_at}},
+            upsert=True
+        )
+
+    async def delete(self, session_id):
+        await self.dao.delete(self.COLLECTION, "_id", session_id)
+
+
+class RedisSessionStore(SessionStore):
+    """
+    Redis protocol backend, values are stored as JSON with SET ... EX.
+    :param client: a redis.asyncio compatible client; built from REDIS_URL when omitted
+    """
+    def __init__(self, client=None, url=REDIS_URL, ttl=SESSION_TTL_SECONDS, prefix="session:"):
+        super().__init__(ttl)
+        if client is None:
+            # redis只在选择该后端时才需要安装
+            import redis.asyncio as redis
+            client = redis.from_url(url)
+        self.client = client
+        self.prefix = prefix
+
+    async def get(self, session_id):
+        value = await self.client.get(self.prefix + session_id)
+        return json.loads(value) if value else None
+
+    async def set(self, session_id, data, ttl=None):
+        await self.client.set(self.prefix + session_id, json.dumps(data), ex=ttl or self.ttl)
+
+    async def delete(self, session_id):
+        await self.client.delete(self.prefix + session_id)
+
+
+def create_session_store(backend=None):
+    """
+    build the store selected by SESSION_BACKEND
+    """
+    backend = (backend or SESSION_BACKEND).lower()
+    if backend == "memory":
+        return MemorySessionStore()
+    if backend == "mongo":
+        return MongoSessionStore()
+    if backend == "redis":
+        return RedisSessionStore()
+    raise ValueError(f"未知的会话存储后端: {backend}")
+
+
+# 每个进程首次使用时创建
+session_store = LazyInstance(create_session_store)
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+无状态会话令牌：会话数据和过期时间直接放在Cookie里，用SECRET_KEY做HMAC-SHA256签名。
+验证只需要密钥，不需要查询会话存储或数据库。
+
+令牌格式: base64url(JSON负载).base64url(签名)，负载为 {"data": {...}, "exp": 过期时间戳}
+"""
+
+import hmac
+import json
+import time
+import base64
+import hashlib
+
+
+def _b64encode(raw):
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _signature(payload, secret):
+    if not secret:
+        raise ValueError("会话令牌需要配置SECRET_KEY")
+    return hmac.new(secret.encode("utf-8"), payload.encode("ascii"), hashlib.sha256).digest()
+
+
+def sign_session_token(data, secret, ttl, now=None):
+    """
+    :param data: JSON serialisable session data
+    :param secret: signing key (SECRET_KEY)
+    :param ttl: lifetime in seconds
+    :return: token string suitable for a cookie value
+    """
+    expires_at = int((now or time.time()) + ttl)
+    payload = _b64encode(json.dumps({"data": data, "exp": expires_at}, separators=(",", ":")).encode("utf-8"))
+    return f"{payload}.{_b64encode(_signature(payload, secret))}"
+
+
+def verify_session_token(token, secret, now=None):
+    """
+    :return: the session data, or None if the token is malformed, tampered with or expired
+    """
+    try:
+        payload, signature = token.split(".")
+        if not hmac.compare_digest(_b64decode(signature), _signature(payload, secret)):
+            return None
+        claims = json.loads(_b64decode(payload))
+    except ValueError:
+        return None
+    if claims.get("exp", 0) <= (now or time.time()):
+        return None
+    return claims.get("data")
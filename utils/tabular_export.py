@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+表格数据流式导出
+
+行来自异步迭代器，按块编码为CSV或Parquet并逐块返回，导出整年数据时内存中也只有一块。
+Parquet需要安装pyarrow（pip install pyarrow），未安装时只能导出CSV。
+"""
+
+import io
+import csv
+
+try:
+    import pyarrow
+    import pyarrow.parquet as pq
+except ImportError:
+    pyarrow = None
+
+EXPORT_CONTENT_TYPES = {"csv": "text/csv", "parquet": "application/vnd.apache.parquet"}
+EXPORT_CHUNK_ROWS = 5000
+
+
+def export_formats():
+    return ("csv", "parquet") if pyarrow is not None else ("csv",)
+
+
+async def _chunks(rows, chunk_rows):
+    chunk = []
+    async for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_rows:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+async def csv_stream(rows, columns, chunk_rows=EXPORT_CHUNK_ROWS):
+    """
+    :param rows: async iterable of dicts
+    :param columns: list of (name, type); only the names are used
+    :return: async generator of UTF-8 bytes, starting with a BOM so Excel detects the encoding
+    """
+    names = [name for name, _ in columns]
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=names, extrasaction="ignore")
+    writer.writeheader()
+    yield ("﻿" + buffer.getvalue()).encode("utf-8")
+    async for chunk in _chunks(rows, chunk_rows):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(chunk)
+        yield buffer.getvalue().encode("utf-8")
+
+
+class _DrainableSink(io.RawIOBase):
+    """
+    write-only file collecting what the parquet writer produced since the last drain
+    """
+    def __init__(self):
+        self._parts = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b"".join(self._parts)
+        self._parts = []
+        return data
+
+
+_ARROW_TYPES = {"string": "string", "float": "float64", "int": "int64"}
+
+
+async def parquet_stream(rows, columns, chunk_rows=EXPORT_CHUNK_ROWS):
+    """
+    each chunk becomes one row group
+    :param columns: list of (name, type) with type in "string", "float", "int"
+    :raise RuntimeError: pyarrow is not installed
+    """
+    if pyarrow is None:
+        raise RuntimeError("未安装pyarrow，无法导出Parquet")
+    schema = pyarrow.schema([(name, _ARROW_TYPES[kind]) for name, kind in columns])
+    sink = _DrainableSink()
+    writer = pq.ParquetWriter(sink, schema)
+    try:
+        async for chunk in _chunks(rows, chunk_rows):
+            writer.write_table(pyarrow.Table.from_pylist(chunk, schema=schema))
+            data = sink.drain()
+            if data:
+                yield data
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def export_stream(format, rows, columns, chunk_rows=EXPORT_CHUNK_ROWS):
+    """
+    :param format: "csv" or "parquet"
+    :return: async generator of bytes
+    """
+    if format == "parquet":
+        return parquet_stream(rows, columns, chunk_rows)
+    return csv_stream(rows, columns, chunk_rows)
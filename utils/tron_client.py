@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+TRON链上USDT(TRC20)转账查询
+
+支付监听只需要"某个地址在某个时间之后收到的USDT转账"，这里把它抽象成链客户端：
+TronGrid（默认，HTTP接口，只返回已确认的交易）和内存中的假客户端（本地开发、测试）。
+客户端方法都是同步的，由调用方放到线程池中执行。
+
+    TRON_CHAIN_CLIENT=trongrid                            # trongrid / fake
+    TRONGRID_URL=https://api.trongrid.io                  # 测试网如 https://api.shasta.trongrid.io
+    TRONGRID_API_KEY=                                     # TronGrid API Key（可选，无Key时有较低的频率限制）
+    USDT_CONTRACT=TR7NHqjeKQxGTCi8q8ZY4pL8otSzgjLj6t      # USDT(TRC20)合约地址
+"""
+
+import os
+import json
+import threading
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+from .lazy_instance import LazyInstance
+
+TRON_CHAIN_CLIENT = os.getenv('TRON_CHAIN_CLIENT', 'trongrid')
+TRONGRID_URL = os.getenv('TRONGRID_URL', 'https://api.trongrid.io')
+TRONGRID_API_KEY = os.getenv('TRONGRID_API_KEY', '')
+USDT_CONTRACT = os.getenv('USDT_CONTRACT', 'TR7NHqjeKQxGTCi8q8ZY4pL8otSzgjLj6t')
+
+# USDT精度为6位小数，链上金额以最小单位（sun）表示
+USDT_DECIMALS = 6
+
+
+def usdt_to_sun(amount_usdt):
+    """
+    :return: integer amount in the smallest unit, rounded (0.29 * 10**6 is 289999.99...)
+    """
+    return int(round(float(amount_usdt) * 10 ** USDT_DECIMALS))
+
+
+def transfer(tx_hash, from_address, to_address, amount_sun, timestamp):
+    """
+    one incoming transfer as returned by the chain clients
+    :param timestamp: block timestamp in milliseconds
+    """
+    return {"tx_hash": tx_hash, "from": from_address, "to": to_address,
+            "amount_sun": int(amount_sun), "timestamp": int(timestamp)}
+
+
+class ChainClient:
+    def incoming_transfers(self, address, since_ms, limit=1000):
+        """
+        confirmed USDT transfers to address with block timestamp >= since_ms
+        :param limit: stop after this many transfers; the caller continues from the last timestamp
+        :return: list of transfer dicts in ascending timestamp order
+        """
+        raise NotImplementedError
+
+    def usdt_balance(self, address):
+        """
+        :return: USDT balance of address, in USDT
+        """
+        raise NotImplementedError
+
+
+class TronGridClient(ChainClient):
+    """
+    :param base_url: TronGrid endpoint
+    :param api_key: sent as TRON-PRO-API-KEY when set
+    :param contract: TRC20 contract of the token to watch
+    :param page_size: transfers per request, at most 200
+    """
+    def __init__(self, base_url=TRONGRID_URL, api_key=TRONGRID_API_KEY, contract=USDT_CONTRACT,
+                 page_size=200, timeout=10):
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.contract = contract
+        self.page_size = min(page_size, 200)
+        self.timeout = timeout
+        self.request_count = 0
+
+    def _get(self, path, params):
+        headers = {"Accept": "application/json"}
+        if self.api_key:
+            headers["TRON-PRO-API-KEY"] = self.api_key
+        request = Request(f"{self.base_url}{path}?{urlencode(params)}", headers=headers)
+        self.request_count += 1
+        with urlopen(request, timeout=self.timeout) as response:
+            data = json.loads(response.read())
+        if not data.get("success", True):
+            raise ValueError(f"TronGrid请求失败: {data.get('error')}")
+        return data
+
+    def incoming_transfers(self, address, since_ms, limit=1000):
+        params = {
+            "only_to": "true",
+            "only_confirmed": "true",
+            "contract_address": self.contract,
+            "min_timestamp": int(since_ms),
+            "order_by": "block_timestamp,asc",
+            "limit": self.page_size,
+        }
+        transfers = []
+        while len(transfers) < limit:
+            data = self._get(f"/v1/accounts/{address}/transactions/trc20", params)
+            for item in data.get("data", []):
+                if item.get("type") != "Transfer" or item.get("to") != address:
+                    continue
+                transfers.append(transfer(item["transaction_id"], item.get("from"), item["to"],
+                                          item["value"], item["block_timestamp"]))
+            fingerprint = data.get("meta", {}).get("fingerprint")
+            if not fingerprint:
+                break
+            params["fingerprint"] = fingerprint
+        return transfers[:limit]
+
+    def usdt_balance(self, address):
+        data = self._get(f"/v1/accounts/{address}", {"only_confirmed": "true"})
+        for account in data.get("data", []):
+            for token in account.get("trc20", []):
+                if self.contract in token:
+                    return int(token[self.contract]) / 10 ** USDT_DECIMALS
+        return 0.0
+
+
+class FakeChainClient(ChainClient):
+    """
+    in-memory chain for local development and tests; add_transfer() simulates a wallet payment
+    """
+    def __init__(self):
+        self.transfers = []
+        self.request_count = 0
+        self._lock = threading.Lock()
+
+    def add_transfer(self, to_address, amount_usdt, timestamp, tx_hash=None, from_address="TFakeSender"):
+        """
+        :param timestamp: block timestamp in milliseconds
+        """
+        with self._lock:
+            tx_hash = tx_hash or f"fake{len(self.transfers):060x}"
+            self.transfers.append(transfer(tx_hash, from_address, to_address, usdt_to_sun(amount_usdt), timestamp))
+            self.transfers.sort(key=lambda item: item["timestamp"])
+        return tx_hash
+
+    def incoming_transfers(self, address, since_ms, limit=1000):
+        with self._lock:
+            self.request_count += 1
+            return [dict(item) for item in self.transfers
+                    if item["to"] == address and item["timestamp"] >= since_ms][:limit]
+
+    def usdt_balance(self, address):
+        with self._lock:
+            return sum(item["amount_sun"] for item in self.transfers
+                       if item["to"] == address) / 10 ** USDT_DECIMALS
+
+
+def create_chain_client():
+    if TRON_CHAIN_CLIENT == "fake":
+        return FakeChainClient()
+    if TRON_CHAIN_CLIENT != "trongrid":
+        raise ValueError(f"未知的链客户端: {TRON_CHAIN_CLIENT}")
+    return TronGridClient()
+
+
+chain_client = LazyInstance(create_chain_client)
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+附件上传
+
+请求体在接收过程中按字节计数，超过单次请求上限立即返回413，不必等整个请求体收完。
+每个文件在线程池中分块复制到暂存文件并同时计算SHA-256，超过单文件上限即中止；
+全部文件都通过限制后才交给附件存储（utils.blob_store，相同内容只存一份）。
+多个文件并行处理，不会整个读入内存，也不阻塞事件循环。
+
+    UPLOAD_DIR=uploads                   # 旧版附件目录（uploads/{时间}_{随机}.{扩展名}），迁移脚本使用
+    UPLOAD_MAX_FILE_BYTES=52428800       # 单个文件上限，默认50MB
+    UPLOAD_MAX_REQUEST_BYTES=209715200   # 单次请求上限，默认200MB
+    UPLOAD_MAX_FILES=10                  # 单次请求的文件数量上限
+"""
+
+import os
+import uuid
+import asyncio
+import hashlib
+import mimetypes
+import threading
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+
+UPLOAD_DIR = os.getenv('UPLOAD_DIR', 'uploads')
+UPLOAD_MAX_FILE_BYTES = int(os.getenv('UPLOAD_MAX_FILE_BYTES', 50 * 1024 * 1024))
+UPLOAD_MAX_REQUEST_BYTES = int(os.getenv('UPLOAD_MAX_REQUEST_BYTES', 200 * 1024 * 1024))
+UPLOAD_MAX_FILES = int(os.getenv('UPLOAD_MAX_FILES', 10))
+UPLOAD_CHUNK_BYTES = int(os.getenv('UPLOAD_CHUNK_BYTES', 1024 * 1024))
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class UploadBudget:
+    """
+    byte budget shared by the files of one request, safe to consume from several threads
+    """
+    def __init__(self, max_bytes):
+        self.remaining = max_bytes
+        self._lock = threading.Lock()
+
+    def consume(self, size):
+        with self._lock:
+            if size > self.remaining:
+                raise UploadTooLarge("上传文件总大小超出限制")
+            self.remaining -= size
+
+
+def format_size(size):
+    if size >= 1024 * 1024:
+        return f"{size / (1024 * 1024):g}MB"
+    return f"{size / 1024:g}KB"
+
+
+def copy_to_file(source, path, max_bytes=UPLOAD_MAX_FILE_BYTES, budget=None, chunk_size=UPLOAD_CHUNK_BYTES):
+    """
+    blocking chunked copy of a file object into path via a temp file in the same directory
+    :raise UploadTooLarge: the file exceeds max_bytes or the request budget; nothing is left on disk
+    :return: (number of bytes written, sha256 hex digest)
+    """
+    temp_path = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.{uuid.uuid4().hex[:8]}.part")
+    written = 0
+    digest = hashlib.sha256()
+    try:
+        with open(temp_path, "wb") as target:
+            while True:
+                chunk = source.read(chunk_size)
+                if not chunk:
+                    break
+                written += len(chunk)
+                if written > max_bytes:
+                    raise UploadTooLarge(f"单个文件不能超过 {format_size(max_bytes)}")
+                if budget is not None:
+                    budget.consume(len(chunk))
+                digest.update(chunk)
+                target.write(chunk)
+        os.replace(temp_path, path)
+        return written, digest.hexdigest()
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+async def stage_upload(file, store, max_bytes=UPLOAD_MAX_FILE_BYTES, budget=None):
+    """
+    copy an UploadFile into a staging file of the blob store
+    :return: dict with "staging_path", "id" (sha256), "size", "filename", "content_type"
+    """
+    staging_path = store.staging_path()
+    await file.seek(0)
+    try:
+        size, blob_id = await run_in_threadpool(copy_to_file, file.file, staging_path, max_bytes, budget)
+    except BaseException:
+        if os.path.exists(staging_path):
+            os.remove(staging_path)
+        raise
+    return {
+        "staging_path": staging_path,
+        "id": blob_id,
+        "size": size,
+        "filename": file.filename,
+        "content_type": file.content_type or mimetypes.guess_type(file.filename)[0] or "application/octet-stream",
+    }
+
+
+async def save_uploads(files, store, max_file_bytes=UPLOAD_MAX_FILE_BYTES,
+                       max_request_bytes=UPLOAD_MAX_REQUEST_BYTES, max_files=UPLOAD_MAX_FILES):
+    """
+    stage every named file in parallel, then put them into the blob store
+    :param store: utils.blob_store.BlobStore
+    :return: list of dicts ("id", "size", "filename", "content_type", "created") in upload order;
+             files failing for other reasons are logged and skipped
+    :raise UploadTooLarge: a limit was exceeded; nothing is stored
+    """
+    files = [file for file in files if file.filename]
+    if len(files) > max_files:
+        raise UploadTooLarge(f"最多上传 {max_files} 个文件")
+
+    budget = UploadBudget(max_request_bytes)
+    results = await asyncio.gather(
+        *[stage_upload(file, store, max_file_bytes, budget) for file in files],
+        return_exceptions=True
+    )
+
+    staged = []
+    too_large = None
+    for file, result in zip(files, results):
+        if isinstance(result, UploadTooLarge):
+            too_large = too_large or result
+        elif isinstance(result, BaseException):
+            # 即使文件上传失败，也继续处理其他文件
+            print(f"文件上传失败: {file.filename}, 错误: {result}")
+        else:
+            staged.append(result)
+
+    if too_large:
+        for blob in staged:
+            os.remove(blob["staging_path"])
+        raise too_large
+
+    for blob in staged:
+        blob["created"] = await store.put(blob.pop("staging_path"), blob["id"])
+        print(f"文件上传成功: {blob['filename']} -> {blob['id']}{'' if blob['created'] else '（内容已存在）'}")
+    return staged
+
+
+class RequestSizeLimitMiddleware:
+    """
+    ASGI middleware rejecting request bodies above max_bytes with 413: up front from Content-Length,
+    otherwise as soon as the streamed body crosses the limit
+    """
+    def __init__(self, app, max_bytes=UPLOAD_MAX_REQUEST_BYTES):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length and content_length.isdigit() and int(content_length) > self.max_bytes:
+            return await self._reject(send)
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    raise HTTPException(status_code=413, detail="请求体过大")
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+    @staticmethod
+    async def _reject(send):
+        body = '{"detail":"请求体过大"}'.encode("utf-8")
+        await send({"type": "http.response.start", "status": 413, "headers": [
+            (b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()),
+        ]})
+        await send({"type": "http.response.body", "body": body})